@@ -0,0 +1,329 @@
+"""Worker agent: runs queued jobs on this host, alongside the API's executor.
+
+Jobs with ``runs_on`` labels in their schedule are left in the queue by the
+API for agents offering all of those labels. Start one or more per host:
+
+    python agent.py --label linux --label gpu --max-runs 4
+
+Agents share the API's database and read the same targets.yaml, with each
+target's repo checked out at its repo_path on this host (``main.py --pull``).
+Output goes to the API's log store: directly when LOGS_DIR is shared
+(e.g. on the same host), otherwise streamed to ``--api-url``, authenticated
+as SCHEDULER_AGENT_USER / SCHEDULER_AGENT_PASSWORD from the environment; that
+user must be in the ``agents`` group in users.yaml.
+"""
+
+import argparse
+import asyncio
+import base64
+import http.client
+import logging
+import os
+import signal
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+from sqlmodel import Session
+
+import runlogs
+from catalog import SCRIPT_DIR, Catalog, CatalogLoader, build_wrapper_command
+from db import CatalogVersion, engine, init_db
+from executor import (
+    Dispatcher, OutputTail, PendingRun, QueueConsumer, RunLimits, resource_usage, run_command, run_outcome
+)
+from watcher import VersionWatcher
+from workers import DEFAULT_LEASE_SECONDS, WorkerQueue, can_run
+
+logger = logging.getLogger(__name__)
+
+TARGETS_FILE = SCRIPT_DIR / "targets.yaml"
+DEFAULT_MAX_RUNS = 4
+DEFAULT_POLL_INTERVAL = 1.0
+SHIP_INTERVAL = 1.0
+SHIP_TIMEOUT = 30
+SHIP_RETRIES = 5
+
+
+class LogShipper:
+    """Append a run's output to its log in the API as the local copy grows.
+
+    Each POST carries the byte offset it starts at, so a retried chunk is
+    never written twice. A 409 means the run is no longer this worker's.
+    """
+
+    def __init__(self, api_url: str, worker_id: str, run_id: str, log_file: Path):
+        parts = urlsplit(api_url)
+        self._cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._path = f"{parts.path.rstrip('/')}/api/runs/{run_id}/logs"
+        self._worker_id = worker_id
+        self._log_file = log_file
+        credentials = f"{os.environ.get('SCHEDULER_AGENT_USER', '')}:{os.environ.get('SCHEDULER_AGENT_PASSWORD', '')}"
+        self._auth = "Basic " + base64.b64encode(credentials.encode()).decode()
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self.offset = 0
+        self.rejected = False
+
+    def ship(self) -> bool:
+        """Send whatever was written since the last call; returns False if it could not."""
+        if self.rejected or not self._log_file.exists():
+            return not self.rejected
+        with open(self._log_file, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        if not data:
+            return True
+        query = urlencode({"offset": self.offset, "worker_id": self._worker_id})
+        try:
+            if self._conn is None:
+                self._conn = self._cls(self._netloc, timeout=SHIP_TIMEOUT)
+            self._conn.request("POST", f"{self._path}?{query}", body=data, headers={
+                "Authorization": self._auth,
+                "Content-Type": "application/octet-stream",
+            })
+            response = self._conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            logger.warning("Shipping log of %s failed: %s", self._path, e)
+            self.close()
+            return False
+        if response.status == 409:
+            self.rejected = True
+            return False
+        if response.status >= 400:
+            logger.warning("Shipping log of %s failed: HTTP %d", self._path, response.status)
+            return False
+        self.offset += len(data)
+        return True
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class Agent:
+    """Claim runs this host may execute and run them through a local Dispatcher.
+
+    The QueueConsumer that feeds the API's executor from the queue is reused
+    with ``WorkerQueue.claim`` as its source, so per-job and per-target
+    limits hold within each agent. A heartbeat thread renews the leases on
+    claimed runs; runs whose lease was lost are killed without recording a
+    result, since another agent owns them now.
+    """
+
+    def __init__(
+        self,
+        labels: list[str],
+        targets: Optional[list[str]] = None,
+        max_runs: int = DEFAULT_MAX_RUNS,
+        api_url: Optional[str] = None,
+        targets_file: Path = TARGETS_FILE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        self.loader = CatalogLoader(targets_file)
+        self.catalog = Catalog([])
+        self.catalog_version = 0
+        self.api_url = api_url
+        self.labels = labels
+        self.targets = targets
+        self.queue = WorkerQueue(labels, targets, max_runs)
+        self.dispatcher = Dispatcher(self._execute, max_workers=max_runs, max_queue=max_runs)
+        self.consumer = QueueConsumer(self.dispatcher, self._claim, poll_interval, cancel=self._apply_cancellations)
+        self.version_watcher = VersionWatcher(self._shared_version, lambda: self.catalog_version, self.reload)
+        self._spool = Path(tempfile.mkdtemp(prefix="scheduler-agent-")) if api_url else None
+        self._job_ids: list[str] = []
+        self._draining = False
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def reload(self):
+        catalog = self.loader.load()
+        version = self._shared_version()
+        self.catalog = catalog
+        self.catalog_version = version
+        self._job_ids = [job["job_id"] for job in catalog if can_run(job, self.labels, self.targets)]
+        self.queue.lease_seconds = catalog.config.get("workers", {}).get("lease_seconds", DEFAULT_LEASE_SECONDS)
+        logger.info("Catalog loaded: this agent can run %d job(s)", len(self._job_ids))
+
+    def _shared_version(self) -> int:
+        with Session(engine) as session:
+            shared = session.get(CatalogVersion, 1)
+            return shared.version if shared else 0
+
+    def start(self):
+        init_db()
+        self.reload()
+        self.queue.register()
+        logger.info("Worker %s started (labels=%s, targets=%s)", self.queue.worker_id, self.labels, self.targets or "any")
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True)
+        self._heartbeat.start()
+        self.version_watcher.start()
+        self.consumer.start()
+
+    def drain(self):
+        """Stop claiming runs; the ones already claimed carry on."""
+        self._draining = True
+
+    def abandon(self):
+        """Hand every unfinished run back to the queue and kill its processes."""
+        self._draining = True
+        run_ids = self.dispatcher.run_ids()
+        released = self.queue.release(run_ids)
+        for run_id in run_ids:
+            self.dispatcher.cancel(run_id, "agent shutdown")
+        if released:
+            logger.warning("Requeued %d unfinished run(s)", released)
+
+    def stop(self):
+        self.consumer.stop()
+        self.version_watcher.stop()
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        self.queue.deregister()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                lost = self.queue.heartbeat(self.dispatcher.run_ids())
+            except Exception:
+                logger.exception("Heartbeat failed")
+                continue
+            for run_id in lost:
+                logger.warning("Lost the lease on run %s; stopping it", run_id)
+                self.dispatcher.cancel(run_id, "lease lost")
+
+    def _claim(self, exclude: set[str], limit: int) -> list[PendingRun]:
+        if self._draining:
+            return []
+        catalog = self.catalog
+        # The dispatcher's queue holds claimed runs that are waiting on a
+        # per-job limit; only claim what can start.
+        limit = min(limit, self.dispatcher.max_workers - len(exclude))
+        doppler = catalog.config.get("doppler", {})
+        runs = []
+        for row in self.queue.claim(self._job_ids, exclude, limit):
+            job = catalog.by_id.get(row.job_id)
+            if job is None:
+                self.queue.release([row.run_id])
+                continue
+            runs.append(PendingRun(
+                row.run_id, job, build_wrapper_command(job, doppler), row.triggered_by,
+                queued_at=row.queued_at or row.started_at, parent_run_id=row.parent_run_id,
+            ))
+        return runs
+
+    def _apply_cancellations(self):
+        for run_id, job_id, cancelled_by in self.queue.cancellations():
+            if self.dispatcher.cancel(run_id, cancelled_by) != "queued":
+                continue  # _execute records the outcome once the process is gone
+            now = datetime.utcnow()
+            self.queue.finish(
+                run_id, job_id, now.date(),
+                status="cancelled", finished_at=now, error_message=f"Cancelled by {cancelled_by}",
+            )
+
+    async def _execute(self, run: PendingRun):
+        run_id, job = run.run_id, run.job
+        started_at = datetime.utcnow()
+        if not await asyncio.to_thread(
+            self.queue.start,
+            run_id,
+            started_at=started_at,
+            queue_wait_ms=int((started_at - run.queued_at).total_seconds() * 1000),
+        ):
+            logger.warning("Run %s was taken back before it started", run_id)
+            return
+        log_file = self._spool / f"{run_id}.log" if self._spool else runlogs.log_path(run_id)
+        shipper = LogShipper(self.api_url, self.queue.worker_id, run_id, log_file) if self.api_url else None
+        tail = OutputTail()
+        limits = RunLimits.from_job(job)
+        fields = {}
+        try:
+            task = asyncio.create_task(
+                run_command(run.cmd, log_file, tail, {"SCHEDULER_RUN_ID": run_id}, limits, run.cancel)
+            )
+            while shipper is not None and not task.done():
+                await asyncio.wait({task}, timeout=SHIP_INTERVAL)
+                await asyncio.to_thread(shipper.ship)
+            result = await task
+            run_status, error_message = run_outcome(result, tail, limits, run.cancelled_by)
+            fields = {
+                "status": run_status,
+                "exit_code": result.returncode,
+                "error_message": error_message,
+                **resource_usage(result.rusage),
+            }
+        except Exception as e:
+            fields = {"status": "failed", "exit_code": -1, "error_message": str(e)}
+        finally:
+            if shipper is not None:
+                for _ in range(SHIP_RETRIES):
+                    if await asyncio.to_thread(shipper.ship) or shipper.rejected:
+                        break
+                    await asyncio.sleep(SHIP_INTERVAL)
+                shipper.close()
+
+        finished_at = datetime.utcnow()
+        if log_file.exists():
+            fields["log_bytes"] = log_file.stat().st_size
+            if shipper is not None:
+                log_file.unlink()
+        recorded = await asyncio.to_thread(
+            self.queue.finish,
+            run_id,
+            job["job_id"],
+            started_at.date(),
+            finished_at=finished_at,
+            duration_ms=int((finished_at - started_at).total_seconds() * 1000),
+            **fields,
+        )
+        if recorded:
+            logger.info("Run %s (%s) %s", run_id, job["job_id"], fields["status"])
+        else:
+            logger.warning("Run %s (%s) was taken over by another worker; result dropped", run_id, job["job_id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued jobs on this host as a worker agent")
+    parser.add_argument("--label", "-l", action="append", default=[], help="Label jobs can ask for with runs_on (repeatable)")
+    parser.add_argument("--target", "-t", action="append", default=[], help="Only run jobs of this target (repeatable)")
+    parser.add_argument("--max-runs", "-j", type=int, default=DEFAULT_MAX_RUNS, help="Runs executing at once")
+    parser.add_argument("--api-url", help="Stream run output to this API instead of writing LOGS_DIR directly")
+    parser.add_argument("--targets-file", type=Path, default=TARGETS_FILE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    agent = Agent(args.label, args.target or None, args.max_runs, args.api_url, args.targets_file)
+    stopping = threading.Event()
+
+    def on_signal(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    agent.start()
+    stopping.wait()
+
+    # First signal: finish what is running. Second: requeue it and exit.
+    logger.info("Draining %d run(s); signal again to requeue them and exit", len(agent.dispatcher.run_ids()))
+    agent.drain()
+    stopping.clear()
+    while agent.dispatcher.run_ids() and not stopping.wait(1.0):
+        pass
+    if agent.dispatcher.run_ids():
+        agent.abandon()
+        while agent.dispatcher.run_ids():
+            stopping.wait(1.0)
+    agent.stop()
+
+
+if __name__ == "__main__":
+    main()
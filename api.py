@@ -1,24 +1,55 @@
 """FastAPI webhook trigger service for monorepo-scheduler jobs."""
 
+import asyncio
+import base64
 from contextlib import asynccontextmanager
+import json
 import logging
-import secrets
-import subprocess
-from typing import Optional
+from typing import Callable, Optional
 
-import bcrypt
-import yaml
-import uuid
 import threading
-from datetime import datetime
-from fastapi import APIRouter, APIRouter, Depends, FastAPI, HTTPException, status
-from fastapi.responses import FileResponse
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from fastapi import APIRouter, APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from sqlmodel import Field, Session, SQLModel, create_engine, select
+from sqlalchemy import update
+from sqlmodel import Session, and_, func, or_, select
 
-from catalog import build_wrapper_command, load_catalog
+from auth import UserStore
+from catalog import Catalog, CatalogDiff, CatalogLoader, build_wrapper_command
+from db import CatalogVersion, JobRun, PipelineRun, Worker, engine, get_session, init_db, run_changes
+from executor import (
+    DEFAULT_MAX_QUEUE,
+    Dispatcher,
+    OutputTail,
+    PendingRun,
+    QueueConsumer,
+    QueueFull,
+    RunLimits,
+    resource_usage,
+    run_command,
+    run_outcome,
+)
+from cronruns import CronRunIngester
+from hcrelay import PingRelay
+from httpcache import DEFAULT_TTL, ResponseCache, etag_matches, make_etag
+from leader import Leadership
+from logindex import InvalidQuery, LogIndex
+from pipelines import DEFAULT_MAX_PARALLEL, InvalidPipeline, Pipelines, plan
+from runstore import RunStore
+from schemas import InvalidFields, JobDetail, JobOut, RunOut, encode, parse_fields
+from secretcache import SecretCache
+import metrics
+import stats
+from scheduler import Scheduler
+from watcher import CatalogWatcher, VersionWatcher
+from workers import DEFAULT_LEASE_SECONDS, LeaseMonitor
+import runlogs
 
 logger = logging.getLogger(__name__)
 
@@ -26,71 +57,110 @@ USERS_FILE = Path(__file__).resolve().parent / "users.yaml"
 TARGETS_FILE = Path(__file__).resolve().parent / "targets.yaml"
 FRONTEND_DIST = Path(__file__).resolve().parent / "frontend" / "dist"
 
-LOGS_DIR = Path("/var/lib/monorepo-scheduler/logs")
-LOGS_DIR.mkdir(parents=True, exist_ok=True)
-
-DATABASE_URL = "sqlite:///./runs.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-
-# SQLModel models
-class JobRun(SQLModel, table=True):
-    run_id: str = Field(primary_key=True)
-    job_id: str
-    target_name: str
-    status: str  # running, success, failed
-    triggered_by: str
-    started_at: datetime
-    finished_at: Optional[datetime] = None
-    exit_code: Optional[int] = None
-    error_message: Optional[str] = None
-    duration_ms: Optional[int] = None
-
-def get_session():
-    with Session(engine) as session:
-        yield session
+RUNS_PAGE_DEFAULT = 100
+RUNS_PAGE_MAX = 1000
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+INDEX_BACKFILL_DAYS = 1
+# Users in this group may act for worker agents (see agent.py).
+AGENT_GROUP = "agents"
+# Users in this group may use the debug endpoints.
+ADMIN_GROUP = "admin"
+# Where the worker processes share metrics and profiler settings.
+METRICS_DIR = Path("./metrics.d")
 
-# Loaded at startup, refreshable via /catalog/reload
-_job_catalog: list[dict] = []
-_config: dict = {}
+# Loaded at startup and reloaded by /catalog/reload or the file watcher.
+# Always replaced as a whole (never mutated), so a request that reads
+# _catalog once sees a consistent set of jobs, indexes and config.
+_catalog: Catalog = Catalog([])
+_catalog_version = 0  # the CatalogVersion.version _catalog corresponds to
+_catalog_loader: Optional[CatalogLoader] = None
+_catalog_watcher: Optional[CatalogWatcher] = None
+_version_watcher: Optional[VersionWatcher] = None
+_reload_lock = threading.Lock()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _job_catalog, _config
-    # Create database tables
-    SQLModel.metadata.create_all(engine)
+    global _catalog_loader, _catalog_watcher, _version_watcher
+    # Create database tables and indexes
+    init_db()
+    _shared_metrics.start()
     
     logger.info("Loading job catalog from %s", TARGETS_FILE)
-    _job_catalog, _config = load_catalog(TARGETS_FILE)
-    logger.info("Catalog loaded: %d job(s) found", len(_job_catalog))
-    for job in _job_catalog:
+    _catalog_loader = CatalogLoader(TARGETS_FILE)
+    _reload_catalog()
+    logger.info("Catalog loaded: %d job(s) found", len(_catalog))
+    for job in _catalog:
         logger.info("  Job: %s (target=%s)", job["job_id"], job["target_name"])
+
+    catalog_config = _catalog.config.get("catalog", {})
+    poll_interval = catalog_config.get("poll_interval", 2.0)
+    if catalog_config.get("watch", True):
+        _catalog_watcher = CatalogWatcher(_catalog_loader, _reload_catalog, poll_interval=poll_interval)
+        _catalog_watcher.start()
+    _version_watcher = VersionWatcher(
+        _shared_catalog_version, lambda: _catalog_version, _reload_catalog, poll_interval=poll_interval
+    )
+    _version_watcher.start()
+
+    # With several worker processes, only the elected one executes runs.
+    _leadership.start()
     yield
+    if _catalog_watcher is not None:
+        _catalog_watcher.stop()
+    _version_watcher.stop()
+    _queue_consumer.stop()
+    _lease_monitor.stop()
+    _scheduler.stop()
+    _ping_relay.stop()
+    _secret_cache.stop()
+    _cron_runs.stop()
+    _log_archiver.stop()
+    _log_index.stop()
+    _run_store.stop()
+    _shared_metrics.stop()
+    _leadership.stop()
 
 
 app = FastAPI(title="monorepo-scheduler API", lifespan=lifespan)
 security = HTTPBasic()
 
-router = APIRouter(prefix="/api")   
 
-jobs_router = APIRouter(prefix="/jobs")
-runs_router = APIRouter(prefix="/runs")
+class _ProfiledRoute(APIRoute):
+    """Route whose endpoint can be profiled on demand (see /api/debug/profile)."""
 
-def _load_users() -> list[dict]:
-    if not USERS_FILE.exists():
-        return []
-    with open(USERS_FILE) as f:
-        data = yaml.safe_load(f)
-    return data.get("users", [])
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, metrics.PROFILER.wrap(path, endpoint), **kwargs)
+
+
+router = APIRouter(prefix="/api", route_class=_ProfiledRoute)
+
+jobs_router = APIRouter(prefix="/jobs", route_class=_ProfiledRoute)
+runs_router = APIRouter(prefix="/runs", route_class=_ProfiledRoute)
+pipelines_router = APIRouter(prefix="/pipelines", route_class=_ProfiledRoute)
+
+
+@app.middleware("http")
+async def _record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template so per-run URLs do not create new series.
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+_user_store = UserStore(USERS_FILE)
 
 def _authenticate(credentials: HTTPBasicCredentials = Depends(security)) -> dict:
-    users = _load_users()
-    for user in users:
-        if secrets.compare_digest(credentials.username, user["username"]):
-            if bcrypt.checkpw(
-                credentials.password.encode(), user["password_hash"].encode()
-            ):
-                return {"username": credentials.username, "groups": user.get("groups", [])}
+    user = _user_store.verify(credentials.username, credentials.password)
+    if user is not None:
+        return user
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid credentials",
@@ -98,287 +168,1090 @@ def _authenticate(credentials: HTTPBasicCredentials = Depends(security)) -> dict
     )
 
 
-def _jobs_for_user(user_groups: list[str]) -> list[dict]:
-    """Return jobs the user has access to based on group membership."""
-    group_set = set(user_groups)
-    return [j for j in _job_catalog if group_set & set(j.get("groups", []))]
+def _authenticate_admin(user: dict = Depends(_authenticate)) -> dict:
+    """Require a user in ADMIN_GROUP."""
+    if ADMIN_GROUP not in user["groups"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
+
+
+def _authenticate_agent(user: dict = Depends(_authenticate)) -> dict:
+    """Require a worker agent's credentials (a user in AGENT_GROUP)."""
+    if AGENT_GROUP not in user["groups"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Worker agent credentials required")
+    return user
+
+
+def _get_job_for_user(job_id: str, user: dict, catalog: Optional[Catalog] = None) -> dict:
+    """Return the job if the user has access to it, otherwise raise 404."""
+    job = (catalog or _catalog).get(job_id, user["groups"])
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
 
 
 @router.get("/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "executor": _leadership.is_leader, "catalog_version": _catalog_version}
 
 
-@jobs_router.get("")
-def list_jobs(user: dict = Depends(_authenticate)):
-    return [
-        {
-            "job_id": j["job_id"],
-            "target_name": j["target_name"],
-            "cron": j["cron"],
-        }
-        for j in _jobs_for_user(user["groups"])
-    ]
+_response_cache = ResponseCache()
+_shared_metrics = metrics.SharedMetrics(METRICS_DIR)
 
-@jobs_router.get("/{job_id}")
-def get_job(job_id: str, user: dict = Depends(_authenticate)):
-    accessible = _jobs_for_user(user["groups"])
-    job = next((j for j in accessible if j["job_id"] == job_id), None)
-    if job is None:
-        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
-    return {
-        "job_id": job["job_id"],
-        "target_name": job["target_name"],
-        "cron": job["cron"],
-        "groups": job.get("groups", []),
-    }
 
-def _execute_job(run_id: str, job: dict, cmd: str, triggered_by: str):
-    log_file = LOGS_DIR / f"{run_id}.log"
-    
-    started_at = datetime.utcnow()
-    
-    # Create initial run record
-    with Session(engine) as session:
-        job_run = JobRun(
-            run_id=run_id,
-            job_id=job["job_id"],
-            target_name=job["target_name"],
-            status="running",
-            triggered_by=triggered_by,
-            started_at=started_at
-        )
-        session.add(job_run)
-        session.commit()
+def _cached_json(
+    request: Request,
+    user: dict,
+    model: type,
+    fields: Optional[str],
+    build: Callable[[dict], object],
+    runs: bool = True,
+) -> Response:
+    """Serve a polled GET as ``model`` JSON with an ETag.
+
+    The ETag comes from the catalog version, the shared run change sequence
+    (unless ``runs`` is False) and the user and URL, so If-None-Match is
+    answered with 304 before the database is touched. Otherwise the body
+    is served from _response_cache or made by ``build(headers)``, which may
+    add response headers. ``fields`` is a comma-separated projection.
+    """
+    try:
+        projection = parse_fields(fields, model)
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Read the version before build() reads _catalog, so a reload in between
+    # can only make the body newer than its tag, never older.
+    catalog_version = _catalog_version
+    run_seq = run_changes.value() if runs else None
+    if run_seq is not None:
+        _response_cache.observe(run_seq)
+    key = (user["username"], tuple(sorted(user["groups"])), request.url.path, request.url.query)
+    etag = make_etag(key, catalog_version, run_seq)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.RESPONSE_CACHE.inc(result="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = _response_cache.get(key, etag)
+    if cached is None:
+        metrics.RESPONSE_CACHE.inc(result="miss")
+        extra = {}
+        cached = encode(build(extra), model, projection), extra
+        _response_cache.put(key, etag, *cached)
+    else:
+        metrics.RESPONSE_CACHE.inc(result="hit")
+    body, extra = cached
+    return Response(body, media_type="application/json", headers={**headers, **extra})
+
+
+@jobs_router.get("", response_model=list[JobOut])
+def list_jobs(request: Request, fields: Optional[str] = None, user: dict = Depends(_authenticate)):
+    return _cached_json(
+        request, user, JobOut, fields,
+        lambda headers: [JobOut.from_job(j) for j in _catalog.jobs_for(user["groups"])],
+        runs=False,
+    )
+
+@jobs_router.get("/{job_id}", response_model=JobDetail)
+def get_job(job_id: str, request: Request, fields: Optional[str] = None, user: dict = Depends(_authenticate)):
+    job = _get_job_for_user(job_id, user)
+    return _cached_json(request, user, JobDetail, fields, lambda headers: JobDetail.from_job(job), runs=False)
+
+
+def _run_filters(
+    status: Optional[str] = None,
+    target: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> dict:
+    """Query parameters shared by the run listing endpoints."""
+    return {"status": status, "target": target, "since": since, "until": until}
+
 
+def _encode_cursor(run: JobRun) -> str:
+    raw = f"{run.started_at.isoformat()}|{run.run_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
     try:
-        with open(log_file, "w") as log:
-            process = subprocess.Popen(
-                cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
+        started_at, run_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(started_at), run_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _page_runs(session: Session, statement, headers: dict, filters: dict, cursor: Optional[str], limit: int) -> list[RunOut]:
+    """Apply filters and keyset pagination on (started_at, run_id), newest first.
+
+    When more rows are available the cursor for the next page is returned in
+    the ``X-Next-Cursor`` response header.
+    """
+    if filters["status"]:
+        statement = statement.where(JobRun.status == filters["status"])
+    if filters["target"]:
+        statement = statement.where(JobRun.target_name == filters["target"])
+    if filters["since"]:
+        statement = statement.where(JobRun.started_at >= filters["since"])
+    if filters["until"]:
+        statement = statement.where(JobRun.started_at < filters["until"])
+    if cursor:
+        started_at, run_id = _decode_cursor(cursor)
+        statement = statement.where(
+            or_(
+                JobRun.started_at < started_at,
+                and_(JobRun.started_at == started_at, JobRun.run_id < run_id),
             )
+        )
+
+    statement = statement.order_by(JobRun.started_at.desc(), JobRun.run_id.desc()).limit(limit + 1)
+    runs = session.exec(statement).all()
+
+    if len(runs) > limit:
+        runs = runs[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(runs[-1])
 
-            for line in process.stdout:
-                log.write(line)
-                log.flush()
+    return [RunOut.from_run(run) for run in runs]
 
-            process.wait()
+def _log_params(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    tail: Optional[int] = Query(None, ge=1),
+    follow: bool = False,
+) -> dict:
+    """Query parameters shared by the log endpoints."""
+    return {"offset": offset, "limit": limit, "tail": tail, "follow": follow}
+
+
+def _log_response(request: Request, run: JobRun, params: dict):
+    """Stream a run's log, honouring Range, offset/limit, tail and follow.
+
+    ``follow`` streams the log as server-sent events until the run finishes.
+    Otherwise the selected byte range is streamed as plain text.
+    """
+    log_file = runlogs.find_log(run.run_id, run.started_at)
+    if log_file is None:
+        if not (params["follow"] and run.status == "running"):
+            return PlainTextResponse("No logs available")
+        log_file = runlogs.log_path(run.run_id)
+
+    size = runlogs.log_size(log_file, run.log_bytes) if log_file.exists() else 0
+    if params["tail"] is not None and size:
+        start = runlogs.tail_offset(log_file, params["tail"])
+    else:
+        start = min(params["offset"], size)
+
+    if params["follow"]:
+        run_id = run.run_id
+
+        async def is_running() -> bool:
+            def check():
+                with Session(engine) as session:
+                    current = session.get(JobRun, run_id)
+                    return current is not None and current.status == "running"
+            return await asyncio.to_thread(check)
+
+        return StreamingResponse(
+            runlogs.follow(log_file, start, is_running),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    headers = {"Accept-Ranges": "bytes"}
+    status_code = status.HTTP_200_OK
+    end = size if params["limit"] is None else min(size, start + params["limit"])
+
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = runlogs.parse_range(range_header, size)
+        if byte_range is None:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        runlogs.iter_file(log_file, start, end),
+        status_code=status_code,
+        media_type="text/plain; charset=utf-8",
+        headers=headers,
+    )
+
+
+_run_store = RunStore()
+_ping_relay = PingRelay()
+_secret_cache = SecretCache()
+
+
+def _finished_runs(job_id: str) -> list[tuple[str, datetime]]:
+    with Session(engine) as session:
+        return session.exec(
+            select(JobRun.run_id, JobRun.started_at)
+            .where(JobRun.job_id == job_id, JobRun.status.not_in(["queued", "running"]))
+            .order_by(JobRun.started_at.desc())
+        ).all()
+
+
+_log_index = LogIndex()
+_log_archiver = runlogs.LogArchiver(_finished_runs, on_remove=_log_index.remove)
+
+
+def _cron_runs_ingested(runs: list[dict]):
+    for run in runs:
+        if run["log_bytes"] is not None:
+            _log_index.submit(run["run_id"], run["job_id"], run["started_at"])
+            _log_archiver.submit(run["run_id"], run["started_at"])
+
+
+_cron_runs = CronRunIngester(_run_store, on_ingested=_cron_runs_ingested)
+
+
+def _record_queued(run: PendingRun):
+    # Wait for the insert so the run_id handed back to the caller is queryable.
+    _run_store.insert(JobRun(
+        run_id=run.run_id,
+        job_id=run.job["job_id"],
+        target_name=run.job["target_name"],
+        status="queued",
+        triggered_by=run.triggered_by,
+        started_at=run.queued_at,
+        queued_at=run.queued_at,
+        parent_run_id=run.parent_run_id,
+    ), wait=True)
+
+
+async def _record_finished(run: PendingRun, day: date, **fields):
+    """Record an executed run's outcome for _execute_job."""
+    if run.parent_run_id is None:
+        _run_store.finish(run.run_id, run.job["job_id"], day, **fields)
+        return
+    # A pipeline reads the finished run back to decide what runs next, so
+    # wait for the commit, but off the event loop: the writer may be busy
+    # with a long retention pass while other runs' output needs reading.
+    await asyncio.to_thread(_run_store.finish, run.run_id, run.job["job_id"], day, wait=True, **fields)
+
+
+async def _execute_job(run: PendingRun):
+    run_id, cmd = run.run_id, run.cmd
+    log_file = runlogs.log_path(run_id)
+    
+    started_at = datetime.utcnow()
+    queue_wait = (started_at - run.queued_at).total_seconds()
+
+    # Claim the queued run record. A run that already finished here can
+    # still read as queued while its writes wait in the run store, so
+    # _fetch_queued may hand it over again; only the first claim runs it.
+    claimed = await asyncio.to_thread(
+        _run_store.claim, run_id, started_at=started_at, queue_wait_ms=int(queue_wait * 1000)
+    )
+    if not claimed:
+        logger.info("Run %s is no longer queued; skipping it", run_id)
+        return
+    metrics.QUEUE_WAIT_SECONDS.observe(queue_wait)
+
+    tail = OutputTail()
+    try:
+        # wrapper.sh records the run in run_log.csv under this id, so the
+        # ingester knows the run is already here.
+        env = {"SCHEDULER_RUN_ID": run_id}
+        if run.doppler:
+            env.update(await asyncio.to_thread(
+                _secret_cache.environ, run.doppler.get("project", ""), run.doppler.get("config", "")
+            ))
+        limits = RunLimits.from_job(run.job)
+        result = await run_command(cmd, log_file, tail, env, limits, run.cancel)
+        returncode = result.returncode
 
         finished_at = datetime.utcnow()
         duration_ms = int((finished_at - started_at).total_seconds() * 1000)
-        status = "success" if process.returncode == 0 else "failed"
-        
-        # Update run record
-        with Session(engine) as session:
-            job_run = session.get(JobRun, run_id)
-            if job_run:
-                job_run.status = status
-                job_run.finished_at = finished_at
-                job_run.exit_code = process.returncode
-                job_run.duration_ms = duration_ms
-                if process.returncode != 0:
-                    # Read error from log file
-                    if log_file.exists():
-                        error_content = log_file.read_text()
-                        # Take last few lines as error message
-                        error_lines = error_content.strip().split('\n')[-5:]
-                        job_run.error_message = '\n'.join(error_lines)
-                session.add(job_run)
-                session.commit()
-                
+        run_status, error_message = run_outcome(result, tail, limits, run.cancelled_by)
+        metrics.JOB_DURATION_SECONDS.observe(duration_ms / 1000, job_id=run.job["job_id"], status=run_status)
+
+        await _record_finished(
+            run,
+            started_at.date(),
+            status=run_status,
+            finished_at=finished_at,
+            exit_code=returncode,
+            duration_ms=duration_ms,
+            error_message=error_message,
+            log_bytes=log_file.stat().st_size if log_file.exists() else None,
+            **resource_usage(result.rusage),
+        )
+
     except Exception as e:
         # Mark run as failed due to execution error
         finished_at = datetime.utcnow()
         duration_ms = int((finished_at - started_at).total_seconds() * 1000)
-        
-        with Session(engine) as session:
-            job_run = session.get(JobRun, run_id)
-            if job_run:
-                job_run.status = "failed"
-                job_run.finished_at = finished_at
-                job_run.exit_code = -1
-                job_run.duration_ms = duration_ms
-                job_run.error_message = str(e)
-                session.add(job_run)
-                session.commit()
+        metrics.JOB_DURATION_SECONDS.observe(duration_ms / 1000, job_id=run.job["job_id"], status="failed")
 
-@jobs_router.post("/{job_id}/trigger", status_code=status.HTTP_202_ACCEPTED)
-def trigger_job(job_id: str, user: dict = Depends(_authenticate)):
-    accessible = _jobs_for_user(user["groups"])
-    job = next((j for j in accessible if j["job_id"] == job_id), None)
+        await _record_finished(
+            run,
+            started_at.date(),
+            status="failed",
+            finished_at=finished_at,
+            exit_code=-1,
+            duration_ms=duration_ms,
+            error_message=str(e),
+            log_bytes=log_file.stat().st_size if log_file.exists() else None,
+        )
+    _log_index.submit(run_id, run.job["job_id"], started_at)
+    _log_archiver.submit(run_id, started_at)
+    if run.parent_run_id is not None:
+        await asyncio.to_thread(_pipelines.advance, run.parent_run_id)
+
+
+_dispatcher = Dispatcher(_execute_job)
+
+
+def _runs_by_job(run_status: str) -> dict:
+    """Runs in ``run_status`` per job, from the database, so every worker process reports the same."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(JobRun.job_id, func.count()).where(JobRun.status == run_status).group_by(JobRun.job_id)
+        ).all()
+    return {(job_id,): count for job_id, count in rows}
+
+
+metrics.REGISTRY.gauge(
+    "runs_active", "Runs currently executing, by job", ("job_id",),
+    collect=lambda: _runs_by_job("running"),
+)
+metrics.REGISTRY.gauge(
+    "runs_queued", "Runs waiting to start, by job", ("job_id",),
+    collect=lambda: _runs_by_job("queued"),
+)
+metrics.REGISTRY.gauge(
+    "run_queue_depth", "Runs waiting to start", collect=lambda: sum(_runs_by_job("queued").values()),
+)
+metrics.REGISTRY.gauge("catalog_jobs", "Jobs in the loaded catalog", collect=lambda: len(_catalog))
+
+
+def _fail_interrupted_runs():
+    """Mark runs left running by a previous executor as failed.
+
+    Queued runs are left for _queue_consumer, which starts them as usual.
+    Runs held by worker agents carry on; _lease_monitor requeues them if
+    their agent is gone too.
+    """
+    with Session(engine) as session:
+        stale = session.exec(
+            select(JobRun).where(JobRun.status == "running", JobRun.worker_id.is_(None))
+        ).all()
+        for job_run in stale:
+            job_run.status = "failed"
+            job_run.error_message = "Interrupted by scheduler restart"
+            job_run.rolled_up = True
+            stats.record_run(session, job_run.job_id, job_run.started_at.date(), "failed", None, None)
+            session.add(job_run)
+        session.commit()
+    if stale:
+        run_changes.bump()
+        logger.warning("Marked %d interrupted run(s) as failed", len(stale))
+
+
+def _archive_leftover_logs():
+    """Queue the live logs of runs that finished before the last shutdown for compression."""
+    run_ids = [path.stem for path in runlogs.LOGS_DIR.glob("*.log")]
+    with Session(engine) as session:
+        for i in range(0, len(run_ids), 500):
+            rows = session.exec(
+                select(JobRun.run_id, JobRun.started_at).where(JobRun.run_id.in_(run_ids[i:i + 500]))
+            ).all()
+            for run_id, started_at in rows:
+                _log_archiver.submit(run_id, started_at, delay=0)
+
+
+def _backfill_log_index():
+    """Queue recently finished runs that were never indexed, e.g. because of a restart."""
+    if not _log_index.running:
+        return
+    since = datetime.utcnow() - timedelta(days=INDEX_BACKFILL_DAYS)
+    with Session(engine) as session:
+        rows = session.exec(
+            select(JobRun.run_id, JobRun.job_id, JobRun.started_at)
+            .where(JobRun.started_at >= since, JobRun.status.not_in(["queued", "running"]))
+        ).all()
+    indexed = _log_index.indexed(run_id for run_id, _, _ in rows)
+    for run_id, job_id, started_at in rows:
+        if run_id not in indexed:
+            _log_index.submit(run_id, job_id, started_at)
+
+def _new_run(
+    job: dict,
+    triggered_by: str,
+    catalog: Catalog,
+    run_id: Optional[str] = None,
+    queued_at: Optional[datetime] = None,
+    parent_run_id: Optional[str] = None,
+) -> PendingRun:
+    doppler = catalog.config.get("doppler", {})
+    run = PendingRun(run_id or str(uuid.uuid4()), job, "", triggered_by, parent_run_id=parent_run_id)
+    if queued_at is not None:
+        run.queued_at = queued_at
+    if doppler.get("cache"):
+        # Secrets come from _secret_cache at start time instead of doppler run.
+        run.cmd = build_wrapper_command(job, doppler, with_secrets=False)
+        run.doppler = doppler
+    else:
+        run.cmd = build_wrapper_command(job, doppler)
+    return run
+
+
+def _submit_run(run: PendingRun):
+    """Queue a run, raising QueueFull when the queue is at capacity.
+
+    The executor process hands it straight to its dispatcher; other worker
+    processes only record it as queued for the executor's _queue_consumer.
+    Runs of jobs with ``runs_on`` labels are always just recorded, for the
+    worker agents.
+    """
+    if _leadership.is_leader and not run.job.get("runs_on"):
+        _dispatcher.submit(run, on_queued=_record_queued)
+        return
+    max_queue = _catalog.config.get("executor", {}).get("max_queue", DEFAULT_MAX_QUEUE)
+    with Session(engine) as session:
+        queued = session.exec(select(func.count()).select_from(JobRun).where(JobRun.status == "queued")).one()
+    if queued >= max_queue:
+        raise QueueFull(f"{queued} run(s) already queued")
+    _record_queued(run)
+
+
+def _fetch_queued(exclude: set[str], limit: int) -> list[PendingRun]:
+    """Oldest queued runs recorded by any worker, for _queue_consumer.
+
+    Runs for worker agents are left in the queue.
+    """
+    catalog = _catalog
+    remote = [job["job_id"] for job in catalog if job.get("runs_on")]
+    with Session(engine) as session:
+        rows = session.exec(
+            select(JobRun)
+            .where(
+                JobRun.status == "queued",
+                JobRun.cancelled_by.is_(None),
+                JobRun.run_id.not_in(exclude),
+                JobRun.job_id.not_in(remote),
+            )
+            .order_by(JobRun.queued_at)
+            .limit(limit)
+        ).all()
+    runs = []
+    for row in rows:
+        job = catalog.by_id.get(row.job_id)
+        if job is None:
+            _run_store.finish(
+                row.run_id, row.job_id, row.started_at.date(), wait=True,
+                status="failed", finished_at=datetime.utcnow(), exit_code=-1,
+                error_message="Job is no longer in the catalog",
+            )
+            if row.parent_run_id is not None:
+                _pipelines.advance(row.parent_run_id)
+            continue
+        runs.append(_new_run(
+            job, row.triggered_by, catalog, row.run_id, row.queued_at or row.started_at, row.parent_run_id
+        ))
+    return runs
+
+
+def _apply_cancellations():
+    """Stop runs whose cancellation was requested through any worker, for _queue_consumer."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(JobRun).where(JobRun.cancelled_by.is_not(None), JobRun.status.in_(["queued", "running"]))
+        ).all()
+    for row in rows:
+        state = _dispatcher.cancel(row.run_id, row.cancelled_by)
+        if state == "running" or (state is None and row.status != "queued"):
+            continue  # _execute_job records the outcome once the process is gone
+        _run_store.finish(
+            row.run_id, row.job_id, row.started_at.date(), wait=True,
+            status="cancelled", finished_at=datetime.utcnow(),
+            error_message=f"Cancelled by {row.cancelled_by}",
+        )
+        if row.parent_run_id is not None:
+            _pipelines.advance(row.parent_run_id)
+
+
+_queue_consumer = QueueConsumer(_dispatcher, _fetch_queued, cancel=_apply_cancellations)
+
+
+def _worker_runs_finished(runs: list[JobRun]):
+    """Follow up runs finished (or given up on) by worker agents, as _execute_job does."""
+    for run in runs:
+        _log_index.submit(run.run_id, run.job_id, run.started_at)
+        _log_archiver.submit(run.run_id, run.started_at)
+        if run.parent_run_id is not None:
+            _pipelines.advance(run.parent_run_id)
+
+
+_lease_monitor = LeaseMonitor(_worker_runs_finished)
+
+
+def _start_pipeline_job(job_id: str, pipeline: PipelineRun):
+    """Queue one job of a pipeline for _queue_consumer, whichever worker calls it."""
+    catalog = _catalog
+    job = catalog.by_id.get(job_id)
     if job is None:
-        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        now = datetime.utcnow()
+        _run_store.insert(JobRun(
+            run_id=str(uuid.uuid4()),
+            job_id=job_id,
+            target_name="",
+            status="failed",
+            triggered_by=pipeline.triggered_by,
+            started_at=now,
+            queued_at=now,
+            finished_at=now,
+            exit_code=-1,
+            error_message="Job is no longer in the catalog",
+            parent_run_id=pipeline.run_id,
+        ), wait=True)
+        return
+    _record_queued(_new_run(job, pipeline.triggered_by, catalog, parent_run_id=pipeline.run_id))
+    if _leadership.is_leader:
+        _queue_consumer.wake()
 
-    doppler = _config.get("doppler", {})
-    cmd = build_wrapper_command(job, doppler)
 
-    run_id = str(uuid.uuid4())
+_pipelines = Pipelines(_start_pipeline_job)
 
-    thread = threading.Thread(
-        target=_execute_job,
-        args=(run_id, job, cmd, user["username"]),
-        daemon=True,
-    )
-    thread.start()
+
+def _fire_scheduled(job: dict, scheduled_for: datetime):
+    run = _new_run(job, "scheduler", _catalog)
+    try:
+        _submit_run(run)
+    except QueueFull:
+        logger.warning("Run queue full, dropping scheduled run of %s for %s", job["job_id"], scheduled_for)
+        return
+    logger.info("Fired %s for %s (run %s)", job["job_id"], scheduled_for, run.run_id)
+
+
+def _last_scheduled_fire(job_id: str) -> Optional[datetime]:
+    """Return the local time of the job's most recent scheduler-fired run."""
+    with Session(engine) as session:
+        statement = (
+            select(JobRun.queued_at)
+            .where(JobRun.job_id == job_id, JobRun.triggered_by == "scheduler")
+            .order_by(JobRun.started_at.desc())
+            .limit(1)
+        )
+        queued_at = session.exec(statement).first()
+    if queued_at is None:
+        return None
+    return queued_at.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+_scheduler = Scheduler(_fire_scheduled, last_fire=_last_scheduled_fire)
+
+
+def _reload_catalog() -> CatalogDiff:
+    """Build a new catalog from disk and swap it in atomically."""
+    global _catalog, _catalog_version
+    with _reload_lock:
+        with metrics.CATALOG_LOAD_SECONDS.time():
+            catalog = _catalog_loader.load()
+        diff = _catalog.diff(catalog)
+        _catalog = catalog
+        _catalog_version = _publish_catalog_version(catalog)
+        _apply_catalog(catalog)
+    if diff:
+        logger.info(
+            "Catalog reloaded: %d job(s); added=%s removed=%s changed=%s",
+            len(catalog), diff.added, diff.removed, diff.changed,
+        )
+    return diff
+
+
+def _publish_catalog_version(catalog: Catalog) -> int:
+    """Record a newly loaded catalog as the one every worker should serve."""
+    # One conditional UPDATE of the row init_db seeds, so workers starting
+    # together with the same catalog bump the version once between them.
+    with Session(engine) as session:
+        session.execute(
+            update(CatalogVersion)
+            .where(CatalogVersion.id == 1, CatalogVersion.digest != catalog.digest)
+            .values(version=CatalogVersion.version + 1, digest=catalog.digest, updated_at=datetime.utcnow())
+        )
+        version = session.exec(select(CatalogVersion.version).where(CatalogVersion.id == 1)).one()
+        session.commit()
+        return version
+
+
+def _shared_catalog_version() -> int:
+    with Session(engine) as session:
+        shared = session.get(CatalogVersion, 1)
+        return shared.version if shared else 0
+
+
+def _become_executor():
+    """Start executing runs in this worker process, once elected by _leadership."""
+    _fail_interrupted_runs()
+    _run_store.start()
+    _log_archiver.start()
+    _archive_leftover_logs()
+    with _reload_lock:
+        _apply_catalog(_catalog)
+    _backfill_log_index()
+    _queue_consumer.start()
+    _lease_monitor.start()
+    # Children interrupted above have failed; settle or continue their pipelines.
+    _pipelines.resume()
+
+
+_leadership = Leadership(_become_executor)
+
+
+def _apply_catalog(catalog: Catalog):
+    """Push a newly loaded catalog's settings to the dispatcher, scheduler and relays.
+
+    Only the executor process starts them; other workers just serve the API.
+    """
+    scheduler_config = catalog.config.get("scheduler", {})
+    _dispatcher.configure(catalog.config.get("executor", {}), scheduler_config.get("max_running"))
+    _run_store.configure(catalog.config.get("runs", {}))
+    _log_archiver.configure(catalog, catalog.config.get("runs", {}))
+    run_log_config = catalog.config.get("run_log", {})
+    _cron_runs.configure(catalog, run_log_config)
+    _lease_monitor.configure(catalog.config.get("workers", {}))
+    _response_cache.ttl = catalog.config.get("api", {}).get("cache_ttl", DEFAULT_TTL)
+    doppler_config = catalog.config.get("doppler", {})
+    _secret_cache.configure(doppler_config)
+    healthchecks_config = catalog.config.get("healthchecks", {})
+    _ping_relay.configure(healthchecks_config)
+    if not _leadership.is_leader:
+        return
+
+    if run_log_config.get("ingest", True):
+        _cron_runs.start()
+    else:
+        _cron_runs.stop()
+    if catalog.config.get("search", {}).get("enabled", True):
+        _log_index.start()
+    else:
+        _log_index.stop()
+    if doppler_config.get("cache"):
+        _secret_cache.start()
+    else:
+        _secret_cache.stop()
+    if healthchecks_config.get("relay", True):
+        _ping_relay.start()
+    else:
+        _ping_relay.disable()
+    if scheduler_config.get("enabled", False):
+        _scheduler.configure(scheduler_config)
+        _scheduler.replan(catalog)
+        _scheduler.start()
+    else:
+        _scheduler.stop()
+        _scheduler.replan([])
+
+
+@jobs_router.post("/{job_id}/trigger", status_code=status.HTTP_202_ACCEPTED)
+def trigger_job(job_id: str, user: dict = Depends(_authenticate)):
+    catalog = _catalog
+    job = _get_job_for_user(job_id, user, catalog)
+    run = _new_run(job, user["username"], catalog)
+
+    try:
+        _submit_run(run)
+    except QueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Run queue is full, try again later",
+            headers={"Retry-After": "30"},
+        )
 
     return {
         "status": "triggered",
         "job_id": job_id,
-        "run_id": run_id,
+        "run_id": run.run_id,
     }
 
-@jobs_router.get("/{job_id}/runs")
-def list_job_runs(job_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
-    accessible = _jobs_for_user(user["groups"])
-    job = next((j for j in accessible if j["job_id"] == job_id), None)
-    if job is None:
-        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+def _stats_window(window: str = stats.DEFAULT_WINDOW) -> str:
+    if window not in stats.WINDOWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown window '{window}', expected one of {', '.join(stats.WINDOWS)}",
+        )
+    return window
 
-    statement = select(JobRun).where(JobRun.job_id == job_id).order_by(JobRun.started_at.desc())
-    runs = session.exec(statement).all()
-    
-    return [
-        {
-            "run_id": run.run_id,
-            "job_id": run.job_id,
-            "target_name": run.target_name,
-            "status": run.status,
-            "triggered_by": run.triggered_by,
-            "created_at": run.started_at.isoformat(),
-            "started_at": run.started_at.isoformat(),
-            "finished_at": run.finished_at.isoformat() if run.finished_at else None,
-            "exit_code": run.exit_code,
-            "duration": run.duration_ms,
-            "error": run.error_message
-        }
-        for run in runs
-    ]
 
-@jobs_router.get("/{job_id}/runs/{run_id}")
-def get_job_run(job_id: str, run_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
-    accessible = _jobs_for_user(user["groups"])
-    job = next((j for j in accessible if j["job_id"] == job_id), None)
-    if job is None:
-        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
-    
-    run = session.get(JobRun, run_id)
-    if not run or run.job_id != job_id:
-        raise HTTPException(status_code=404, detail="Run not found")
-    
-    return {
-        "run_id": run.run_id,
-        "job_id": run.job_id,
-        "target_name": run.target_name,
-        "status": run.status,
-        "triggered_by": run.triggered_by,
-        "created_at": run.started_at.isoformat(),
-        "started_at": run.started_at.isoformat(),
-        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
-        "exit_code": run.exit_code,
-        "duration": run.duration_ms,
-        "error": run.error_message
-    }
+@jobs_router.get("/{job_id}/stats")
+def get_job_stats(
+    job_id: str,
+    window: str = Depends(_stats_window),
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    _get_job_for_user(job_id, user)
+
+    per_job, _ = stats.job_stats(session, [job_id], stats.window_start(window))
+    return {"job_id": job_id, "window": window, **per_job[job_id]}
+
+@jobs_router.get("/{job_id}/runs", response_model=list[RunOut])
+def list_job_runs(
+    job_id: str,
+    request: Request,
+    filters: dict = Depends(_run_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(RUNS_PAGE_DEFAULT, ge=1, le=RUNS_PAGE_MAX),
+    fields: Optional[str] = None,
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    _get_job_for_user(job_id, user)
+
+    statement = select(JobRun).where(JobRun.job_id == job_id)
+    return _cached_json(
+        request, user, RunOut, fields,
+        lambda headers: _page_runs(session, statement, headers, filters, cursor, limit),
+    )
+
+@jobs_router.get("/{job_id}/runs/{run_id}", response_model=RunOut)
+def get_job_run(
+    job_id: str,
+    run_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    _get_job_for_user(job_id, user)
+
+    def build(headers: dict) -> RunOut:
+        run = session.get(JobRun, run_id)
+        if not run or run.job_id != job_id:
+            raise HTTPException(status_code=404, detail="Run not found")
+        return RunOut.from_run(run)
+
+    return _cached_json(request, user, RunOut, fields, build)
 
 @jobs_router.get("/{job_id}/runs/{run_id}/logs")
-def get_job_run_logs(job_id: str, run_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
-    accessible = _jobs_for_user(user["groups"])
-    job = next((j for j in accessible if j["job_id"] == job_id), None)
-    if job is None:
-        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+def get_job_run_logs(
+    job_id: str,
+    run_id: str,
+    request: Request,
+    params: dict = Depends(_log_params),
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    _get_job_for_user(job_id, user)
     
     run = session.get(JobRun, run_id)
     if not run or run.job_id != job_id:
         raise HTTPException(status_code=404, detail="Run not found")
     
-    log_file = LOGS_DIR / f"{run_id}.log"
-    if not log_file.exists():
-        return "No logs available"
-    
-    return log_file.read_text()
+    return _log_response(request, run, params)
 
-@runs_router.get("/")
-def list_runs(user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
-    statement = select(JobRun).order_by(JobRun.started_at.desc())
-    runs = session.exec(statement).all()
-    
-    # Filter runs based on user access
-    accessible_job_ids = {j["job_id"] for j in _jobs_for_user(user["groups"])}
-    filtered_runs = [run for run in runs if run.job_id in accessible_job_ids]
-    
-    return [
-        {
-            "run_id": run.run_id,
-            "job_id": run.job_id,
-            "target_name": run.target_name,
-            "status": run.status,
-            "triggered_by": run.triggered_by,
-            "created_at": run.started_at.isoformat(),
-            "started_at": run.started_at.isoformat(),
-            "finished_at": run.finished_at.isoformat() if run.finished_at else None,
-            "exit_code": run.exit_code,
-            "duration": run.duration_ms,
-            "error": run.error_message
-        }
-        for run in filtered_runs
-    ]
+@runs_router.get("/", response_model=list[RunOut])
+def list_runs(
+    request: Request,
+    filters: dict = Depends(_run_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(RUNS_PAGE_DEFAULT, ge=1, le=RUNS_PAGE_MAX),
+    fields: Optional[str] = None,
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    def build(headers: dict) -> list[RunOut]:
+        # Filter runs based on user access
+        accessible_job_ids = _catalog.accessible_ids(user["groups"])
+        if not accessible_job_ids:
+            return []
+        statement = select(JobRun).where(JobRun.job_id.in_(accessible_job_ids))
+        return _page_runs(session, statement, headers, filters, cursor, limit)
+
+    return _cached_json(request, user, RunOut, fields, build)
+
+@runs_router.get("/search")
+def search_runs(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    job_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    user: dict = Depends(_authenticate),
+):
+    """Find runs whose logs contain every word of ``q``, newest first, with matching lines."""
+    if not _catalog.config.get("search", {}).get("enabled", True):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Log search is disabled")
+
+    accessible_job_ids = _catalog.accessible_ids(user["groups"])
+    if job_id is not None:
+        accessible_job_ids = [job_id] if job_id in accessible_job_ids else []
+    if not accessible_job_ids:
+        return []
+
+    try:
+        results, next_cursor = _log_index.search(q, accessible_job_ids, since=since, before=cursor, limit=limit)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return results
 
-@runs_router.get("/{run_id}")
-def get_run(run_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
+@runs_router.get("/{run_id}", response_model=RunOut)
+def get_run(
+    run_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    def build(headers: dict) -> RunOut:
+        run = session.get(JobRun, run_id)
+        if not run:
+            raise HTTPException(status_code=404, detail="Run not found")
+
+        # Check user access to this job
+        accessible_job_ids = _catalog.accessible_ids(user["groups"])
+        if run.job_id not in accessible_job_ids:
+            raise HTTPException(status_code=404, detail="Run not found")
+
+        return RunOut.from_run(run)
+
+    return _cached_json(request, user, RunOut, fields, build)
+
+@runs_router.post("/{run_id}/cancel", status_code=status.HTTP_202_ACCEPTED)
+def cancel_run(run_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
+    """Drop a queued run, or stop a running one (SIGTERM, then SIGKILL, to its process group)."""
     run = session.get(JobRun, run_id)
-    if not run:
-        raise HTTPException(status_code=404, detail="Run not found")
-    
-    # Check user access to this job
-    accessible_job_ids = {j["job_id"] for j in _jobs_for_user(user["groups"])}
-    if run.job_id not in accessible_job_ids:
+    if not run or run.job_id not in _catalog.accessible_ids(user["groups"]):
         raise HTTPException(status_code=404, detail="Run not found")
-    
-    return {
-        "run_id": run.run_id,
-        "job_id": run.job_id,
-        "target_name": run.target_name,
-        "status": run.status,
-        "triggered_by": run.triggered_by,
-        "created_at": run.started_at.isoformat(),
-        "started_at": run.started_at.isoformat(),
-        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
-        "exit_code": run.exit_code,
-        "duration": run.duration_ms,
-        "error": run.error_message
-    }
+    if run.status not in ("queued", "running"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Run already {run.status}")
+
+    # The executor acts on it, whichever worker process received the request.
+    _run_store.update(run_id, wait=True, cancelled_by=user["username"])
+    _queue_consumer.wake()
+    return {"status": "cancelling", "run_id": run_id}
 
 @runs_router.get("/{run_id}/logs")
-def get_logs(run_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
+def get_logs(
+    run_id: str,
+    request: Request,
+    params: dict = Depends(_log_params),
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
     run = session.get(JobRun, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
     # Check user access to this job
-    accessible_job_ids = {j["job_id"] for j in _jobs_for_user(user["groups"])}
+    accessible_job_ids = _catalog.accessible_ids(user["groups"])
     if run.job_id not in accessible_job_ids:
         raise HTTPException(status_code=404, detail="Logs not found")
     
-    log_file = LOGS_DIR / f"{run_id}.log"
-    if not log_file.exists():
-        return "No logs available"
-    
-    return log_file.read_text()
+    return _log_response(request, run, params)
+
+@runs_router.post("/{run_id}/logs")
+async def append_logs(
+    run_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    worker_id: str = Query(...),
+    user: dict = Depends(_authenticate_agent),
+):
+    """Append output streamed by the worker agent executing the run.
+
+    Only agents may call this; like their database access, it is not
+    limited to the job's groups. ``offset`` is where the body starts in
+    the log, so a chunk sent again after a lost response is only written
+    once.
+    """
+    def check() -> Optional[JobRun]:
+        with Session(engine) as session:
+            return session.get(JobRun, run_id)
+
+    run = await asyncio.to_thread(check)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run.status != "running" or run.worker_id != worker_id:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Run is not held by this worker")
+
+    data = await request.body()
+
+    def append() -> int:
+        with open(runlogs.log_path(run_id), "ab") as log:
+            size = log.tell()
+            if offset > size:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT, detail=f"Log has {size} byte(s), not {offset}"
+                )
+            log.write(data[size - offset:])
+            return log.tell()
+
+    return {"size": await asyncio.to_thread(append)}
+
+
+@pipelines_router.post("", status_code=status.HTTP_202_ACCEPTED)
+def trigger_pipeline(
+    job_id: list[str] = Query(..., min_length=1),
+    max_parallel: Optional[int] = Query(None, ge=1),
+    user: dict = Depends(_authenticate),
+):
+    """Run the given jobs and everything they depend on, each as soon as its upstreams succeed."""
+    catalog = _catalog
+    for requested in job_id:
+        _get_job_for_user(requested, user, catalog)
+    try:
+        graph = plan(catalog.by_id, job_id)
+    except InvalidPipeline as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for upstream in graph:
+        _get_job_for_user(upstream, user, catalog)
+    if max_parallel is None:
+        max_parallel = catalog.config.get("pipelines", {}).get("max_parallel", DEFAULT_MAX_PARALLEL)
+
+    pipeline = _pipelines.create(graph, user["username"], max_parallel)
+    return {
+        "status": "triggered",
+        "pipeline_id": pipeline.run_id,
+        "jobs": list(graph),
+    }
+
+@pipelines_router.get("/{pipeline_id}")
+def get_pipeline(pipeline_id: str, user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
+    pipeline = session.get(PipelineRun, pipeline_id)
+    if not pipeline:
+        raise HTTPException(status_code=404, detail="Pipeline not found")
+
+    graph = json.loads(pipeline.jobs)
+    accessible_job_ids = _catalog.accessible_ids(user["groups"])
+    if not accessible_job_ids.issuperset(graph):
+        raise HTTPException(status_code=404, detail="Pipeline not found")
+
+    children = {
+        run.job_id: run
+        for run in session.exec(select(JobRun).where(JobRun.parent_run_id == pipeline_id)).all()
+    }
+    return {
+        "pipeline_id": pipeline.run_id,
+        "status": pipeline.status,
+        "triggered_by": pipeline.triggered_by,
+        "started_at": pipeline.started_at.isoformat(),
+        "finished_at": pipeline.finished_at.isoformat() if pipeline.finished_at else None,
+        "duration": pipeline.duration_ms,
+        "critical_path_duration": pipeline.critical_path_ms,
+        "critical_path": json.loads(pipeline.critical_path) if pipeline.critical_path else None,
+        "max_parallel": pipeline.max_parallel,
+        "error": pipeline.error_message,
+        "jobs": [
+            {
+                "job_id": child_job_id,
+                "depends_on": upstream,
+                "run": RunOut.from_run(children[child_job_id]) if child_job_id in children else None,
+            }
+            for child_job_id, upstream in graph.items()
+        ],
+    }
+
+
+@router.get("/stats")
+def get_stats(
+    window: str = Depends(_stats_window),
+    sort: Optional[str] = Query(None, pattern="^(cpu|memory)$"),
+    user: dict = Depends(_authenticate),
+    session: Session = Depends(get_session),
+):
+    """Totals across all jobs the user can see, plus a breakdown per job.
+
+    ``sort=cpu`` or ``sort=memory`` lists the heaviest jobs first, by total
+    CPU time or peak RSS.
+    """
+    jobs = _catalog.jobs_for(user["groups"])
+    per_job, overall = stats.job_stats(session, [j["job_id"] for j in jobs], stats.window_start(window))
+    breakdown = [
+        {"job_id": j["job_id"], "target_name": j["target_name"], **per_job[j["job_id"]]}
+        for j in jobs
+    ]
+    if sort is not None:
+        key = "cpu_total_ms" if sort == "cpu" else "max_rss_kb"
+        breakdown.sort(key=lambda j: j["resources"][key] or 0, reverse=True)
+    return {
+        "window": window,
+        **overall,
+        "jobs": breakdown,
+    }
+
+
+@router.get("/workers")
+def list_workers(user: dict = Depends(_authenticate), session: Session = Depends(get_session)):
+    """Worker agents that have checked in recently, with the runs they hold."""
+    lease = timedelta(seconds=_catalog.config.get("workers", {}).get("lease_seconds", DEFAULT_LEASE_SECONDS))
+    now = datetime.utcnow()
+    held = dict(session.exec(
+        select(JobRun.worker_id, func.count())
+        .where(JobRun.worker_id.is_not(None), JobRun.status == "running")
+        .group_by(JobRun.worker_id)
+    ).all())
+    return [
+        {
+            "worker_id": worker.worker_id,
+            "hostname": worker.hostname,
+            "pid": worker.pid,
+            "labels": json.loads(worker.labels),
+            "targets": json.loads(worker.targets) if worker.targets else None,
+            "max_runs": worker.max_runs,
+            "running": held.get(worker.worker_id, 0),
+            "alive": now - worker.heartbeat_at < lease,
+            "started_at": worker.started_at.isoformat(),
+            "heartbeat_at": worker.heartbeat_at.isoformat(),
+        }
+        for worker in session.exec(select(Worker).order_by(Worker.hostname, Worker.started_at)).all()
+    ]
 
 
 @router.post("/catalog/reload")
 def reload_catalog(user: dict = Depends(_authenticate)):
-    global _job_catalog, _config
-    _job_catalog, _config = load_catalog(TARGETS_FILE)
-    return {"status": "reloaded", "job_count": len(_job_catalog)}
+    diff = _reload_catalog()
+    return {
+        "status": "reloaded",
+        "job_count": len(_catalog),
+        "added": diff.added,
+        "removed": diff.removed,
+        "changed": diff.changed,
+    }
+
+@router.get("/debug/profile")
+def get_profiles(user: dict = Depends(_authenticate_admin)):
+    """Profiler settings and the most recent request profiles of every worker process."""
+    return {
+        "enabled": metrics.PROFILER.enabled,
+        "match": metrics.PROFILER.match,
+        "profiles": _shared_metrics.profiles(),
+    }
+
+
+@router.put("/debug/profile")
+def set_profiling(enabled: bool, match: str = "/api/", user: dict = Depends(_authenticate_admin)):
+    """Turn per-request profiling on or off for routes starting with ``match``.
+
+    Applies here at once and in the other worker processes within
+    metrics.SHARE_INTERVAL seconds.
+    """
+    _shared_metrics.configure_profiler(enabled, match)
+    logger.info("Request profiling %s by %s (match=%r)", "enabled" if enabled else "disabled", user["username"], match)
+    return {"enabled": enabled, "match": match}
+
 
 router.include_router(jobs_router)
 router.include_router(runs_router)
+router.include_router(pipelines_router)
 
 app.include_router(router)
 
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(_shared_metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # # Serve Vue SPA from frontend/dist (production build)
 # if FRONTEND_DIST.is_dir():
 #     app.mount("/assets", StaticFiles(directory=FRONTEND_DIST / "assets"), name="assets")
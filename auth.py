@@ -0,0 +1,128 @@
+"""User store and credential verification cache for the API."""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import bcrypt
+import yaml
+
+from metrics import AUTH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore:
+    """In-memory view of users.yaml with a cache of verified credentials.
+
+    The file is re-read only when its mtime/size change (checked at most once
+    every ``check_interval`` seconds) and re-parsed only when its content hash
+    differs. Successful verifications are cached under an HMAC of the
+    username/password pair, so a cache hit skips bcrypt entirely and plaintext
+    passwords are never kept. The cache is cleared whenever the file reloads.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        cache_ttl: float = 300.0,
+        cache_size: int = 1024,
+        check_interval: float = 2.0,
+    ):
+        self.path = Path(path)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._users: dict[str, dict] = {}
+        self._stat_key: tuple[int, int] | None = None
+        self._digest: bytes | None = None
+        self._next_check = 0.0
+        self._cache_key = secrets.token_bytes(32)
+        self._verified: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+            try:
+                st = self.path.stat()
+            except FileNotFoundError:
+                if self._stat_key is not None or self._users:
+                    logger.info("Users file %s removed, clearing users", self.path)
+                    self._swap({}, None, None)
+                return
+
+            stat_key = (st.st_mtime_ns, st.st_size)
+            if stat_key == self._stat_key:
+                return
+
+            raw = self.path.read_bytes()
+            digest = hashlib.sha256(raw).digest()
+            if digest == self._digest:
+                self._stat_key = stat_key
+                return
+
+            data = yaml.safe_load(raw) or {}
+            users = {u["username"]: u for u in data.get("users", [])}
+            logger.info("Loaded %d user(s) from %s", len(users), self.path)
+            self._swap(users, stat_key, digest)
+
+    def _swap(self, users, stat_key, digest):
+        self._users = users
+        self._stat_key = stat_key
+        self._digest = digest
+        self._verified.clear()
+        self._cache_key = secrets.token_bytes(32)
+
+    def _credential_key(self, username: str, password: str) -> bytes:
+        msg = username.encode() + b"\x00" + password.encode()
+        return hmac.new(self._cache_key, msg, hashlib.sha256).digest()
+
+    def verify(self, username: str, password: str) -> dict | None:
+        """Return ``{"username", "groups"}`` for valid credentials, else None."""
+        start = time.perf_counter()
+        principal, result = self._verify(username, password)
+        AUTH_SECONDS.observe(time.perf_counter() - start, result=result)
+        return principal
+
+    def _verify(self, username: str, password: str) -> tuple[dict | None, str]:
+        self._refresh()
+
+        now = time.monotonic()
+        with self._lock:
+            key = self._credential_key(username, password)
+            hit = self._verified.get(key)
+            if hit is not None:
+                expires_at, principal = hit
+                if expires_at > now:
+                    self._verified.move_to_end(key)
+                    return dict(principal), "cached"
+                del self._verified[key]
+            user = self._users.get(username)
+            cache_key = self._cache_key
+
+        if user is None:
+            return None, "unknown_user"
+        if not bcrypt.checkpw(password.encode(), user["password_hash"].encode()):
+            return None, "denied"
+
+        principal = {"username": username, "groups": list(user.get("groups", []))}
+        with self._lock:
+            # Drop the result if the file was reloaded while bcrypt was running.
+            if cache_key == self._cache_key:
+                self._verified[key] = (now + self.cache_ttl, principal)
+                while len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        return dict(principal), "verified"
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""Synthetic benchmarks for the catalog, apply, API and execution paths.
+
+Builds a throwaway tree of targets and schedules, seeds runs.db with
+JobRun rows and times the hot paths, printing the results as JSON so runs
+from different commits can be diffed or compared by a script:
+
+    python bench.py --jobs 10,1000,10000 --runs 1000000 --output before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import bcrypt
+import yaml
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+JOBS_PER_TARGET = 50
+SEED_CHUNK = 20000
+BENCH_PASSWORD = "bench"
+
+
+def measure(fn, repeat: int) -> dict:
+    """Call ``fn`` ``repeat`` times and summarise the wall-clock times in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "n": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+    }
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "-C", str(SCRIPT_DIR), "rev-parse", "HEAD"], capture_output=True, text=True, check=False
+    )
+    return result.stdout.strip()
+
+
+def generate_tree(root: Path, job_count: int) -> Path:
+    """Write a targets.yaml with ``job_count`` jobs spread over several targets."""
+    targets = []
+    for t in range((job_count + JOBS_PER_TARGET - 1) // JOBS_PER_TARGET):
+        name = f"target{t:04d}"
+        repo = root / "repos" / name
+        repo.mkdir(parents=True, exist_ok=True)
+        count = min(JOBS_PER_TARGET, job_count - t * JOBS_PER_TARGET)
+        schedules = [
+            {
+                "name": f"job{j:03d}",
+                "cron": f"{j % 60} {t % 24} * * *",
+                "command": "true",
+                "groups": ["bench"] if j % 2 else [],
+            }
+            for j in range(count)
+        ]
+        (repo / "schedule.yml").write_text(yaml.safe_dump({"defaults": {"log_dir": "logs/"}, "schedules": schedules}))
+        targets.append({
+            "name": name,
+            "repo_path": str(repo),
+            "schedule_file": "schedule.yml",
+            "groups": ["bench"],
+        })
+
+    config = {
+        "executor": {"max_workers": 8, "max_queue": 1_000_000},
+        "catalog": {"watch": False},
+        "scheduler": {"enabled": False},
+        "targets": targets,
+    }
+    path = root / "targets.yaml"
+    path.write_text(yaml.safe_dump(config))
+    return path
+
+
+def bench_catalog(root: Path, sizes: list[int], repeat: int) -> list[dict]:
+    import main
+    from catalog import CatalogLoader, load_catalog
+
+    results = []
+    for size in sizes:
+        tree = root / f"tree-{size}"
+        targets_file = generate_tree(tree, size)
+        config = yaml.safe_load(targets_file.read_text())
+
+        results.append({"name": "load_catalog", "jobs": size, **measure(lambda: load_catalog(targets_file), repeat)})
+
+        loader = CatalogLoader(targets_file)
+        loader.load()
+        results.append({"name": "catalog_loader_warm", "jobs": size, **measure(loader.load, repeat)})
+
+        main.CRON_DIR = tree / "cron.d"
+        main.CRON_DIR.mkdir(exist_ok=True)
+        main.MAKEFILE_PATH = tree / "Makefile"
+
+        def apply_all(state):
+            return [main.apply_target(t, state) for t in config["targets"]]
+
+        def apply_cold():
+            shutil.rmtree(main.CRON_DIR)
+            main.CRON_DIR.mkdir()
+            apply_all({})
+
+        results.append({"name": "apply_target_cold", "jobs": size, **measure(apply_cold, repeat)})
+        state = {t["name"]: ts for t, (_, _, ts) in zip(config["targets"], apply_all({})) if ts}
+        results.append({"name": "apply_target_warm", "jobs": size, **measure(lambda: apply_all(state), repeat)})
+
+        catalog, _ = load_catalog(targets_file)
+
+        def makefile():
+            main.MAKEFILE_PATH.unlink(missing_ok=True)
+            main.generate_makefile(catalog, {})
+
+        results.append({"name": "generate_makefile", "jobs": size, **measure(makefile, repeat)})
+    return results
+
+
+def seed_runs(jobs: list[dict], count: int) -> dict:
+    """Insert ``count`` finished JobRun rows spread over the last 90 days."""
+    from db import JobRun, engine
+
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    inserted = 0
+    while inserted < count:
+        rows = []
+        for _ in range(min(SEED_CHUNK, count - inserted)):
+            job = rng.choice(jobs)
+            started_at = now - timedelta(seconds=rng.uniform(0, 90 * 86400))
+            duration_ms = int(rng.lognormvariate(7, 1.5))
+            failed = rng.random() < 0.05
+            rows.append({
+                "run_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "job_id": job["job_id"],
+                "target_name": job["target_name"],
+                "status": "failed" if failed else "success",
+                "triggered_by": "bench",
+                "started_at": started_at,
+                "queued_at": started_at,
+                "finished_at": started_at + timedelta(milliseconds=duration_ms),
+                "duration_ms": duration_ms,
+                "exit_code": 1 if failed else 0,
+            })
+        with engine.begin() as conn:
+            conn.execute(JobRun.__table__.insert(), rows)
+        inserted += len(rows)
+    elapsed = time.perf_counter() - start
+    return {"name": "seed_runs", "runs": count, "seconds": elapsed, "rows_per_second": count / elapsed if elapsed else None}
+
+
+def bench_api(root: Path, size: int, run_count: int, log_mb: int, triggers: int, repeat: int) -> list[dict]:
+    import api
+    import runlogs
+    from auth import UserStore
+    from db import init_db
+
+    results = []
+    targets_file = root / f"tree-{size}" / "targets.yaml"
+    if not targets_file.exists():
+        targets_file = generate_tree(root / f"tree-{size}", size)
+
+    users_file = root / "users.yaml"
+    users_file.write_text(yaml.safe_dump({"users": [{
+        "username": "bench",
+        "password_hash": bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt()).decode(),
+        "groups": ["bench"],
+    }]}))
+    api.TARGETS_FILE = targets_file
+    api._user_store = UserStore(users_file)
+    runlogs.LOGS_DIR = root / "logs"
+    runlogs.LOGS_DIR.mkdir(exist_ok=True)
+    # Measure the scheduler's own overhead, not doppler or wrapper.sh.
+    api.build_wrapper_command = lambda job, doppler, **kwargs: job["command"]
+
+    from catalog import load_catalog
+    jobs = load_catalog(targets_file)[0].jobs
+    init_db()
+    if run_count:
+        results.append(seed_runs(jobs, run_count))
+
+    from fastapi.testclient import TestClient
+
+    auth = ("bench", BENCH_PASSWORD)
+    with TestClient(api.app) as client:
+        def get(url, **kwargs):
+            response = client.get(url, auth=auth, **kwargs)
+            response.raise_for_status()
+            return response
+
+        # First call pays for bcrypt; later ones hit the credential cache.
+        results.append({"name": "api_list_jobs_first", "jobs": size, **measure(lambda: get("/api/jobs"), 1)})
+        results.append({"name": "api_list_jobs", "jobs": size, **measure(lambda: get("/api/jobs"), repeat)})
+        results.append({"name": "api_list_runs", "runs": run_count, **measure(lambda: get("/api/runs/"), repeat)})
+        results.append({
+            "name": "api_list_runs_filtered", "runs": run_count,
+            **measure(lambda: get("/api/runs/", params={"status": "failed", "limit": 50}), repeat),
+        })
+
+        def deep_page():
+            cursor = None
+            for _ in range(10):
+                response = get("/api/runs/", params={"limit": 1000, **({"cursor": cursor} if cursor else {})})
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+
+        results.append({"name": "api_page_runs_10x1000", "runs": run_count, **measure(deep_page, repeat)})
+        results.append({"name": "api_stats", "jobs": size, **measure(lambda: get("/api/stats"), repeat)})
+
+        if log_mb:
+            from db import JobRun, engine
+            from sqlmodel import Session
+
+            run_id = str(uuid.uuid4())
+            with Session(engine) as session:
+                now = datetime.utcnow()
+                session.add(JobRun(
+                    run_id=run_id, job_id=jobs[0]["job_id"], target_name=jobs[0]["target_name"],
+                    status="success", triggered_by="bench", started_at=now, finished_at=now,
+                ))
+                session.commit()
+            line = b"x" * 99 + b"\n"
+            with open(runlogs.log_path(run_id), "wb") as f:
+                for _ in range(log_mb * 1024 * 1024 // len(line)):
+                    f.write(line)
+            url = f"/api/runs/{run_id}/logs"
+            results.append({"name": "api_log_full", "mb": log_mb, **measure(lambda: get(url), repeat)})
+            results.append({"name": "api_log_tail_100", "mb": log_mb, **measure(lambda: get(url, params={"tail": 100}), repeat)})
+            results.append({
+                "name": "api_log_range_64k", "mb": log_mb,
+                **measure(lambda: get(url, headers={"Range": "bytes=-65536"}), repeat),
+            })
+
+            # The same log once the archiver has gzipped it into its day shard.
+            api._log_archiver.compress(run_id, now)
+            results.append({"name": "api_log_full_gz", "mb": log_mb, **measure(lambda: get(url), repeat)})
+            results.append({"name": "api_log_tail_100_gz", "mb": log_mb, **measure(lambda: get(url, params={"tail": 100}), repeat)})
+
+        if triggers:
+            from db import JobRun, engine
+            from sqlmodel import Session, func, select
+
+            job_id = jobs[0]["job_id"]
+            start = time.perf_counter()
+            for _ in range(triggers):
+                client.post(f"/api/jobs/{job_id}/trigger", auth=auth).raise_for_status()
+            submitted = time.perf_counter() - start
+            unfinished = select(func.count()).select_from(JobRun).where(JobRun.status.in_(["queued", "running"]))
+            while True:
+                with Session(engine) as session:
+                    if not session.exec(unfinished).one():
+                        break
+                time.sleep(0.05)
+            finished = time.perf_counter() - start
+            results.append({
+                "name": "trigger_throughput",
+                "runs": triggers,
+                "submit_seconds": submitted,
+                "complete_seconds": finished,
+                "triggers_per_second": triggers / submitted,
+                "runs_per_second": triggers / finished,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark monorepo-scheduler on synthetic data")
+    parser.add_argument("--jobs", default="10,100,1000,10000", help="Comma-separated catalog sizes to generate")
+    parser.add_argument("--runs", type=int, default=100_000, help="JobRun rows to seed for the API benchmarks")
+    parser.add_argument("--log-mb", type=int, default=64, help="Size of the log file used for log retrieval")
+    parser.add_argument("--triggers", type=int, default=500, help="No-op runs to trigger for throughput")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per benchmark")
+    parser.add_argument("--workdir", help="Directory for generated data (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data")
+    parser.add_argument("--output", "-o", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.jobs.split(",") if s]
+    root = Path(args.workdir or tempfile.mkdtemp(prefix="scheduler-bench-")).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    # db.py opens ./runs.db, so run from inside the scratch directory.
+    os.chdir(root)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": datetime.utcnow().isoformat(),
+        "params": {
+            "jobs": sizes, "runs": args.runs, "log_mb": args.log_mb,
+            "triggers": args.triggers, "repeat": args.repeat,
+        },
+        "results": [],
+    }
+    try:
+        # main.apply_target reports progress on stdout; keep stdout for the JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            report["results"] += bench_catalog(root, sizes, args.repeat)
+            report["results"] += bench_api(root, max(sizes), args.runs, args.log_mb, args.triggers, args.repeat)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
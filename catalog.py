@@ -1,15 +1,24 @@
 """Shared job catalog logic for monorepo-scheduler."""
 
+import hashlib
+import json
 import logging
 import shlex
+import sys
+import threading
 import yaml
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import secretcache
+from scheduler import jitter_offset, resolve_hashed
+
 logger = logging.getLogger(__name__)
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 WRAPPER_PATH = Path("/usr/local/bin/monorepo-scheduler-wrapper.sh")
 RUN_LOG = SCRIPT_DIR / "run_log.csv"
+SECRETCACHE_PATH = SCRIPT_DIR / "secretcache.py"
 
 
 def load_yaml(path):
@@ -21,65 +30,307 @@ def shell_quote(s):
     return shlex.quote(str(s))
 
 
-def load_catalog(config_path: str | Path = "targets.yaml"):
-    """Parse targets.yaml and each target's schedule.yml, returning a list of job dicts."""
-    logger.info("Loading catalog from %s", config_path)
-    config = load_yaml(config_path)
-    doppler = config.get("doppler", {})
+class Catalog:
+    """Immutable collection of job dicts with lookup indexes.
+
+    Iterates like the plain job list it replaces. ``by_id`` maps job_id to job
+    and ``by_group`` maps each group to the frozenset of job_ids it grants;
+    the accessible set for a given combination of groups is memoized.
+    ``digest`` identifies the file contents it was built from.
+    """
+
+    def __init__(self, jobs: list[dict], config: dict | None = None, digest: str = ""):
+        self.jobs = jobs
+        self.config = config or {}
+        self.digest = digest
+        self.by_id = {job["job_id"]: job for job in jobs}
+
+        by_group: dict[str, set[str]] = {}
+        for job in jobs:
+            for group in job.get("groups", []):
+                by_group.setdefault(group, set()).add(job["job_id"])
+        self.by_group = {group: frozenset(ids) for group, ids in by_group.items()}
+
+        self._access: dict[frozenset, tuple[frozenset, list[dict]]] = {}
+
+    def __iter__(self):
+        return iter(self.jobs)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def _resolve(self, groups) -> tuple[frozenset, list[dict]]:
+        key = frozenset(groups)
+        cached = self._access.get(key)
+        if cached is None:
+            ids = frozenset().union(*(self.by_group.get(g, frozenset()) for g in key))
+            cached = (ids, [job for job in self.jobs if job["job_id"] in ids])
+            self._access[key] = cached
+        return cached
+
+    def accessible_ids(self, groups) -> frozenset:
+        """Return the job_ids visible to a user with the given groups."""
+        return self._resolve(groups)[0]
+
+    def jobs_for(self, groups) -> list[dict]:
+        """Return the jobs visible to a user with the given groups, in catalog order."""
+        return self._resolve(groups)[1]
+
+    def get(self, job_id: str, groups=None) -> dict | None:
+        """Look up a job by id, optionally restricted to the given groups."""
+        job = self.by_id.get(job_id)
+        if job is None or groups is None:
+            return job
+        return job if job_id in self.accessible_ids(groups) else None
+
+    def diff(self, new: "Catalog") -> "CatalogDiff":
+        """Compare this catalog with a newer one."""
+        old_ids, new_ids = self.by_id.keys(), new.by_id.keys()
+        return CatalogDiff(
+            added=sorted(new_ids - old_ids),
+            removed=sorted(old_ids - new_ids),
+            changed=sorted(i for i in old_ids & new_ids if self.by_id[i] != new.by_id[i]),
+        )
+
+
+@dataclass
+class CatalogDiff:
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def parse_schedule(target: dict, schedule_config: dict) -> list[dict]:
+    """Turn one target's parsed schedule file into job dicts."""
+    name = target["name"]
+    repo_path = Path(target["repo_path"])
+    defaults = schedule_config.get("defaults", {})
+    jobs = []
+
+    for job in schedule_config.get("schedules", []):
+        env_vars = defaults.get("env", {})
+        env_prefix = " ".join(f'{k}={shell_quote(v)}' for k, v in env_vars.items())
+        command = job["command"]
+        final_command = f"{env_prefix} {command}" if env_prefix else command
+
+        log_file = job.get("log_file", f"{defaults.get('log_dir', 'logs')}/{job['name']}.log")
+        abs_log_path = repo_path / log_file
+        log_retention = {**defaults.get("log_retention", {}), **job.get("log_retention", {})}
+        limits = {**defaults.get("limits", {}), **job.get("limits", {})}
+
+        job_id = f"{name}-{job['name']}"
+        cron_spec = job.get("cron")
+        cron = cron_spec
+        if cron_spec:
+            try:
+                cron = resolve_hashed(cron_spec, job_id)
+            except ValueError as e:
+                logger.error("Job %s: %s", job_id, e)
+        jitter = job.get("jitter_seconds", defaults.get("jitter_seconds"))
+        depends_on = job.get("depends_on") or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        runs_on = job.get("runs_on", defaults.get("runs_on", target.get("runs_on"))) or []
+        if isinstance(runs_on, str):
+            runs_on = [runs_on]
+
+        jobs.append({
+            "job_id": job_id,
+            "target_name": name,
+            "repo_path": str(repo_path),
+            "command": final_command,
+            "log_file": str(abs_log_path),
+            "hc_slug": job.get("hc_slug", ""),
+            "cron": cron,  # effective expression, with H fields resolved
+            "cron_spec": cron_spec,
+            "fire_offset": jitter_offset(job_id, jitter) if cron else 0,
+            "groups": target.get("groups", []),
+            "max_concurrency": job.get("max_concurrency"),
+            "target_max_concurrency": target.get("max_concurrency"),
+            "misfire_policy": job.get("misfire_policy"),
+            "log_retention": log_retention or None,
+            "limits": limits or None,
+            # Names of jobs in the same schedule file, as job_ids.
+            "depends_on": [f"{name}-{dep}" for dep in depends_on],
+            # Worker agent labels; jobs without any run in the API's executor.
+            "runs_on": sorted(runs_on),
+        })
+
+    return jobs
+
+
+def load_target_jobs(target: dict) -> list[dict] | None:
+    """Parse a target's schedule file, returning None if it does not exist."""
+    name = target["name"]
+    schedule_path = Path(target["repo_path"]) / target["schedule_file"]
+
+    if not schedule_path.exists():
+        logger.warning("Schedule file not found: %s (target '%s')", schedule_path, name)
+        return None
+
+    logger.info("Loading schedule for target '%s' from %s", name, schedule_path)
+    jobs = parse_schedule(target, load_yaml(schedule_path))
+    logger.info("Target '%s' has %d schedule(s)", name, len(jobs))
+    return jobs
+
+
+def compile_catalog(config: dict) -> Catalog:
+    """Build the Catalog for an already-parsed targets.yaml."""
     targets = config.get("targets", [])
     logger.info("Found %d target(s) in config", len(targets))
     jobs = []
 
     for target in targets:
-        name = target["name"]
         if not target.get("enabled", True):
-            logger.info("Target '%s' is disabled, skipping", name)
+            logger.info("Target '%s' is disabled, skipping", target["name"])
             continue
+        jobs.extend(load_target_jobs(target) or [])
 
-        repo_path = Path(target["repo_path"])
-        schedule_path = repo_path / target["schedule_file"]
+    return Catalog(jobs, config)
 
-        if not schedule_path.exists():
-            logger.warning("Schedule file not found: %s (target '%s')", schedule_path, name)
-            continue
 
-        logger.info("Loading schedule for target '%s' from %s", name, schedule_path)
-        schedule_config = load_yaml(schedule_path)
-        defaults = schedule_config.get("defaults", {})
-        schedules = schedule_config.get("schedules", [])
-        logger.info("Target '%s' has %d schedule(s)", name, len(schedules))
-
-        for job in schedule_config.get("schedules", []):
-            env_vars = defaults.get("env", {})
-            env_prefix = " ".join(f'{k}={shell_quote(v)}' for k, v in env_vars.items())
-            command = job["command"]
-            final_command = f"{env_prefix} {command}" if env_prefix else command
-
-            log_file = job.get("log_file", f"{defaults.get('log_dir', 'logs')}/{job['name']}.log")
-            abs_log_path = repo_path / log_file
-
-            jobs.append({
-                "job_id": f"{name}-{job['name']}",
-                "target_name": name,
-                "repo_path": str(repo_path),
-                "command": final_command,
-                "log_file": str(abs_log_path),
-                "hc_slug": job.get("hc_slug", ""),
-                "cron": job.get("cron"),
-                "groups": target.get("groups", []),
-            })
-
-    return jobs, config
-
-
-def build_wrapper_command(job, doppler_config, log_file_override=None):
-    """Build the full doppler run ... wrapper.sh ... command string for a job."""
+def load_catalog(config_path: str | Path = "targets.yaml"):
+    """Parse targets.yaml and each target's schedule.yml, returning a Catalog of job dicts and the config."""
+    logger.info("Loading catalog from %s", config_path)
+    config = load_yaml(config_path)
+    return compile_catalog(config), config
+
+
+class CatalogLoader:
+    """Builds catalogs, re-parsing only the files that changed since last time.
+
+    Each YAML file is cached with its (mtime, size) and content hash: an
+    unchanged stat skips the read, an unchanged hash skips the parse. Job
+    dicts are cached per target too, so editing one schedule file rebuilds
+    only that target's jobs.
+    """
+
+    def __init__(self, config_path: str | Path = "targets.yaml"):
+        self.config_path = Path(config_path)
+        self._lock = threading.Lock()
+        self._files: dict[Path, tuple[tuple[int, int], bytes, object]] = {}
+        self._targets: dict[str, tuple[str, bytes, list[dict]]] = {}
+
+    def _read(self, path: Path) -> tuple[bytes, object]:
+        """Return ``(digest, parsed)`` for a YAML file, using the cache when possible."""
+        st = path.stat()
+        stat_key = (st.st_mtime_ns, st.st_size)
+        cached = self._files.get(path)
+        if cached and cached[0] == stat_key:
+            return cached[1], cached[2]
+
+        raw = path.read_bytes()
+        digest = hashlib.sha256(raw).digest()
+        if cached and cached[1] == digest:
+            data = cached[2]
+        else:
+            logger.info("Parsing %s", path)
+            data = yaml.safe_load(raw)
+        self._files[path] = (stat_key, digest, data)
+        return digest, data
+
+    def watched_paths(self) -> list[Path]:
+        """targets.yaml plus the schedule file of every enabled target."""
+        with self._lock:
+            paths = [self.config_path]
+            cached = self._files.get(self.config_path)
+            config = cached[2] if cached else {}
+            for target in (config or {}).get("targets", []):
+                if target.get("enabled", True):
+                    paths.append(Path(target["repo_path"]) / target["schedule_file"])
+            return paths
+
+    def stale(self) -> bool:
+        """Whether any watched file has changed on disk since the last load."""
+        for path in self.watched_paths():
+            cached = self._files.get(path)
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                if cached:
+                    return True
+                continue
+            if not cached or cached[0] != (st.st_mtime_ns, st.st_size):
+                return True
+        return False
+
+    def load(self) -> Catalog:
+        with self._lock:
+            config_digest, config = self._read(self.config_path)
+            config = config or {}
+            jobs = []
+            seen = set()
+            hasher = hashlib.sha256(config_digest)
+
+            for target in config.get("targets", []):
+                name = target["name"]
+                if not target.get("enabled", True):
+                    continue
+                schedule_path = Path(target["repo_path"]) / target["schedule_file"]
+                try:
+                    digest, schedule_config = self._read(schedule_path)
+                except FileNotFoundError:
+                    logger.warning("Schedule file not found: %s (target '%s')", schedule_path, name)
+                    self._files.pop(schedule_path, None)
+                    continue
+                seen.add(schedule_path)
+                hasher.update(digest)
+
+                target_key = json.dumps(target, sort_keys=True)
+                cached = self._targets.get(name)
+                if cached and cached[0] == target_key and cached[1] == digest:
+                    target_jobs = cached[2]
+                else:
+                    target_jobs = parse_schedule(target, schedule_config)
+                    self._targets[name] = (target_key, digest, target_jobs)
+                jobs.extend(target_jobs)
+
+            # Forget files and targets that are no longer referenced.
+            for path in list(self._files):
+                if path != self.config_path and path not in seen:
+                    del self._files[path]
+            names = {t["name"] for t in config.get("targets", [])}
+            for name in list(self._targets):
+                if name not in names:
+                    del self._targets[name]
+
+            return Catalog(jobs, config, hasher.hexdigest())
+
+
+def build_wrapper_command(job, doppler_config, log_file_override=None, with_secrets=True):
+    """Build the full doppler run ... wrapper.sh ... command string for a job.
+
+    With ``doppler.cache`` set, secrets come from a secretcache.py snapshot
+    instead of a ``doppler run`` round trip per run. ``with_secrets=False``
+    leaves them out entirely, for callers that inject the environment
+    themselves.
+    """
     doppler_project = doppler_config.get("project", "")
     doppler_conf = doppler_config.get("config", "")
     log_file = log_file_override or job["log_file"]
 
+    if not with_secrets:
+        prefix = ""
+    elif doppler_config.get("cache"):
+        prefix = (
+            f"{shell_quote(sys.executable)} {shell_quote(SECRETCACHE_PATH)} "
+            f"--project {shell_quote(doppler_project)} --config {shell_quote(doppler_conf)} "
+            f"--ttl {int(doppler_config.get('cache_ttl', secretcache.DEFAULT_TTL))} "
+            f"--max-stale-hours {int(doppler_config.get('max_stale_hours', secretcache.DEFAULT_MAX_STALE_HOURS))} "
+        )
+        if doppler_config.get("key_file"):
+            prefix += f"--key-file {shell_quote(doppler_config['key_file'])} "
+        if doppler_config.get("command"):
+            prefix += f"--provider {shell_quote(json.dumps(doppler_config['command']))} "
+        prefix += "-- "
+    else:
+        prefix = f"doppler run --project {shell_quote(doppler_project)} --config {shell_quote(doppler_conf)} -- "
+
     return (
-        f"doppler run --project {shell_quote(doppler_project)} --config {shell_quote(doppler_conf)} -- "
+        f"{prefix}"
         f"{WRAPPER_PATH} "
         f"{shell_quote(log_file)} "
         f"{shell_quote(job['repo_path'])} "
@@ -0,0 +1,206 @@
+"""Ingest cron-fired runs that wrapper.sh records in run_log.csv."""
+
+import csv
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from sqlmodel import Session
+
+import runlogs
+from catalog import RUN_LOG
+from db import IngestState, engine
+from runstore import RunStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_ROTATE_MB = 64
+INGEST_BATCH = 5000
+READ_SIZE = 1024 * 1024
+HEADER_PREFIX = b"timestamp,"
+
+
+def parse_line(line: str, job_targets: dict[str, str], log_sizes: dict[str, int]) -> Optional[dict]:
+    """Turn one run_log.csv row into JobRun fields, or None if it is malformed.
+
+    Rows are ``timestamp,job_id,exit_code,duration_seconds[,run_id,start_epoch]``;
+    rows written before wrapper.sh recorded a run_id get a stable one
+    derived from the job and start time, so re-reading them is harmless.
+    ``log_sizes`` maps run_ids to the sizes of the logs wrapper.sh left in
+    LOGS_DIR.
+    """
+    try:
+        # wrapper.sh never quotes fields; csv is only needed for hand-edited lines.
+        fields = next(csv.reader([line])) if '"' in line else line.rstrip("\r").split(",")
+        timestamp, job_id, exit_code, duration = fields[:4]
+        exit_code, duration_ms = int(exit_code), int(duration) * 1000
+        if len(fields) >= 6 and fields[4] and fields[5]:
+            run_id = fields[4]
+            started_at = datetime.fromtimestamp(int(fields[5]), timezone.utc).replace(tzinfo=None)
+        else:
+            run_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"run_log.csv:{job_id}:{timestamp}"))
+            # wrapper.sh writes local time; the API records UTC.
+            local = datetime.fromisoformat(timestamp)
+            started_at = local.astimezone(timezone.utc).replace(tzinfo=None)
+    except (StopIteration, ValueError):
+        return None
+    return {
+        "run_id": run_id,
+        "job_id": job_id,
+        "target_name": job_targets.get(job_id, ""),
+        "status": "success" if exit_code == 0 else "failed",
+        "triggered_by": "cron",
+        "started_at": started_at,
+        "queued_at": started_at,
+        "finished_at": started_at + timedelta(milliseconds=duration_ms),
+        "exit_code": exit_code,
+        "duration_ms": duration_ms,
+        "queue_wait_ms": 0,
+        "log_bytes": log_sizes.get(run_id),
+    }
+
+
+class CronRunIngester:
+    """Tail run_log.csv into the JobRun table.
+
+    Cron-fired jobs only append a line to run_log.csv, so without this the
+    API never sees them. A background thread reads the file from the byte
+    offset saved in IngestState and hands complete lines to the run store in
+    batches of INGEST_BATCH; each batch and the new offset commit together.
+
+    A smaller file than the saved offset means it was truncated, and a new
+    inode means it was rotated: the rest of the old file is read first if
+    it is still next to it as ``run_log.csv.1``. Once everything is read
+    and the file is over ``rotate_mb``, the ingester rotates it itself;
+    wrapper.sh starts a fresh file on its next run. ``on_ingested`` is
+    called with the runs of each batch, e.g. to archive and index their logs.
+    """
+
+    def __init__(
+        self,
+        run_store: RunStore,
+        path: Path = RUN_LOG,
+        on_ingested: Optional[Callable[[list[dict]], None]] = None,
+    ):
+        self.run_store = run_store
+        self.path = Path(path)
+        self.on_ingested = on_ingested
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self.rotate_bytes = DEFAULT_ROTATE_MB * 1024 * 1024
+
+        self._job_targets: dict[str, str] = {}
+        self._saved: tuple[Optional[int], int] = (None, 0)  # committed (inode, offset)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, jobs: Iterable[dict], config: dict):
+        """Take the catalog's jobs and the ``run_log`` section of targets.yaml."""
+        self._job_targets = {job["job_id"]: job["target_name"] for job in jobs}
+        self.poll_interval = config.get("poll_interval", DEFAULT_POLL_INTERVAL)
+        self.rotate_bytes = config.get("rotate_mb", DEFAULT_ROTATE_MB) * 1024 * 1024
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="cron-runs", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.ingest_pending()
+            except Exception:
+                logger.exception("Ingesting %s failed", self.path)
+            self._stop.wait(self.poll_interval)
+
+    def ingest_pending(self) -> int:
+        """Ingest everything appended since the last call; returns the number of rows read."""
+        source = str(self.path)
+        with Session(engine) as session:
+            saved = session.get(IngestState, source)
+            state = IngestState(**saved.model_dump()) if saved else IngestState(source=source)
+        self._saved = (state.inode, state.offset)
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        if state.inode is not None and state.inode != st.st_ino:
+            rotated = self.path.with_name(self.path.name + ".1")
+            try:
+                if rotated.stat().st_ino == state.inode:
+                    count += self._ingest_file(rotated, state)
+            except FileNotFoundError:
+                pass
+            logger.info("%s was rotated, reading the new file from the start", self.path)
+            state.offset = 0
+        elif st.st_size < state.offset:
+            logger.warning("%s was truncated, reading it again from the start", self.path)
+            state.offset = 0
+        state.inode = st.st_ino
+        count += self._ingest_file(self.path, state)
+
+        if state.offset >= self.rotate_bytes and state.offset == self.path.stat().st_size:
+            # Lines appended after the size check are picked up from .1 next pass.
+            self.path.replace(self.path.with_name(self.path.name + ".1"))
+            logger.info("Rotated %s after ingesting %d bytes", self.path, state.offset)
+        return count
+
+    def _ingest_file(self, path: Path, state: IngestState) -> int:
+        count = 0
+        runs: list[dict] = []
+        offset = state.offset
+        # One directory scan instead of a stat per line; only running and
+        # just-finished runs' logs live at the top of LOGS_DIR.
+        log_sizes = {
+            entry.name[:-4]: entry.stat().st_size
+            for entry in os.scandir(runlogs.LOGS_DIR) if entry.name.endswith(".log")
+        }
+        with open(path, "rb") as f:
+            f.seek(offset)
+            buffer = b""
+            while chunk := f.read(READ_SIZE):
+                buffer += chunk
+                # Leave a partial last line for the next pass.
+                complete, newline, buffer = buffer.rpartition(b"\n")
+                if not newline:
+                    continue
+                for raw in complete.split(b"\n"):
+                    offset += len(raw) + 1
+                    count += 1
+                    if not raw.strip() or raw.startswith(HEADER_PREFIX):
+                        continue
+                    run = parse_line(raw.decode("utf-8", errors="replace"), self._job_targets, log_sizes)
+                    if run is None:
+                        logger.warning("Skipping malformed line in %s: %r", path, raw[:200])
+                        continue
+                    runs.append(run)
+                    if len(runs) >= INGEST_BATCH:
+                        self._commit(runs, state, offset)
+                        runs = []
+                if self._stop.is_set():
+                    break
+        self._commit(runs, state, offset)
+        return count
+
+    def _commit(self, runs: list[dict], state: IngestState, offset: int):
+        if not runs and (state.inode, offset) == self._saved:
+            return
+        state.offset = offset
+        state.updated_at = datetime.utcnow()
+        self.run_store.ingest(runs, IngestState(**state.model_dump()), wait=True)
+        self._saved = (state.inode, offset)
+        if runs and self.on_ingested is not None:
+            self.on_ingested(runs)
@@ -0,0 +1,224 @@
+"""Run history database for monorepo-scheduler."""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import Index, event, inspect, text
+from sqlmodel import Field, Session, SQLModel, create_engine
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = "sqlite:///./runs.db"
+INIT_LOCK_PATH = "./runs.db.init-lock"
+RUN_CHANGES_PATH = "./runs.db.changes"
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30},
+    pool_size=10,
+    max_overflow=20,
+)
+
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer (and vice versa).
+    "journal_mode": "WAL",
+    # Safe with WAL: a crash can lose the last commits but not corrupt the DB.
+    "synchronous": "NORMAL",
+    "busy_timeout": 30000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# SQLModel models
+class JobRun(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_jobrun_job_id_started_at", "job_id", "started_at"),
+        Index("ix_jobrun_status_started_at", "status", "started_at"),
+        Index("ix_jobrun_started_at_run_id", "started_at", "run_id"),
+        # One run per job in a pipeline; NULLs (runs outside pipelines) never clash.
+        Index("ix_jobrun_parent_run_id_job_id", "parent_run_id", "job_id", unique=True),
+        Index("ix_jobrun_worker_id_status", "worker_id", "status"),
+    )
+
+    run_id: str = Field(primary_key=True)
+    job_id: str
+    target_name: str
+    status: str  # queued, running, success, failed, cancelled
+    triggered_by: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    exit_code: Optional[int] = None
+    error_message: Optional[str] = None
+    duration_ms: Optional[int] = None
+    queued_at: Optional[datetime] = None
+    queue_wait_ms: Optional[int] = None
+    rolled_up: Optional[bool] = None  # counted in JobRunDaily
+    log_bytes: Optional[int] = None  # uncompressed size of the run log
+    parent_run_id: Optional[str] = None  # PipelineRun this run belongs to
+    cancelled_by: Optional[str] = None  # set when a cancel is requested
+    # Resource usage of the run's processes, from wait4.
+    max_rss_kb: Optional[int] = None
+    cpu_user_ms: Optional[int] = None
+    cpu_system_ms: Optional[int] = None
+    io_read_blocks: Optional[int] = None
+    io_write_blocks: Optional[int] = None
+    # Set while a worker agent holds the run; it is requeued once the lease expires.
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    attempts: Optional[int] = None  # times a worker agent claimed the run
+
+
+class JobRunDaily(SQLModel, table=True):
+    """Per-job daily aggregates of finished runs, kept after retention deletes them."""
+
+    job_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    runs: int = 0
+    failures: int = 0
+    duration_sum_ms: int = 0
+    duration_min_ms: Optional[int] = None
+    duration_max_ms: Optional[int] = None
+    duration_sketch: Optional[str] = None  # stats.DurationSketch as JSON
+    last_success_at: Optional[datetime] = None
+    last_failure_at: Optional[datetime] = None
+    cpu_sum_ms: Optional[int] = None  # over the runs with recorded resource usage
+    cpu_runs: Optional[int] = None
+    max_rss_kb: Optional[int] = None
+
+
+class IngestState(SQLModel, table=True):
+    """How far an append-only source (e.g. run_log.csv) has been ingested."""
+
+    source: str = Field(primary_key=True)
+    inode: Optional[int] = None
+    offset: int = 0
+    updated_at: Optional[datetime] = None
+
+
+class PipelineRun(SQLModel, table=True):
+    """A batch of dependent jobs triggered together; each job runs as a child JobRun."""
+
+    run_id: str = Field(primary_key=True)
+    status: str  # running, success, failed
+    triggered_by: str
+    jobs: str  # JSON {job_id: [upstream job_ids]}, in dependency order
+    max_parallel: int
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[int] = None
+    critical_path_ms: Optional[int] = None
+    critical_path: Optional[str] = None  # JSON list of job_ids
+    error_message: Optional[str] = None
+
+
+class Worker(SQLModel, table=True):
+    """A worker agent process (agent.py) pulling runs from the queue."""
+
+    worker_id: str = Field(primary_key=True)
+    hostname: str
+    pid: int
+    labels: str  # JSON list
+    targets: Optional[str] = None  # JSON list; None means any target
+    max_runs: int
+    started_at: datetime
+    heartbeat_at: datetime
+
+
+class CatalogVersion(SQLModel, table=True):
+    """The catalog generation every API worker process should be serving."""
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = 0
+    digest: str = ""
+    updated_at: Optional[datetime] = None
+
+
+class ChangeCounter:
+    """Sequence number bumped by every process after it changes JobRun rows.
+
+    It lives in a small file next to the database rather than in it, so the
+    API can tell whether runs changed (e.g. to answer a conditional GET) with
+    one pread instead of a query. A new file starts from the clock, so a
+    recreated counter does not repeat values handed out before.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _open(self) -> int:
+        if self._fd is None:
+            with self._lock:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def value(self) -> int:
+        data = os.pread(self._open(), 8, 0)
+        return int.from_bytes(data, "little") if len(data) == 8 else 0
+
+    def bump(self):
+        fd = self._open()
+        # flock excludes other processes; threads here share the descriptor.
+        with self._lock:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                os.pwrite(fd, ((self.value() or time.time_ns()) + 1).to_bytes(8, "little"), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+run_changes = ChangeCounter(RUN_CHANGES_PATH)
+
+
+def init_db():
+    """Create missing tables, columns and indexes.
+
+    ``create_all`` only handles tables it creates itself, so nullable columns
+    and indexes declared after a database already exists are added here.
+    Worker processes starting together take turns, so DDL never races;
+    singleton rows they all update later are seeded here for the same reason.
+    """
+    with open(INIT_LOCK_PATH, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _migrate()
+
+
+def _migrate():
+    SQLModel.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            logger.info("Adding column %s.%s", table.name, column.name)
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with Session(engine) as session:
+        if session.get(CatalogVersion, 1) is None:
+            session.add(CatalogVersion(id=1))
+            session.commit()
+
+
+def get_session():
+    with Session(engine) as session:
+        yield session
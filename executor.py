@@ -0,0 +1,525 @@
+"""Bounded dispatcher and asyncio executor for job runs."""
+
+import asyncio
+import json
+import logging
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from metrics import LOG_BYTES, SPAWN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_QUEUE = 100
+QUEUE_POLL_INTERVAL = 0.5
+
+READ_CHUNK = 64 * 1024
+FLUSH_BYTES = 64 * 1024
+FLUSH_INTERVAL = 0.5
+ERROR_TAIL_LINES = 5
+MAX_TAIL_LINE = 4096
+STOP_POLL_INTERVAL = 0.5  # how often a run checks its timeout and cancellation
+KILL_GRACE = 10  # seconds between SIGTERM and SIGKILL
+
+
+class QueueFull(Exception):
+    """Raised when a run cannot be queued because the queue is at capacity."""
+
+
+@dataclass
+class PendingRun:
+    run_id: str
+    job: dict
+    cmd: str
+    triggered_by: str
+    queued_at: datetime = field(default_factory=datetime.utcnow)
+    # Doppler project/config whose cached secrets the executor injects, when
+    # ``cmd`` does not fetch them itself.
+    doppler: Optional[dict] = None
+    parent_run_id: Optional[str] = None  # PipelineRun the run belongs to
+    cancel: threading.Event = field(default_factory=threading.Event)
+    cancelled_by: Optional[str] = None
+
+
+class OutputTail:
+    """Ring buffer of the last few non-blank lines of a byte stream."""
+
+    def __init__(self, max_lines: int = ERROR_TAIL_LINES):
+        self._lines: deque[bytes] = deque(maxlen=max_lines)
+        self._partial = b""
+
+    def feed(self, chunk: bytes):
+        parts = (self._partial + chunk).split(b"\n")
+        # Cap an unterminated line so a stream without newlines stays bounded.
+        self._partial = parts.pop()[-MAX_TAIL_LINE:]
+        recent = []
+        for line in reversed(parts):
+            if line.strip():
+                recent.append(line[-MAX_TAIL_LINE:].rstrip())
+                if len(recent) == self._lines.maxlen:
+                    break
+        self._lines.extend(reversed(recent))
+
+    def lines(self) -> list[str]:
+        lines = list(self._lines)
+        if self._partial.strip():
+            lines = (lines + [self._partial.rstrip()])[-self._lines.maxlen:]
+        return [line.decode(errors="replace") for line in lines]
+
+
+@dataclass
+class RunLimits:
+    """A job's ``limits`` from its schedule file; None means unlimited.
+
+    ``max_memory_mb`` (address space) and ``cpu_seconds`` are rlimits, so
+    they apply to each process the run starts; ``timeout`` is wall-clock
+    time for the whole run.
+    """
+
+    timeout: Optional[float] = None
+    max_memory_mb: Optional[int] = None
+    cpu_seconds: Optional[int] = None
+
+    @classmethod
+    def from_job(cls, job: dict) -> "RunLimits":
+        limits = job.get("limits") or {}
+        return cls(limits.get("timeout"), limits.get("max_memory_mb"), limits.get("cpu_seconds"))
+
+    def launcher_args(self) -> list[str]:
+        """The rlimit arguments for launcher.py (see there)."""
+        as_bytes = int(self.max_memory_mb * 1024 * 1024) if self.max_memory_mb else 0
+        # SIGXCPU at the soft CPU limit, SIGKILL at the hard one.
+        cpu = int(self.cpu_seconds) if self.cpu_seconds else 0
+        return [str(as_bytes), str(cpu), str(cpu + KILL_GRACE if cpu else 0)]
+
+
+@dataclass
+class RunResult:
+    returncode: int
+    rusage: Optional[resource.struct_rusage] = None
+    stopped: Optional[str] = None  # "timeout" or "cancelled" if the run was killed
+
+
+def run_outcome(
+    result: RunResult, tail: OutputTail, limits: RunLimits, cancelled_by: Optional[str]
+) -> tuple[str, Optional[str]]:
+    """A finished run's JobRun status and error message."""
+    if result.stopped == "cancelled":
+        return "cancelled", f"Cancelled by {cancelled_by}"
+    if result.returncode == 0:
+        return "success", None
+    # Keep the last few lines of output as the error.
+    error_message = "\n".join(tail.lines())
+    if result.stopped == "timeout":
+        error_message = f"Timed out after {limits.timeout}s\n{error_message}"
+    return "failed", error_message
+
+
+def resource_usage(rusage: Optional[resource.struct_rusage]) -> dict:
+    """JobRun fields for a run's wait4 rusage; none if it was not reported."""
+    if rusage is None:
+        return {}
+    return {
+        "max_rss_kb": rusage.ru_maxrss,
+        "cpu_user_ms": int(rusage.ru_utime * 1000),
+        "cpu_system_ms": int(rusage.ru_stime * 1000),
+        "io_read_blocks": rusage.ru_inblock,
+        "io_write_blocks": rusage.ru_oublock,
+    }
+
+
+LAUNCHER = str(Path(__file__).resolve().parent / "launcher.py")
+
+
+def _signal_group(pgid: int, sig: int):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass  # the whole group has exited
+
+
+def _read_usage(fd: int) -> Optional[resource.struct_rusage]:
+    """The rusage launcher.py wrote to ``fd``; None if it was killed before it could."""
+    data = os.read(fd, 4096)
+    return resource.struct_rusage(json.loads(data)) if data else None
+
+
+def _wait4(pid: int) -> tuple[int, resource.struct_rusage]:
+    _, wait_status, rusage = os.wait4(pid, 0)
+    return wait_status, rusage
+
+
+def _watch_exit(loop: asyncio.AbstractEventLoop, pid: int) -> asyncio.Future:
+    """Future for a child's ``(wait status, rusage)``, reaped with wait4 once it exits."""
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd support: block a thread in wait4 instead.
+        return asyncio.ensure_future(asyncio.to_thread(_wait4, pid))
+    future = loop.create_future()
+
+    def reap():
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+        try:
+            future.set_result(_wait4(pid))
+        except OSError as e:
+            future.set_exception(e)
+
+    loop.add_reader(pidfd, reap)
+    return future
+
+
+async def run_command(
+    cmd: str,
+    log_file: Path,
+    tail: OutputTail,
+    env: Optional[dict] = None,
+    limits: Optional[RunLimits] = None,
+    cancel: Optional[threading.Event] = None,
+) -> RunResult:
+    """Run ``cmd`` through the shell, copying its output to ``log_file``.
+
+    ``env`` adds variables to the inherited environment.
+
+    Output is read in binary chunks and written to the log whenever
+    FLUSH_BYTES have accumulated or FLUSH_INTERVAL has passed, so followers
+    of the log see progress without a syscall per line.
+
+    The command runs in its own process group under ``limits``. Once
+    ``limits.timeout`` passes or ``cancel`` is set, the group gets SIGTERM,
+    then SIGKILL after KILL_GRACE seconds. It is started through
+    launcher.py, which reports the resource usage of the command and the
+    children it waited for; that is missing for a run killed with SIGKILL.
+    """
+    limits = limits or RunLimits()
+    loop = asyncio.get_running_loop()
+    report_fd, report_w = os.pipe()
+    try:
+        with SPAWN_SECONDS.time():
+            process = subprocess.Popen(
+                [sys.executable, "-I", "-S", LAUNCHER, str(report_w), *limits.launcher_args(), cmd],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env={**os.environ, **env} if env else None,
+                start_new_session=True,
+                pass_fds=(report_w,),
+            )
+    except BaseException:
+        os.close(report_fd)
+        raise
+    finally:
+        os.close(report_w)
+    reader = asyncio.StreamReader(limit=READ_CHUNK)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+    exited = _watch_exit(loop, process.pid)
+    deadline = time.monotonic() + limits.timeout if limits.timeout else None
+    stopped: Optional[str] = None
+    kill_at: Optional[float] = None
+
+    def check_stop(now: float):
+        nonlocal stopped, kill_at
+        if stopped is None:
+            if cancel is not None and cancel.is_set():
+                stopped = "cancelled"
+            elif deadline is not None and now >= deadline:
+                stopped = "timeout"
+            else:
+                return
+            _signal_group(process.pid, signal.SIGTERM)
+            kill_at = now + KILL_GRACE
+        elif kill_at is not None and now >= kill_at:
+            _signal_group(process.pid, signal.SIGKILL)
+            kill_at = None
+
+    pending = bytearray()
+    last_flush = time.monotonic()
+    try:
+        with open(log_file, "wb", buffering=0) as log:
+            while True:
+                timeout = STOP_POLL_INTERVAL
+                if pending:
+                    timeout = min(timeout, max(last_flush + FLUSH_INTERVAL - time.monotonic(), 0.01))
+                try:
+                    chunk = await asyncio.wait_for(reader.read(READ_CHUNK), timeout)
+                except asyncio.TimeoutError:
+                    chunk = None
+                if chunk:
+                    pending += chunk
+                    tail.feed(chunk)
+                now = time.monotonic()
+                if pending and (not chunk or len(pending) >= FLUSH_BYTES or now - last_flush >= FLUSH_INTERVAL):
+                    log.write(pending)
+                    LOG_BYTES.inc(len(pending))
+                    pending.clear()
+                    last_flush = now
+                if chunk == b"":
+                    break
+                check_stop(now)
+        # Output is closed, but the shell itself may not have exited yet.
+        while True:
+            try:
+                wait_status, _ = await asyncio.wait_for(asyncio.shield(exited), STOP_POLL_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                check_stop(time.monotonic())
+        rusage = _read_usage(report_fd)
+    finally:
+        transport.close()
+        os.close(report_fd)
+    if stopped is not None:
+        # Take down anything the job left behind in its group.
+        _signal_group(process.pid, signal.SIGKILL)
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    return RunResult(process.returncode, rusage, stopped)
+
+
+class Dispatcher:
+    """Start runs under a global worker cap and per-target/per-job limits.
+
+    Runs that cannot start immediately wait in a FIFO queue; a run blocked by
+    its own job or target limit does not hold up runs of other jobs behind it.
+    Runs fired by the scheduler are also held back while ``max_scheduled``
+    of them are executing, so jobs sharing a fire time start as others finish.
+    ``submit`` raises QueueFull once ``max_queue`` runs are waiting.
+
+    Runs execute as coroutines on a single event loop owned by the
+    dispatcher, so concurrent runs do not each hold an OS thread.
+    """
+
+    def __init__(
+        self,
+        execute: Callable[[PendingRun], Awaitable[None]],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        self._execute = execute
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_scheduled: Optional[int] = None
+
+        self._lock = threading.Lock()
+        self._pending: deque[PendingRun] = deque()
+        self._active = 0
+        self._active_by_job: Counter[str] = Counter()
+        self._active_by_target: Counter[str] = Counter()
+        self._active_scheduled = 0
+        self._runs: dict[str, PendingRun] = {}  # reserved, pending or active
+        self._reserved: set[str] = set()  # being recorded by submit's on_queued
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # Caller holds self._lock.
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=self._loop.run_forever, name="run-executor", daemon=True
+            ).start()
+        return self._loop
+
+    def configure(self, config: dict, max_scheduled: Optional[int] = None):
+        """Apply the ``executor`` section of targets.yaml and ``scheduler.max_running``."""
+        with self._lock:
+            self.max_workers = config.get("max_workers", DEFAULT_MAX_WORKERS)
+            self.max_queue = config.get("max_queue", DEFAULT_MAX_QUEUE)
+            self.max_scheduled = max_scheduled
+            self._pump()
+
+    def submit(self, run: PendingRun, on_queued: Optional[Callable[[PendingRun], None]] = None) -> bool:
+        """Queue a run, calling ``on_queued`` before any worker can pick it up.
+
+        The run's queue slot is reserved while ``on_queued`` runs, but not
+        under the dispatcher's lock: recording the run may wait on the
+        database, and finishing runs must not wait on that in turn.
+        Returns False if the run is already queued or running here.
+        """
+        with self._lock:
+            if run.run_id in self._runs:
+                return False
+            queued = len(self._pending) + len(self._reserved)
+            if queued >= self.max_queue:
+                raise QueueFull(f"{queued} run(s) already queued")
+            self._runs[run.run_id] = run
+            self._reserved.add(run.run_id)
+        try:
+            if on_queued:
+                on_queued(run)
+        except BaseException:
+            with self._lock:
+                self._reserved.discard(run.run_id)
+                self._runs.pop(run.run_id, None)
+            raise
+        with self._lock:
+            self._reserved.discard(run.run_id)
+            if run.cancel.is_set():
+                return True  # cancelled while it was being recorded; see cancel
+            self._pending.append(run)
+            self._pump()
+            return True
+
+    def run_ids(self) -> set[str]:
+        """Runs queued or executing in this dispatcher."""
+        with self._lock:
+            return set(self._runs)
+
+    def cancel(self, run_id: str, cancelled_by: str) -> Optional[str]:
+        """Drop a queued run or kill a running one.
+
+        Returns ``"queued"`` or ``"running"`` for what the run was doing, or
+        None if it is not in this dispatcher. A dropped run is not executed,
+        so the caller records its outcome.
+        """
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return None
+            run.cancelled_by = cancelled_by
+            run.cancel.set()
+            if run_id in self._reserved:
+                del self._runs[run_id]  # submit drops it once recorded
+                return "queued"
+            if not any(queued is run for queued in self._pending):
+                return "running"
+            self._pending = deque(queued for queued in self._pending if queued is not run)
+            del self._runs[run_id]
+            return "queued"
+
+    def capacity(self) -> int:
+        """How many more runs can be queued right now."""
+        with self._lock:
+            return self.max_queue - len(self._pending) - len(self._reserved)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "active_scheduled": self._active_scheduled,
+                "queued": len(self._pending) + len(self._reserved),
+                "active_by_job": {k: v for k, v in self._active_by_job.items() if v},
+                "queued_by_job": dict(Counter(run.job["job_id"] for run in self._pending)),
+            }
+
+    def _can_start(self, run: PendingRun) -> bool:
+        if run.triggered_by == "scheduler" and self.max_scheduled:
+            if self._active_scheduled >= self.max_scheduled:
+                return False
+        job = run.job
+        job_limit = job.get("max_concurrency")
+        if job_limit and self._active_by_job[job["job_id"]] >= job_limit:
+            return False
+        target_limit = job.get("target_max_concurrency")
+        if target_limit and self._active_by_target[job["target_name"]] >= target_limit:
+            return False
+        return True
+
+    def _pump(self):
+        # Caller holds self._lock.
+        if self._active >= self.max_workers or not self._pending:
+            return
+        waiting = deque()
+        while self._pending and self._active < self.max_workers:
+            run = self._pending.popleft()
+            if not self._can_start(run):
+                waiting.append(run)
+                continue
+            self._active += 1
+            self._active_by_job[run.job["job_id"]] += 1
+            self._active_by_target[run.job["target_name"]] += 1
+            self._active_scheduled += run.triggered_by == "scheduler"
+            asyncio.run_coroutine_threadsafe(self._worker(run), self._ensure_loop())
+        waiting.extend(self._pending)
+        self._pending = waiting
+
+    async def _worker(self, run: PendingRun):
+        try:
+            await self._execute(run)
+        except Exception:
+            logger.exception("Run %s (%s) failed to execute", run.run_id, run.job["job_id"])
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._active_by_job[run.job["job_id"]] -= 1
+                self._active_by_target[run.job["target_name"]] -= 1
+                self._active_scheduled -= run.triggered_by == "scheduler"
+                self._runs.pop(run.run_id, None)
+                self._pump()
+
+
+class QueueConsumer:
+    """Feed runs queued in the database by any API worker into a Dispatcher.
+
+    A trigger only has to insert a queued JobRun row, so worker processes
+    that are not the executor still accept them. ``fetch(exclude, limit)``
+    returns up to ``limit`` of the oldest queued runs not in ``exclude``;
+    they are submitted every ``poll_interval`` seconds (or on ``wake``), and
+    again after a restart, since the rows outlive the process.
+
+    Cancellations are recorded the same way; ``cancel`` is called first on
+    every pass to act on them, from the same thread that submits runs.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        fetch: Callable[[set[str], int], list[PendingRun]],
+        poll_interval: float = QUEUE_POLL_INTERVAL,
+        cancel: Optional[Callable[[], None]] = None,
+    ):
+        self.dispatcher = dispatcher
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.cancel = cancel
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="run-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.consume()
+            except Exception:
+                logger.exception("Consuming the run queue failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def consume(self) -> int:
+        """Submit queued runs this dispatcher has room for; returns how many."""
+        if self.cancel is not None:
+            self.cancel()
+        capacity = self.dispatcher.capacity()
+        if capacity <= 0:
+            return 0
+        submitted = 0
+        for run in self.fetch(self.dispatcher.run_ids(), capacity):
+            try:
+                submitted += self.dispatcher.submit(run)
+            except QueueFull:
+                break
+        return submitted
@@ -45,7 +45,8 @@ export default function useJobsApi() {
                     job_id: jobId,
                     run_id: runId
                 }
-            }
+            },
+            parseAs: 'text',
         });
     }
 
@@ -0,0 +1,142 @@
+"""Git synchronisation of target repositories for monorepo-scheduler."""
+
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CLONE_MODES = ("blobless", "shallow", "full")
+DEFAULT_CLONE_MODE = "blobless"
+DEFAULT_SYNC_WORKERS = 4
+
+
+class GitError(Exception):
+    """Raised when a git command exits non-zero."""
+
+
+@dataclass
+class SyncResult:
+    name: str
+    action: str  # cloned, updated, up-to-date, skipped, failed
+    head: Optional[str] = None
+    error: Optional[str] = None
+
+
+def git(*args, cwd: Optional[Path] = None) -> str:
+    cmd = ["git"] + (["-C", str(cwd)] if cwd else []) + list(args)
+    result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise GitError(f"{' '.join(cmd)}: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+def _remote_url(url: str) -> str:
+    # --filter and --depth are ignored for plain local paths; file:// enables them.
+    if "://" not in url and ":" not in url.split("/")[0] and Path(url).exists():
+        return Path(url).resolve().as_uri()
+    return url
+
+
+def _fetch_args(mode: str) -> list[str]:
+    if mode == "shallow":
+        return ["--depth", "1"]
+    if mode == "blobless":
+        return ["--filter=blob:none"]
+    return []
+
+
+def sparse_paths(target: dict) -> list[str]:
+    """Directories to check out for a target, or [] for a full checkout.
+
+    Only applies when the target lists ``sparse`` paths; the directory of the
+    schedule file is always added so the scheduler can read it.
+    """
+    paths = list(target.get("sparse") or [])
+    if not paths:
+        return []
+    schedule_dir = str(PurePosixPath(target["schedule_file"]).parent)
+    if schedule_dir != "." and schedule_dir not in paths:
+        paths.append(schedule_dir)
+    return paths
+
+
+def remote_head(repo_path: Path, branch: str) -> Optional[str]:
+    """Return the commit of ``branch`` on origin without fetching anything."""
+    out = git("ls-remote", "origin", f"refs/heads/{branch}", cwd=repo_path)
+    return out.split()[0] if out else None
+
+
+def clone_target(target: dict) -> SyncResult:
+    repo_path = Path(target["repo_path"])
+    branch = target.get("branch")
+    mode = target.get("clone", DEFAULT_CLONE_MODE)
+    paths = sparse_paths(target)
+
+    args = ["clone", "--no-checkout", *_fetch_args(mode)]
+    if branch:
+        args += ["--branch", branch, "--single-branch"]
+    git(*args, _remote_url(target["repo_url"]), str(repo_path))
+
+    if paths:
+        git("sparse-checkout", "set", "--cone", *paths, cwd=repo_path)
+    git("checkout", branch or "HEAD", cwd=repo_path)
+    return SyncResult(target["name"], "cloned", git("rev-parse", "HEAD", cwd=repo_path))
+
+
+def update_target(target: dict) -> SyncResult:
+    repo_path = Path(target["repo_path"])
+    branch = target["branch"]
+    mode = target.get("clone", DEFAULT_CLONE_MODE)
+
+    head = git("rev-parse", "HEAD", cwd=repo_path)
+    current_branch = git("rev-parse", "--abbrev-ref", "HEAD", cwd=repo_path)
+    remote = remote_head(repo_path, branch)
+    if remote is None:
+        raise GitError(f"Branch '{branch}' not found on origin")
+    if remote == head and current_branch == branch:
+        return SyncResult(target["name"], "up-to-date", head)
+
+    git("fetch", *_fetch_args(mode), "origin", f"+refs/heads/{branch}:refs/remotes/origin/{branch}", cwd=repo_path)
+    paths = sparse_paths(target)
+    if paths:
+        git("sparse-checkout", "set", "--cone", *paths, cwd=repo_path)
+    if current_branch != branch or mode == "shallow":
+        # A shallow history cannot be rebased; move the branch to origin's tip.
+        git("checkout", "-B", branch, f"origin/{branch}", cwd=repo_path)
+    else:
+        git("rebase", f"origin/{branch}", cwd=repo_path)
+    return SyncResult(target["name"], "updated", git("rev-parse", "HEAD", cwd=repo_path))
+
+
+def sync_target(target: dict) -> SyncResult:
+    """Clone a target repository if missing, otherwise bring it up to date.
+
+    Existing repositories are compared against origin with ``ls-remote``
+    first, so up-to-date targets cost one round trip and no fetch.
+    """
+    name = target["name"]
+    repo_path = Path(target["repo_path"])
+    mode = target.get("clone", DEFAULT_CLONE_MODE)
+    if mode not in CLONE_MODES:
+        return SyncResult(name, "failed", error=f"Unknown clone mode '{mode}'")
+    try:
+        if not (repo_path / ".git").exists():
+            if not target.get("repo_url"):
+                return SyncResult(name, "skipped", error="Repository missing and no repo_url set")
+            return clone_target(target)
+        if not target.get("branch"):
+            return SyncResult(name, "skipped")
+        return update_target(target)
+    except GitError as e:
+        logger.error("Sync of target '%s' failed: %s", name, e)
+        return SyncResult(name, "failed", error=str(e))
+
+
+def sync_all(targets: list[dict], max_workers: int = DEFAULT_SYNC_WORKERS) -> list[SyncResult]:
+    """Sync several targets at once on a bounded thread pool."""
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        return list(pool.map(sync_target, targets))
@@ -0,0 +1,264 @@
+"""Relay that delivers spooled Healthchecks pings from wrapper.sh."""
+
+import fcntl
+import gzip
+import http.client
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = Path("/var/lib/monorepo-scheduler/hc-spool")
+LOCK_NAME = "relay.lock"  # held while a relay runs; wrapper.sh tests it before spooling
+DEFAULT_MAX_BODY = 100_000  # Healthchecks' own request body limit
+DEFAULT_MAX_AGE_HOURS = 24
+DEFAULT_TIMEOUT = 10.0
+POLL_INTERVAL = 1.0
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+
+PINGS = REGISTRY.counter("healthchecks_pings_total", "Healthchecks pings handled by the relay", ("result",))
+SPOOLED = REGISTRY.gauge(
+    "healthchecks_spooled_pings", "Pings waiting in the spool",
+    collect=lambda: sum(1 for _ in (SPOOL_DIR / "new").glob("*.ping")) if (SPOOL_DIR / "new").is_dir() else 0,
+)
+
+
+class Ping:
+    """One spooled ping: ``signal`` (start, log, fail or an exit code) for a check URL."""
+
+    def __init__(self, path: Path, check: str, signal: str, body: bytes):
+        self.path = path
+        self.check = check
+        self.signal = signal
+        self.body = body
+
+    @classmethod
+    def read(cls, path: Path) -> "Ping":
+        header, _, body = path.read_bytes().partition(b"\n\n")
+        fields = dict(line.split("=", 1) for line in header.decode().splitlines() if "=" in line)
+        return cls(path, fields["check"], fields["signal"], body)
+
+    @property
+    def url(self) -> str:
+        return f"{self.check.rstrip('/')}/{self.signal}"
+
+    @property
+    def age(self) -> float:
+        # Spool file names start with the enqueue time in nanoseconds.
+        return time.time() - int(self.path.name.split("-", 1)[0]) / 1e9
+
+
+def spool(check: str, signal: str, body: bytes = b"", spool_dir: Path = SPOOL_DIR) -> Path:
+    """Queue a ping the same way wrapper.sh does: write to tmp/, rename into new/."""
+    name = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}-{signal}.ping"
+    tmp = spool_dir / "tmp" / name
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(f"check={check}\nsignal={signal}\n\n".encode() + body)
+    return tmp.replace(spool_dir / "new" / name)
+
+
+class PingRelay:
+    """Deliver pings from the on-disk spool over pooled keep-alive connections.
+
+    wrapper.sh writes each ping to ``spool_dir/new`` instead of calling curl,
+    so a slow or unreachable Healthchecks server never adds to a job's run
+    time. A background thread sends everything pending in one pass per
+    wake-up, reusing one HTTP connection per host, and deletes each file once
+    it is accepted. Pings survive restarts because they stay on disk until
+    delivered. Failed hosts are retried with exponential backoff, keeping
+    each check's pings in order. Pings older than ``max_age_hours`` are dropped.
+
+    A running relay holds a lock on ``spool_dir/relay.lock``. wrapper.sh
+    only spools while that lock is held, and curls Healthchecks itself
+    otherwise, so pings are not left waiting while the API is down.
+    """
+
+    def __init__(self, spool_dir: Path = SPOOL_DIR, timeout: float = DEFAULT_TIMEOUT):
+        self.spool_dir = Path(spool_dir)
+        self.timeout = timeout
+        self.max_body = DEFAULT_MAX_BODY
+        self.max_age = DEFAULT_MAX_AGE_HOURS * 3600
+        self.gzip = False
+
+        self._connections: dict[tuple[str, str], http.client.HTTPConnection] = {}
+        self._backoff: dict[str, float] = {}
+        self._retry_at: dict[str, float] = {}
+        self._lock_fd: Optional[int] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: dict):
+        """Apply the ``healthchecks`` section of targets.yaml."""
+        self.max_body = config.get("max_body", DEFAULT_MAX_BODY)
+        self.max_age = config.get("max_age_hours", DEFAULT_MAX_AGE_HOURS) * 3600
+        self.gzip = config.get("gzip", False)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        for sub in ("tmp", "new"):
+            (self.spool_dir / sub).mkdir(parents=True, exist_ok=True, mode=0o700)
+        self._take_lock()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="hc-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        self._stop.clear()
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+        if self._lock_fd is not None:
+            # wrapper.sh calls curl itself from here on.
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _take_lock(self):
+        """Hold relay.lock, unless another relay (e.g. one still stopping) does for now."""
+        if self._lock_fd is not None:
+            return
+        fd = os.open(self.spool_dir / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+        self._lock_fd = fd
+
+    def disable(self):
+        """Stop relaying so wrapper.sh goes back to calling curl itself."""
+        self.stop()
+        try:
+            (self.spool_dir / "new").rmdir()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("Healthchecks relay disabled with %d ping(s) still spooled", len(self.pending()))
+
+    def wake(self):
+        """Deliver pending pings now rather than at the next poll."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._take_lock()
+                self.deliver_pending()
+            except Exception:
+                logger.exception("Healthchecks relay pass failed")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def pending(self) -> list[Path]:
+        return sorted((self.spool_dir / "new").glob("*.ping"))
+
+    def deliver_pending(self) -> int:
+        """Send every deliverable spooled ping once; returns the number delivered."""
+        delivered = 0
+        blocked: set[str] = set()  # checks with an undelivered earlier ping
+        for path in self.pending():
+            if self._stop.is_set():
+                break
+            try:
+                ping = Ping.read(path)
+            except (OSError, KeyError, ValueError, UnicodeDecodeError):
+                logger.warning("Dropping unreadable Healthchecks spool file %s", path.name)
+                path.unlink(missing_ok=True)
+                PINGS.inc(result="dropped")
+                continue
+            if ping.check in blocked:
+                continue
+            if ping.age > self.max_age:
+                logger.warning("Dropping Healthchecks ping %s after %.0fh", ping.signal, ping.age / 3600)
+                path.unlink(missing_ok=True)
+                PINGS.inc(result="dropped")
+                continue
+
+            host = urlsplit(ping.check).netloc
+            if time.monotonic() < self._retry_at.get(host, 0):
+                blocked.add(ping.check)
+                continue
+            try:
+                status = self._send(ping)
+            except (OSError, http.client.HTTPException) as e:
+                status, error = None, str(e)
+            else:
+                error = f"HTTP {status}"
+
+            if status is not None and status < 400:
+                path.unlink(missing_ok=True)
+                self._backoff.pop(host, None)
+                self._retry_at.pop(host, None)
+                PINGS.inc(result="delivered")
+                delivered += 1
+            elif status is not None and 400 <= status < 500 and status != 429:
+                # Unknown check, bad key, etc.; retrying will not help.
+                logger.warning("Healthchecks rejected %s ping for %s: %s", ping.signal, _redact(ping.check), error)
+                path.unlink(missing_ok=True)
+                PINGS.inc(result="dropped")
+            else:
+                backoff = min(self._backoff.get(host, MIN_BACKOFF / 2) * 2, MAX_BACKOFF)
+                self._backoff[host] = backoff
+                self._retry_at[host] = time.monotonic() + backoff
+                logger.warning("Healthchecks ping to %s failed (%s), retrying in %.0fs", host, error, backoff)
+                blocked.add(ping.check)
+                PINGS.inc(result="retried")
+        return delivered
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conn = self._connections.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = self._connections[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def _send(self, ping: Ping) -> int:
+        url = urlsplit(ping.url)
+        path = url.path + (f"?{url.query}" if url.query else "")
+        body = ping.body[-self.max_body:] if ping.body else b""
+        headers = {"Connection": "keep-alive"}
+        if body and self.gzip:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in (1, 2):
+            conn = self._connection(url.scheme, url.netloc)
+            reused = conn.sock is not None
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+                return response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._connections.pop((url.scheme, url.netloc), None)
+                # A kept-alive connection the server already closed fails on
+                # first use; retry once on a fresh one.
+                if attempt == 2 or not reused:
+                    raise
+
+
+def _redact(check: str) -> str:
+    """Hide the ping key in a check URL for logging."""
+    parts = check.rstrip("/").split("/")
+    if len(parts) > 4:
+        parts[-2] = "***"
+    return "/".join(parts)
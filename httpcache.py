@@ -0,0 +1,87 @@
+"""ETags and a short-lived per-user cache for polled API responses."""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+DEFAULT_TTL = 5.0
+DEFAULT_MAX_ENTRIES = 2048
+# Bump when response payloads change shape, so old ETags stop matching.
+PAYLOAD_VERSION = 1
+
+
+def make_etag(key: Hashable, catalog_version: int, run_seq: Optional[int]) -> str:
+    """ETag for the response ``key`` identifies, as of the given catalog and run state.
+
+    ``key`` covers everything else the body depends on (user, path, query),
+    so the tag can be computed, and a conditional GET answered, without
+    building the response. ``run_seq`` is None for responses that do not
+    depend on runs.
+    """
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    seq = "-" if run_seq is None else run_seq
+    return f'"{PAYLOAD_VERSION}.{catalog_version}.{seq}.{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists ``etag`` (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """Recently built response bodies, by request key and the ETag they were built under.
+
+    A hit needs the same ETag, so nothing is served across a catalog reload
+    or a run change; the whole cache is dropped as soon as a new run
+    sequence is seen. Entries also expire after ``ttl`` seconds, bounding
+    staleness from writers that do not bump the sequence, and the least
+    recently used are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._run_seq: Optional[int] = None
+        self._entries: OrderedDict[Hashable, tuple[str, float, bytes, dict]] = OrderedDict()
+
+    def observe(self, run_seq: int):
+        """Drop everything if runs changed since the last call."""
+        with self._lock:
+            if run_seq != self._run_seq:
+                self._run_seq = run_seq
+                self._entries.clear()
+
+    def get(self, key: Hashable, etag: str) -> Optional[tuple[bytes, dict]]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            cached_etag, expires_at, body, headers = hit
+            if cached_etag != etag or expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body, headers
+
+    def put(self, key: Hashable, etag: str, body: bytes, headers: dict):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (etag, time.monotonic() + self.ttl, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
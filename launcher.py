@@ -0,0 +1,57 @@
+"""Run one job command and report its resource usage (used by executor.run_command).
+
+A process's peak RSS (``ru_maxrss``) starts out at that of the process it
+was forked from, and exec does not reset it, so a shell forked straight
+from the API process reported the API's few hundred MB for every run. The
+executor starts this script in a fresh interpreter instead; the command is
+forked from here, so its usage is its own, give or take the few MB this
+interpreter takes.
+
+Usage: python -I -S launcher.py REPORT_FD AS_BYTES CPU_SOFT CPU_HARD COMMAND
+
+The rlimits (0 for none) apply to the command only. Once it exits, its
+rusage is written to REPORT_FD as a JSON list and this process exits with
+the same status, re-raising the signal that killed the command if any.
+"""
+
+import json
+import os
+import resource
+import signal
+import sys
+
+# Signals the executor sends the whole process group to stop a run; the
+# command handles them, this process outlives it to report its usage.
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+def main(argv: list[str]):
+    report_fd, as_bytes, cpu_soft, cpu_hard = (int(arg) for arg in argv[1:5])
+    cmd = argv[5]
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(report_fd)
+            if as_bytes:
+                resource.setrlimit(resource.RLIMIT_AS, (as_bytes, as_bytes))
+            if cpu_soft:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+            os.execv("/bin/sh", ["/bin/sh", "-c", cmd])
+        except Exception as e:
+            print(f"launcher: {e}", file=sys.stderr)
+        os._exit(127)
+    for sig in STOP_SIGNALS:
+        signal.signal(sig, signal.SIG_IGN)
+    _, wait_status, rusage = os.wait4(pid, 0)
+    os.write(report_fd, json.dumps(list(rusage)).encode())
+    os.close(report_fd)
+    if os.WIFSIGNALED(wait_status):
+        sig = os.WTERMSIG(wait_status)
+        signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+        sys.exit(128 + sig)  # only if the signal does not terminate
+    sys.exit(os.waitstatus_to_exitcode(wait_status))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,75 @@
+"""Elect the one API worker process that executes runs."""
+
+import fcntl
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LOCK_PATH = Path("./executor.lock")
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class Leadership:
+    """Hold an exclusive ``flock`` on ``path`` to act as the executor.
+
+    Every API worker process creates one and calls ``start``. Whichever gets
+    the lock first calls ``on_elected`` and keeps the lock until it stops or
+    dies (the kernel releases it with the process); the others retry every
+    ``poll_interval`` seconds, so a surviving worker takes over. With a
+    single worker it is elected during ``start``, before serving requests.
+    """
+
+    def __init__(self, on_elected: Callable[[], None], path: Path = LOCK_PATH, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.path = Path(path)
+        self.on_elected = on_elected
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def start(self):
+        self._stop.clear()
+        if self._try_acquire():
+            return
+        logger.info("Another worker is the executor; serving API requests only")
+        self._thread = threading.Thread(target=self._loop, name="leadership", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        if self._fd is not None:
+            os.close(self._fd)  # releases the lock
+            self._fd = None
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_interval):
+            if self._try_acquire():
+                return
+
+    def _try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        logger.info("Worker %d is now the executor", os.getpid())
+        try:
+            self.on_elected()
+        except Exception:
+            logger.exception("Starting the executor failed")
+        return True
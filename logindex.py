@@ -0,0 +1,265 @@
+"""Full-text index of run logs, kept in SQLite FTS5 next to runs.db."""
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import runlogs
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = Path("./logindex.db")
+INDEX_CHUNK = 16 * 1024  # bytes of whole lines per indexed row
+MAX_CHUNKS_PER_RUN = 20  # matching rows read back per run for snippets
+MAX_MATCHES_PER_RUN = 5
+SNIPPET_LENGTH = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_runs (
+    run_id TEXT PRIMARY KEY,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS log_chunks (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    line INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_log_chunks_run_id ON log_chunks (run_id);
+-- Contentless: the text lives in the log files, so the index stays small.
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(body, content='');
+"""
+
+
+class InvalidQuery(ValueError):
+    """Raised for a search query with no searchable terms."""
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _chunks(path: Path) -> Iterator[tuple[int, int, int, bytes]]:
+    """Split a log into ``(offset, line, length, data)`` runs of whole lines."""
+    offset = line = 0
+    pending: list[bytes] = []
+    size = 0
+    with runlogs.open_log(path) as f:
+        for raw in f:
+            pending.append(raw)
+            size += len(raw)
+            if size >= INDEX_CHUNK:
+                yield offset, line, size, b"".join(pending)
+                offset += size
+                line += len(pending)
+                pending, size = [], 0
+    if pending:
+        yield offset, line, size, b"".join(pending)
+
+
+def _match_query(q: str) -> tuple[str, list[str]]:
+    """Quote each term, so user input is never parsed as FTS5 syntax."""
+    terms = [t for t in q.split() if any(c.isalnum() for c in t)]
+    if not terms:
+        raise InvalidQuery("Query has no searchable terms")
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms), [t.lower() for t in terms]
+
+
+class LogIndex:
+    """Searchable index of finished runs' logs.
+
+    ``submit`` queues a finished run; a background thread reads its log (live
+    or archived) and indexes it in INDEX_CHUNK pieces of whole lines, each
+    keeping its byte offset and first line number. The FTS5 table is
+    contentless, so ``search`` re-reads the matching pieces from the logs to
+    build snippets, and ``remove`` must be called with a log before it is
+    deleted to take its terms back out of the index.
+    """
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # guards _conn, the only writer
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._conn is None:
+                self._conn = _connect(self.path)
+                self._conn.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._loop, name="log-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Runs still queued are picked up again by the next startup's backfill.
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def submit(self, run_id: str, job_id: str, started_at: datetime):
+        if self._thread is not None:
+            self._queue.put((run_id, job_id, started_at))
+
+    def _loop(self):
+        while (item := self._queue.get()) is not None:
+            try:
+                self.index_run(*item)
+            except (OSError, sqlite3.Error):
+                logger.exception("Indexing log of run %s failed", item[0])
+
+    def indexed(self, run_ids: Iterable[str]) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id FROM indexed_runs WHERE run_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(run_ids)),),
+            ).fetchall()
+        return {run_id for run_id, in rows}
+
+    def index_run(self, run_id: str, job_id: str, started_at: datetime) -> int:
+        """Index one finished run's log; returns the number of rows added."""
+        path = runlogs.find_log(run_id, started_at)
+        if path is None:
+            return 0
+        added = 0
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM indexed_runs WHERE run_id = ?", (run_id,)).fetchone():
+                return 0
+            for offset, line, length, data in _chunks(path):
+                chunk_id = self._conn.execute(
+                    "INSERT INTO log_chunks (run_id, job_id, started_at, offset, length, line)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (run_id, job_id, started_at.isoformat(), offset, length, line),
+                ).lastrowid
+                self._conn.execute(
+                    "INSERT INTO log_fts (rowid, body) VALUES (?, ?)",
+                    (chunk_id, data.decode("utf-8", errors="replace")),
+                )
+                added += 1
+            self._conn.execute(
+                "INSERT INTO indexed_runs (run_id, indexed_at) VALUES (?, ?)",
+                (run_id, datetime.utcnow().isoformat()),
+            )
+        return added
+
+    def remove(self, run_id: str, path: Path):
+        """Drop a run from the index; call before its log at ``path`` is deleted."""
+        if self._conn is None:
+            return
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, offset FROM log_chunks WHERE run_id = ? ORDER BY offset", (run_id,)
+            ).fetchall()
+            if rows:
+                ids = dict((offset, chunk_id) for chunk_id, offset in rows)
+                try:
+                    # A contentless table needs the original text to delete a row.
+                    for offset, _, _, data in _chunks(path):
+                        if offset in ids:
+                            self._conn.execute(
+                                "INSERT INTO log_fts (log_fts, rowid, body) VALUES ('delete', ?, ?)",
+                                (ids[offset], data.decode("utf-8", errors="replace")),
+                            )
+                except OSError as e:
+                    # Its terms stay in the index but no longer match any chunk.
+                    logger.warning("Could not read %s to unindex run %s: %s", path, run_id, e)
+                self._conn.execute("DELETE FROM log_chunks WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM indexed_runs WHERE run_id = ?", (run_id,))
+
+    def search(
+        self,
+        q: str,
+        job_ids: Iterable[str],
+        since: Optional[datetime] = None,
+        before: Optional[int] = None,
+        limit: int = 20,
+    ) -> tuple[list[dict], Optional[int]]:
+        """Find the most recently indexed runs whose logs match every term in ``q``.
+
+        Returns up to ``limit`` runs with their matching lines, and a cursor
+        for the next page (pass it back as ``before``) when there may be more.
+        """
+        match, terms = _match_query(q)
+        sql = (
+            "SELECT c.id, c.run_id, c.job_id, c.started_at, c.offset, c.length, c.line"
+            " FROM log_fts JOIN log_chunks c ON c.id = log_fts.rowid"
+            " WHERE log_fts MATCH ? AND c.job_id IN (SELECT value FROM json_each(?))"
+        )
+        params: list = [match, json.dumps(list(job_ids))]
+        if since is not None:
+            sql += " AND c.started_at >= ?"
+            params.append(since.isoformat())
+        if before is not None:
+            sql += " AND log_fts.rowid < ?"
+            params.append(before)
+        # FTS5 walks rowids in order, so this stops once the page is full.
+        sql += " ORDER BY log_fts.rowid DESC"
+
+        runs: dict[str, dict] = {}
+        next_cursor = None
+        # A fresh connection per search keeps readers off the writer's lock.
+        conn = _connect(self.path)
+        try:
+            last_id = None
+            for chunk_id, run_id, job_id, started_at, offset, length, line in conn.execute(sql, params):
+                if run_id not in runs:
+                    if len(runs) == limit:
+                        next_cursor = last_id
+                        break
+                    runs[run_id] = {
+                        "run_id": run_id,
+                        "job_id": job_id,
+                        "started_at": started_at,
+                        "chunks": [],
+                    }
+                chunks = runs[run_id]["chunks"]
+                if len(chunks) < MAX_CHUNKS_PER_RUN:
+                    chunks.append((offset, length, line))
+                last_id = chunk_id
+        except sqlite3.OperationalError as e:
+            raise InvalidQuery(str(e)) from e
+        finally:
+            conn.close()
+
+        results = []
+        for run in runs.values():
+            chunks = sorted(run.pop("chunks"))
+            path = runlogs.find_log(run["run_id"], datetime.fromisoformat(run["started_at"]))
+            run["matches"] = _snippets(path, chunks, terms) if path else []
+            results.append(run)
+        return results, next_cursor
+
+
+def _snippets(path: Path, chunks: list[tuple[int, int, int]], terms: list[str]) -> list[dict]:
+    """Read the matching chunks of a log in one forward pass and pick out lines."""
+    matches = []
+    with runlogs.open_log(path) as f:
+        for offset, length, line in chunks:
+            f.seek(offset)
+            pos = offset
+            for i, raw in enumerate(f.read(length).split(b"\n")):
+                text = raw.decode("utf-8", errors="replace").rstrip("\r")
+                if any(term in text.lower() for term in terms):
+                    matches.append({"line": line + i + 1, "offset": pos, "text": text[:SNIPPET_LENGTH]})
+                    if len(matches) == MAX_MATCHES_PER_RUN:
+                        return matches
+                pos += len(raw) + 1
+    return matches
@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import json
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from catalog import (
     WRAPPER_PATH,
-    RUN_LOG,
+    Catalog,
     load_yaml,
-    shell_quote,
-    load_catalog,
+    parse_schedule,
     build_wrapper_command,
+    shell_quote,
 )
+from gitsync import sync_all
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 BASE_TARGETS = Path("targets.yaml")
 CRON_DIR = Path("/etc/cron.d")
 MAKEFILE_PATH = Path("Makefile")
+STATE_PATH = Path(".apply-state.json")
 WRAPPER_SRC = SCRIPT_DIR / "wrapper.sh"
+DEFAULT_WORKERS = 8
+# Job limits wrapper.sh applies to cron runs (the API enforces its own).
+LIMIT_ENV = {
+    "timeout": "SCHEDULER_TIMEOUT",
+    "max_memory_mb": "SCHEDULER_MAX_MEMORY_MB",
+    "cpu_seconds": "SCHEDULER_CPU_SECONDS",
+}
 
 
 def install_wrapper():
@@ -29,86 +41,142 @@ def install_wrapper():
     print(f"Installed wrapper script to {WRAPPER_PATH}")
 
 
-def apply_target(target, pull=False, doppler=None):
-    if not target.get("enabled", True):
-        return False
+def load_state():
+    if not STATE_PATH.exists():
+        return {}
+    try:
+        return json.loads(STATE_PATH.read_text())
+    except ValueError:
+        return {}
+
+
+def save_state(state):
+    tmp = STATE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
+    tmp.replace(STATE_PATH)
+
+
+def git_head(repo_path):
+    """Return the commit checked out in repo_path, reading .git directly when possible."""
+    git_dir = repo_path / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[5:]
+        ref_file = git_dir / ref
+        if ref_file.exists():
+            return ref_file.read_text().strip()
+        packed = git_dir / "packed-refs"
+        if packed.exists():
+            for line in packed.read_text().splitlines():
+                if line.endswith(f" {ref}"):
+                    return line.split()[0]
+    except (OSError, NotADirectoryError):
+        pass
+    result = subprocess.run(
+        ["git", "-C", str(repo_path), "rev-parse", "HEAD"], capture_output=True, text=True, check=False
+    )
+    return result.stdout.strip()
+
+
+def fingerprint(target, schedule_bytes, head, doppler, native, max_running=None):
+    """Hash everything the rendered cron file for a target depends on."""
+    h = hashlib.sha256()
+    h.update(json.dumps([target, doppler, native, max_running, str(WRAPPER_PATH)], sort_keys=True).encode())
+    h.update(head.encode())
+    h.update(schedule_bytes)
+    return h.hexdigest()
+
+
+def fire_times(job):
+    """Describe when a job actually fires, e.g. ``7,17,27,37,47,57 * * * * +37s``."""
+    if not job["cron"]:
+        return "manual only"
+    text = job["cron"]
+    if job.get("fire_offset"):
+        text += f" +{job['fire_offset']}s"
+    if job.get("cron_spec") and job["cron_spec"] != job["cron"]:
+        text += f" (from {job['cron_spec']})"
+    return text
+
+
+def render_cron(name, jobs, doppler, native, max_running=None):
+    lines = [f"# Auto-generated cron jobs for {name}\n"]
+    if native:
+        # The API's built-in scheduler fires these jobs; keep cron out of it.
+        lines.append("# Scheduled in-process by the API (scheduler.enabled)\n")
+        return "".join(lines) + "\n"
+    if max_running:
+        # wrapper.sh holds runs back while this many scheduled runs are executing on the host.
+        lines.append(f"SCHEDULER_MAX_RUNNING={int(max_running)}\n")
 
+    for job in jobs:
+        if job["cron"]:
+            command = build_wrapper_command(job, doppler)
+            limits = job.get("limits") or {}
+            env = " ".join(
+                f"{var}={shell_quote(limits[key])}" for key, var in LIMIT_ENV.items() if limits.get(key)
+            )
+            if env:
+                command = f"{env} {command}"
+            if job.get("fire_offset"):
+                command = f"sleep {int(job['fire_offset'])} && {command}"
+            lines.append(f"# {job['job_id']}: {fire_times(job)}\n")
+            lines.append(f"{job['cron']} root {command}\n")
+    return "".join(lines) + "\n"
+
+
+def apply_target(target, state, doppler=None, native=False, max_running=None):
+    """Bring one target's cron file up to date.
+
+    Returns ``(changed, jobs, target_state)``; ``jobs`` is None when the
+    schedule file is missing. Targets whose fingerprint matches the saved
+    state reuse their compiled jobs without re-parsing or re-rendering.
+    """
     name = target["name"]
     repo_path = Path(target["repo_path"])
     schedule_path = repo_path / target["schedule_file"]
-    print(f"Applying scheduler for {name}")
-
-    if pull and target.get("branch"):
-        subprocess.run(["git", "-C", str(repo_path), "fetch"], check=False)
-        subprocess.run(["git", "-C", str(repo_path), "checkout", target["branch"]], check=False)
-        subprocess.run(["git", "-C", str(repo_path), "pull", "--rebase"], check=False)
+    cron_file = CRON_DIR / f"{name}"
+    doppler = doppler or {}
 
     if not schedule_path.exists():
         print(f"⚠️  Schedule file not found for {name}: {schedule_path}")
-        return False
-
-    config = load_yaml(schedule_path)
-    defaults = config.get("defaults", {})
-    schedules = config.get("schedules", [])
-
-    cron_file = CRON_DIR / f"{name}"
-    lines = [f"# Auto-generated cron jobs for {name}\n"]
-
-    log_dir = repo_path / defaults.get("log_dir", "logs")
-    log_dir.mkdir(parents=True, exist_ok=True)
-
-    for job in schedules:
-        cron = job.get("cron")
-        if not cron:
-            continue
-        command = job["command"]
-        log_file = job.get("log_file", f"{defaults.get('log_dir', 'logs')}/{job['name']}.log")
-        abs_log_path = repo_path / log_file
-
-        env_vars = defaults.get("env", {})
-        env_prefix = " ".join(f'{k}={shell_quote(v)}' for k, v in env_vars.items())
-
-        final_command = f"{env_prefix} {command}" if env_prefix else command
+        return False, None, None
 
-        job_name = f"{name}-{job['name']}"
-        doppler_project = doppler.get("project", "") if doppler else ""
-        doppler_config = doppler.get("config", "") if doppler else ""
-
-        line = (
-            f"{cron} root doppler run --project {shell_quote(doppler_project)} --config {shell_quote(doppler_config)} -- {WRAPPER_PATH} "
-            f"{shell_quote(str(abs_log_path))} "
-            f"{shell_quote(str(repo_path))} "
-            f"{shell_quote(final_command)} "
-            f"{shell_quote(job_name)} "
-            f"{shell_quote(str(RUN_LOG))} "
-            f"{shell_quote(job.get('hc_slug', ''))} "
-        )
+    schedule_bytes = schedule_path.read_bytes()
+    fp = fingerprint(target, schedule_bytes, git_head(repo_path), doppler, native, max_running)
+    previous = state.get(name)
+    if previous and previous["fingerprint"] == fp and cron_file.exists():
+        print(f"⏩ No changes for {name}")
+        return False, previous["jobs"], previous
 
-        lines.append(line)
+    print(f"Applying scheduler for {name}")
+    jobs = parse_schedule(target, load_yaml(schedule_path))
+    for job in jobs:
+        Path(job["log_file"]).parent.mkdir(parents=True, exist_ok=True)
 
-    new_content = "".join(lines)
-    new_content += "\n\n"
+    target_state = {"fingerprint": fp, "jobs": jobs}
+    new_content = render_cron(name, jobs, doppler, native, max_running)
     existing_content = cron_file.read_text() if cron_file.exists() else ""
 
     if new_content == existing_content:
         print(f"⏩ No changes for {name}")
-        return False
+        return False, jobs, target_state
 
     cron_file.write_text(new_content)
-    print(f"Applied {len(schedules)} schedules for {name}")
-    return True
+    print(f"Applied {len(jobs)} schedules for {name}")
+    return True, jobs, target_state
 
 
-def generate_makefile(config):
-    jobs, _ = load_catalog(BASE_TARGETS)
-    doppler = config.get("doppler", {})
+def generate_makefile(jobs, doppler):
     targets = []
     rules = []
 
     for job in jobs:
         targets.append(job["job_id"])
         wrapper_call = build_wrapper_command(job, doppler, log_file_override="/dev/stdout")
-        rules.append(f"{job['job_id']}:\n\t{wrapper_call}")
+        rules.append(f"# fires: {fire_times(job)}\n{job['job_id']}:\n\t{wrapper_call}")
 
     content = f"# Auto-generated by monorepo-scheduler\n"
     content += f".PHONY: {' '.join(targets)}\n\n"
@@ -122,16 +190,38 @@ def generate_makefile(config):
 
 def main():
     parser = argparse.ArgumentParser(description="Apply cron schedules from monorepo targets")
-    parser.add_argument("--pull", action="store_true", help="Git pull target repos before applying")
+    parser.add_argument("--pull", action="store_true", help="Clone or update target repos before applying")
+    parser.add_argument("--jobs", "-j", type=int, default=DEFAULT_WORKERS, help="Targets to apply in parallel")
+    parser.add_argument("--force", action="store_true", help="Ignore saved fingerprints and re-apply every target")
     args = parser.parse_args()
 
     install_wrapper()
     config = load_yaml(BASE_TARGETS)
-    doppler = config.get("doppler")
-
-    generate_makefile(config)
-    results = [apply_target(t, pull=args.pull, doppler=doppler) for t in config.get("targets", [])]
-    changed = any(results)
+    doppler = config.get("doppler") or {}
+    scheduler_config = config.get("scheduler", {})
+    native = scheduler_config.get("enabled", False)
+    max_running = scheduler_config.get("max_running")
+    state = {} if args.force else load_state()
+
+    targets = [t for t in config.get("targets", []) if t.get("enabled", True)]
+    if args.pull:
+        for result in sync_all(targets, max_workers=args.jobs):
+            if result.action == "failed":
+                print(f"⚠️  Sync failed for {result.name}: {result.error}")
+            elif result.action != "skipped":
+                print(f"Synced {result.name}: {result.action} ({result.head[:12]})")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(
+            lambda t: apply_target(t, state, doppler=doppler, native=native, max_running=max_running), targets
+        ))
+
+    # One compiled catalog feeds both the cron files above and the Makefile.
+    catalog = Catalog([job for _, jobs, _ in results for job in jobs or []], config)
+    generate_makefile(catalog, doppler)
+
+    save_state({t["name"]: ts for t, (_, _, ts) in zip(targets, results) if ts})
+    changed = any(c for c, _, _ in results)
 
     if changed:
         subprocess.run(["service", "cron", "reload"], check=False)
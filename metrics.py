@@ -0,0 +1,441 @@
+"""Metrics in the Prometheus text exposition format, plus an on-demand profiler."""
+
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import math
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600)
+
+PROFILE_KEEP = 20
+PROFILE_TOP = 30
+SHARE_INTERVAL = 5.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+    shared = False  # whether values from other processes are added in (see SharedMetrics)
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def export(self) -> list:
+        """This process's values as ``[label values, value]`` pairs."""
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def render(self, others: Iterable[list] = ()) -> list[str]:
+        """Sample lines, adding in ``others`` (other processes' ``export()``) for shared metrics."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(others))
+        return lines
+
+    def _samples(self, others: Iterable[list]) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+    shared = True
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, others):
+        with self._lock:
+            values = dict(self._values)
+        for export in others:
+            for key, value in export:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """A gauge that is either set directly or read from ``collect`` at scrape time.
+
+    ``collect`` returns a number, or a dict of label-value tuples to numbers.
+    Gauges are not shared: they report the process serving the scrape.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self, others):
+        if self._collect is not None:
+            values = self._collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    shared = True
+
+    def __init__(self, name, help, labels=(), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [per-bucket counts..., sum]
+        self._values: dict[tuple, list] = {}
+
+    def export(self) -> list:
+        with self._lock:
+            return [[list(k), list(v)] for k, v in self._values.items()]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, others):
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        for export in others:
+            for key, series in export:
+                if len(series) != len(self.buckets) + 1:
+                    continue  # written by a process with other buckets
+                mine = values.setdefault(tuple(key), [0] * len(series))
+                values[tuple(key)] = [a + b for a, b in zip(mine, series)]
+        lines = []
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def export(self) -> dict[str, list]:
+        """Values of the shared metrics, by name, for SharedMetrics."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.export() for metric in metrics if metric.shared}
+
+    def render(self, others: Iterable[dict[str, list]] = ()) -> str:
+        """The exposition text, adding in other processes' ``export()`` for shared metrics."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        others = list(others)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render([o[metric.name] for o in others if metric.name in o] if metric.shared else ()))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "API request latency by route", ("method", "route", "status"))
+AUTH_SECONDS = REGISTRY.histogram(
+    "auth_verify_duration_seconds", "Time to verify credentials", ("result",))
+CATALOG_LOAD_SECONDS = REGISTRY.histogram(
+    "catalog_load_duration_seconds", "Time to load and compile the job catalog")
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    "db_commit_duration_seconds", "Latency of run store transactions")
+DB_BATCH_SIZE = REGISTRY.histogram(
+    "db_commit_batch_size", "Writes per run store transaction", buckets=(1, 2, 5, 10, 25, 50, 100, 200))
+SPAWN_SECONDS = REGISTRY.histogram(
+    "run_spawn_duration_seconds", "Time to start a run's subprocess")
+LOG_BYTES = REGISTRY.counter(
+    "run_log_bytes_total", "Bytes of run output written to log files")
+JOB_DURATION_SECONDS = REGISTRY.histogram(
+    "job_run_duration_seconds", "Run duration by job and outcome", ("job_id", "status"), JOB_DURATION_BUCKETS)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "job_queue_wait_seconds", "Time runs spent queued before starting", buckets=JOB_DURATION_BUCKETS)
+RESPONSE_CACHE = REGISTRY.counter(
+    "api_response_cache_total", "Polled GETs by outcome: not_modified, hit or miss", ("result",))
+
+
+class Profiler:
+    """Profile individual requests with cProfile while switched on.
+
+    When ``enabled``, each call to a wrapped endpoint whose path starts with
+    ``match`` is profiled in the thread it runs on, and the top functions by
+    cumulative time are kept for the last PROFILE_KEEP requests.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.match = ""
+        self._lock = threading.Lock()
+        self._profiles: deque[dict] = deque(maxlen=PROFILE_KEEP)
+
+    def configure(self, enabled: bool, match: str = ""):
+        self.enabled = enabled
+        self.match = match
+
+    def profiles(self) -> list[dict]:
+        with self._lock:
+            return list(self._profiles)
+
+    def _record(self, path: str, profile: cProfile.Profile, elapsed: float):
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with self._lock:
+            self._profiles.append({
+                "path": path,
+                "at": time.time(),
+                "duration_ms": round(elapsed * 1000, 3),
+                "stats": out.getvalue(),
+            })
+
+    def _start(self, path: str) -> Optional[cProfile.Profile]:
+        if not (self.enabled and path.startswith(self.match)):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profile is already running on this thread.
+            return None
+        return profile
+
+    def _finish(self, path: str, profile: Optional[cProfile.Profile], start: float):
+        if profile is not None:
+            profile.disable()
+            self._record(path, profile, time.perf_counter() - start)
+
+    def wrap(self, path: str, endpoint: Callable) -> Callable:
+        """Wrap a route endpoint, keeping its signature for dependency injection."""
+        # Routers re-create their routes when included under a prefix.
+        endpoint = getattr(endpoint, "_profiled", endpoint)
+
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                # Async endpoints share the event loop, so other requests'
+                # coroutines may show up in the profile too.
+                start, profile = time.perf_counter(), self._start(path)
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    self._finish(path, profile, start)
+        else:
+            @functools.wraps(endpoint)
+            def wrapper(*args, **kwargs):
+                start, profile = time.perf_counter(), self._start(path)
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    self._finish(path, profile, start)
+
+        wrapper._profiled = endpoint
+        return wrapper
+
+
+PROFILER = Profiler()
+
+
+def _write_json(path: Path, data):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedMetrics:
+    """Metrics and profiler state shared by the worker processes of the API.
+
+    Each process writes its shared metrics (counters and histograms) and
+    recent profiles to ``<pid>.json`` in ``directory`` every ``interval``
+    seconds, and applies the profiler settings saved in ``profiler.json``
+    there. The worker serving /metrics or the profiles adds in the other
+    live processes' files, so the answer does not depend on which worker
+    gets the request, though it can be up to ``interval`` seconds behind.
+    A process that exits takes its counts with it, which Prometheus treats
+    as a counter reset.
+    """
+
+    SETTINGS = "profiler.json"
+
+    def __init__(
+        self,
+        directory: Path,
+        registry: Registry = REGISTRY,
+        profiler: Profiler = PROFILER,
+        interval: float = SHARE_INTERVAL,
+    ):
+        self.directory = Path(directory)
+        self.registry = registry
+        self.profiler = profiler
+        self.interval = interval
+        self._path: Optional[Path] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._path = self.directory / f"{os.getpid()}.json"
+            self._stop.clear()
+            self.sync()
+            self._thread = threading.Thread(target=self._loop, name="shared-metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        if self._path is not None:
+            self._path.unlink(missing_ok=True)
+            self._path = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Sharing metrics failed")
+
+    def sync(self):
+        """Pick up the profiler settings and write out this process's state."""
+        settings = _read_json(self.directory / self.SETTINGS)
+        if settings is not None:
+            self.profiler.configure(settings["enabled"], settings["match"])
+        if self._path is not None:
+            _write_json(self._path, {
+                "pid": os.getpid(),
+                "metrics": self.registry.export(),
+                "profiles": self.profiler.profiles(),
+            })
+
+    def configure_profiler(self, enabled: bool, match: str = ""):
+        """Switch profiling on or off here now, and in the other processes at their next sync."""
+        self.profiler.configure(enabled, match)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _write_json(self.directory / self.SETTINGS, {"enabled": enabled, "match": match})
+
+    def others(self) -> list[dict]:
+        """The last state written by each other live process."""
+        states = []
+        for path in self.directory.glob("*.json"):
+            if not path.stem.isdigit() or path == self._path:
+                continue
+            if not _alive(int(path.stem)):
+                path.unlink(missing_ok=True)
+                continue
+            state = _read_json(path)
+            if state is not None:
+                states.append(state)
+        return states
+
+    def render(self) -> str:
+        return self.registry.render(state["metrics"] for state in self.others())
+
+    def profiles(self) -> list[dict]:
+        """Recent profiles from every process, oldest first, each with its ``pid``."""
+        profiles = [{**profile, "pid": os.getpid()} for profile in self.profiler.profiles()]
+        for state in self.others():
+            profiles.extend({**profile, "pid": state["pid"]} for profile in state["profiles"])
+        return sorted(profiles, key=lambda profile: profile["at"])
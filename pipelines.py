@@ -0,0 +1,176 @@
+"""Dependency-ordered batches of jobs, run as one parent pipeline."""
+
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from sqlmodel import Session, select
+
+from db import JobRun, PipelineRun, engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PARALLEL = 4
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class InvalidPipeline(ValueError):
+    """Raised for a pipeline naming unknown jobs or with a dependency cycle."""
+
+
+def plan(jobs_by_id: dict[str, dict], job_ids: Iterable[str]) -> dict[str, list[str]]:
+    """Return ``{job_id: upstream job_ids}`` for ``job_ids`` and everything they depend on.
+
+    Keys are in dependency order: every job comes after its upstreams.
+    """
+    graph: dict[str, list[str]] = {}
+    visiting: list[str] = []
+
+    def visit(job_id: str):
+        if job_id in graph:
+            return
+        if job_id in visiting:
+            cycle = visiting[visiting.index(job_id):] + [job_id]
+            raise InvalidPipeline(f"Dependency cycle: {' -> '.join(cycle)}")
+        job = jobs_by_id.get(job_id)
+        if job is None:
+            needed_by = f" (needed by '{visiting[-1]}')" if visiting else ""
+            raise InvalidPipeline(f"Unknown job '{job_id}'{needed_by}")
+        visiting.append(job_id)
+        upstream = job.get("depends_on") or []
+        for dep in upstream:
+            visit(dep)
+        visiting.pop()
+        graph[job_id] = list(upstream)
+
+    for job_id in job_ids:
+        visit(job_id)
+    if not graph:
+        raise InvalidPipeline("No jobs given")
+    return graph
+
+
+def critical_path(graph: dict[str, list[str]], durations: dict[str, int]) -> tuple[int, list[str]]:
+    """The chain of jobs whose run durations add up to the longest total.
+
+    Downstream jobs start as soon as their upstreams finish, so this bounds
+    how fast the pipeline could have run with unlimited parallelism.
+    """
+    best: dict[str, tuple[int, Optional[str]]] = {}
+    for job_id, upstream in graph.items():  # dependency order
+        before, via = max(((best[dep][0], dep) for dep in upstream), default=(0, None))
+        best[job_id] = (before + durations.get(job_id, 0), via)
+    if not best:
+        return 0, []
+    job_id = max(best, key=lambda j: best[j][0])
+    total, path = best[job_id][0], []
+    while job_id is not None:
+        path.append(job_id)
+        job_id = best[job_id][1]
+    return total, path[::-1]
+
+
+class Pipelines:
+    """Start each pipeline job once its upstreams have succeeded.
+
+    A PipelineRun row holds the dependency graph; its jobs run as ordinary
+    child JobRuns (``parent_run_id``), so ``advance`` can always work out
+    what to do next from the database alone: it queues every job whose
+    upstreams all succeeded, keeping at most ``max_parallel`` children
+    queued or running. A failed job's downstream jobs are never started.
+    Once nothing is left to run the pipeline is finished with its wall-clock
+    and critical-path durations.
+
+    ``start_job(job_id, pipeline)`` queues one child run, or records it as
+    failed if it cannot run. The executor calls ``advance`` whenever a child
+    finishes, and ``resume`` after a restart.
+    """
+
+    def __init__(self, start_job: Callable[[str, PipelineRun], None]):
+        self.start_job = start_job
+        self._lock = threading.Lock()
+
+    def create(self, graph: dict[str, list[str]], triggered_by: str, max_parallel: int) -> PipelineRun:
+        pipeline = PipelineRun(
+            run_id=str(uuid.uuid4()),
+            status="running",
+            triggered_by=triggered_by,
+            jobs=json.dumps(graph),
+            max_parallel=max_parallel,
+            started_at=datetime.utcnow(),
+        )
+        with Session(engine) as session:
+            session.add(pipeline)
+            session.commit()
+            session.refresh(pipeline)
+        self.advance(pipeline.run_id)
+        return pipeline
+
+    def resume(self):
+        """Advance every unfinished pipeline, e.g. after children were interrupted."""
+        with Session(engine) as session:
+            run_ids = session.exec(select(PipelineRun.run_id).where(PipelineRun.status == "running")).all()
+        for run_id in run_ids:
+            self.advance(run_id)
+
+    def advance(self, run_id: str):
+        with self._lock:
+            while True:
+                with Session(engine) as session:
+                    pipeline = session.get(PipelineRun, run_id)
+                    if pipeline is None or pipeline.status != "running":
+                        return
+                    children = {
+                        child.job_id: child
+                        for child in session.exec(select(JobRun).where(JobRun.parent_run_id == run_id)).all()
+                    }
+                graph = json.loads(pipeline.jobs)
+                active = sum(child.status in ACTIVE_STATUSES for child in children.values())
+                succeeded = {job_id for job_id, child in children.items() if child.status == "success"}
+                ready = [
+                    job_id for job_id, upstream in graph.items()
+                    if job_id not in children and all(dep in succeeded for dep in upstream)
+                ]
+                if not ready and not active:
+                    self._finish(pipeline, graph, children)
+                    return
+                started = 0
+                for job_id in ready[:max(pipeline.max_parallel - active, 0)]:
+                    try:
+                        self.start_job(job_id, pipeline)
+                        started += 1
+                    except Exception:
+                        logger.exception("Starting %s in pipeline %s failed", job_id, run_id)
+                # Look again: a job that could not start (e.g. it left the
+                # catalog) is recorded as failed straight away.
+                if not started:
+                    return
+
+    def _finish(self, pipeline: PipelineRun, graph: dict[str, list[str]], children: dict[str, JobRun]):
+        succeeded = all(children.get(job_id) and children[job_id].status == "success" for job_id in graph)
+        finished_at = max(
+            (child.finished_at for child in children.values() if child.finished_at),
+            default=datetime.utcnow(),
+        )
+        durations = {job_id: child.duration_ms or 0 for job_id, child in children.items()}
+        total, path = critical_path(graph, durations)
+        with Session(engine) as session:
+            row = session.get(PipelineRun, pipeline.run_id)
+            row.status = "success" if succeeded else "failed"
+            row.finished_at = finished_at
+            row.duration_ms = int((finished_at - row.started_at).total_seconds() * 1000)
+            row.critical_path_ms = total
+            row.critical_path = json.dumps(path)
+            if not succeeded:
+                failed = sorted(job_id for job_id, child in children.items() if child.status != "success")
+                skipped = [job_id for job_id in graph if job_id not in children]
+                row.error_message = f"Failed: {', '.join(failed) or '-'}; not run: {', '.join(skipped) or '-'}"
+            session.add(row)
+            logger.info(
+                "Pipeline %s %s in %dms (critical path %dms: %s)",
+                row.run_id, row.status, row.duration_ms, total, " -> ".join(path),
+            )
+            session.commit()
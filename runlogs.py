@@ -0,0 +1,427 @@
+"""Run log storage and retrieval helpers for the API."""
+
+import asyncio
+import gzip
+import heapq
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+LOGS_DIR = Path("/var/lib/monorepo-scheduler/logs")
+LOGS_DIR.mkdir(parents=True, exist_ok=True)
+
+CHUNK_SIZE = 64 * 1024
+FOLLOW_POLL_INTERVAL = 0.5
+ARCHIVE_DELAY = 60.0  # lets clients following a just-finished run read its end
+RETENTION_INTERVAL = 3600.0
+COMPRESS_LEVEL = 6
+MB = 1024 * 1024
+
+
+def log_path(run_id: str) -> Path:
+    """Where a run writes its log while it is running."""
+    return LOGS_DIR / f"{run_id}.log"
+
+
+def archive_path(run_id: str, started_at: datetime) -> Path:
+    """Where a finished run's log is kept once compressed, sharded by day."""
+    return LOGS_DIR / started_at.strftime("%Y/%m/%d") / f"{run_id}.log.gz"
+
+
+def find_log(run_id: str, started_at: datetime) -> Optional[Path]:
+    """Return the run's live or archived log, whichever exists."""
+    for path in (log_path(run_id), archive_path(run_id, started_at)):
+        if path.exists():
+            return path
+    return None
+
+
+def is_compressed(path: Path) -> bool:
+    return path.suffix == ".gz"
+
+
+def open_log(path: Path):
+    """Open a live or compressed log for reading its uncompressed bytes."""
+    return gzip.open(path, "rb") if is_compressed(path) else open(path, "rb")
+
+
+def log_size(path: Path, known: Optional[int] = None) -> int:
+    """Uncompressed size of a log; ``known`` is the size recorded for the run."""
+    if not is_compressed(path):
+        return path.stat().st_size
+    if known is not None:
+        return known
+    # The gzip trailer ends with the uncompressed size modulo 2**32.
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), "little")
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Parse a single-range ``Range: bytes=...`` header into ``(start, end)``.
+
+    ``end`` is exclusive. Returns None when the range cannot be satisfied;
+    multi-range requests are not supported and are treated the same way.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return None
+            return max(size - suffix, 0), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        return None
+    return start, min(end, size)
+
+
+def tail_offset(path: Path, lines: int, block_size: int = CHUNK_SIZE) -> int:
+    """Return the byte offset where the last ``lines`` lines of the file start.
+
+    Reads backwards from the end in blocks, so the cost depends on the size
+    of the tail rather than the size of the file. Compressed logs cannot be
+    read backwards and are decompressed in one streaming pass instead.
+    """
+    if is_compressed(path):
+        return _tail_offset_stream(path, lines)
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        if lines <= 0 or pos == 0:
+            return pos
+
+        # A trailing newline terminates the last line rather than starting a new one.
+        f.seek(pos - 1)
+        if f.read(1) == b"\n":
+            pos -= 1
+        end = pos
+
+        seen = 0
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            idx = len(block)
+            while True:
+                idx = block.rfind(b"\n", 0, idx)
+                if idx == -1:
+                    break
+                seen += 1
+                if seen == lines:
+                    return pos + idx + 1
+        return 0
+
+
+def _tail_offset_stream(path: Path, lines: int) -> int:
+    # Keep only the trailing chunks holding more than ``lines`` newlines.
+    kept: list[tuple[int, bytes]] = []
+    newlines = pos = 0
+    with open_log(path) as f:
+        while chunk := f.read(CHUNK_SIZE):
+            kept.append((pos, chunk))
+            pos += len(chunk)
+            newlines += chunk.count(b"\n")
+            while len(kept) > 1 and newlines - kept[0][1].count(b"\n") > lines:
+                newlines -= kept.pop(0)[1].count(b"\n")
+    if lines <= 0 or pos == 0:
+        return pos
+
+    base = kept[0][0]
+    buf = b"".join(chunk for _, chunk in kept)
+    idx = len(buf) - 1 if buf.endswith(b"\n") else len(buf)
+    for _ in range(lines):
+        idx = buf.rfind(b"\n", 0, idx)
+        if idx == -1:
+            return base
+    return base + idx + 1
+
+
+def iter_file(path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Yield the bytes of ``path`` in ``[start, end)`` in chunks.
+
+    Compressed logs are decompressed as they are streamed; seeking to
+    ``start`` in one decompresses and discards everything before it.
+    """
+    with open_log(path) as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _sse_event(data: bytes, offset: int, event: Optional[str] = None) -> bytes:
+    lines = data.decode("utf-8", errors="replace").split("\n")
+    out = [f"id: {offset}"]
+    if event:
+        out.append(f"event: {event}")
+    out.extend(f"data: {line}" for line in lines)
+    return ("\n".join(out) + "\n\n").encode()
+
+
+async def follow(
+    path: Path,
+    start: int,
+    is_running: Callable[[], Awaitable[bool]],
+    poll_interval: float = FOLLOW_POLL_INTERVAL,
+):
+    """Stream new bytes appended to ``path`` as server-sent events.
+
+    Each event's ``id`` is the byte offset just past its data, so a client can
+    resume with ``offset``. Sends a final ``end`` event once the run has
+    finished and everything it wrote has been sent.
+    """
+    if is_compressed(path):
+        # Archived, so the run has long finished: replay it and end.
+        for event in _replay(path, start):
+            yield event
+        return
+
+    offset = start
+    finished = False
+    while True:
+        sent = False
+        if path.exists():
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while chunk := f.read(CHUNK_SIZE):
+                    # Hold back a partial trailing line until it is complete.
+                    cut = chunk.rfind(b"\n") + 1
+                    if cut == 0 and len(chunk) < CHUNK_SIZE and not finished:
+                        break
+                    if cut:
+                        chunk = chunk[:cut]
+                    offset += len(chunk)
+                    sent = True
+                    yield _sse_event(chunk, offset)
+                    f.seek(offset)
+        if finished:
+            yield _sse_event(b"", offset, event="end")
+            return
+        if not sent:
+            # Re-check after the final read so nothing written just before
+            # the run finished is lost.
+            finished = not await is_running()
+            if not finished:
+                await asyncio.sleep(poll_interval)
+
+
+def _replay(path: Path, start: int) -> Iterator[bytes]:
+    offset, pending = start, b""
+    for chunk in iter_file(path, start):
+        data = pending + chunk
+        # Split events on line boundaries, as follow() does for live logs.
+        cut = data.rfind(b"\n") + 1
+        if cut == 0 and len(data) < CHUNK_SIZE:
+            pending = data
+            continue
+        cut = cut or len(data)
+        pending = data[cut:]
+        offset += cut
+        yield _sse_event(data[:cut], offset)
+    if pending:
+        offset += len(pending)
+        yield _sse_event(pending, offset)
+    yield _sse_event(b"", offset, event="end")
+
+
+class LogArchiver:
+    """Compress finished run logs into day shards and enforce log retention.
+
+    ``submit`` queues a finished run's log; ARCHIVE_DELAY later a background
+    thread gzips it to ``LOGS_DIR/YYYY/MM/DD/{run_id}.log.gz`` and removes
+    the live file, keeping the top-level directory down to running jobs.
+
+    Once an hour the same thread applies each job's ``log_retention`` policy
+    from its schedule file: archived logs older than ``max_age_days`` or
+    beyond ``max_total_mb`` for the job (newest kept first) are deleted, and
+    the job's own ``log_file`` in its repo is rotated to ``.1`` once it grows
+    past ``max_file_mb``. Day shards older than the run store's
+    ``retention_days`` are removed whole, since their runs are gone too.
+    ``list_runs`` returns a job's finished ``(run_id, started_at)`` pairs,
+    newest first; ``on_remove`` is called with each log about to be deleted.
+    """
+
+    def __init__(
+        self,
+        list_runs: Callable[[str], Iterable[tuple[str, datetime]]],
+        on_remove: Optional[Callable[[str, Path], None]] = None,
+    ):
+        self.list_runs = list_runs
+        self.on_remove = on_remove
+        self.delay = ARCHIVE_DELAY
+        self.keep_days: Optional[int] = None
+
+        self._policies: dict[str, tuple[dict, str]] = {}
+        self._pending: list[tuple[float, str, datetime]] = []
+        self._cond = threading.Condition()
+        self._stop = False
+        self._next_retention = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, jobs: Iterable[dict], runs_config: dict):
+        """Take the jobs' ``log_retention`` policies and the ``runs`` section of targets.yaml."""
+        policies = {
+            job["job_id"]: (job["log_retention"], job["log_file"])
+            for job in jobs if job.get("log_retention")
+        }
+        with self._cond:
+            self._policies = policies
+            self.keep_days = runs_config.get("retention_days")
+
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, name="log-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Logs still waiting are picked up again at the next startup.
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def submit(self, run_id: str, started_at: datetime, delay: Optional[float] = None):
+        due = time.monotonic() + (self.delay if delay is None else delay)
+        with self._cond:
+            heapq.heappush(self._pending, (due, run_id, started_at))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.monotonic()
+                    next_due = self._pending[0][0] if self._pending else math.inf
+                    if min(next_due, self._next_retention) <= now:
+                        break
+                    self._cond.wait(min(next_due, self._next_retention) - now)
+                if self._stop:
+                    return
+                due = []
+                while self._pending and self._pending[0][0] <= now:
+                    due.append(heapq.heappop(self._pending))
+                policies, keep_days = self._policies, self.keep_days
+
+            for _, run_id, started_at in due:
+                try:
+                    self.compress(run_id, started_at)
+                except OSError:
+                    logger.exception("Compressing log of run %s failed", run_id)
+            if time.monotonic() >= self._next_retention:
+                self._next_retention = time.monotonic() + RETENTION_INTERVAL
+                try:
+                    self.apply_retention(policies, keep_days)
+                except Exception:
+                    logger.exception("Log retention pass failed")
+
+    def compress(self, run_id: str, started_at: datetime) -> Optional[Path]:
+        """Move a run's live log into its day shard, gzipped."""
+        src = log_path(run_id)
+        if not src.exists():
+            return None
+        dest = archive_path(run_id, started_at)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".tmp")
+        with open(src, "rb") as fin, gzip.open(tmp, "wb", compresslevel=COMPRESS_LEVEL) as fout:
+            shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+        tmp.replace(dest)
+        src.unlink()
+        return dest
+
+    def apply_retention(self, policies: dict[str, tuple[dict, str]], keep_days: Optional[int] = None) -> int:
+        """Delete logs outside their job's policy; returns the number removed."""
+        now = datetime.utcnow()
+        removed = 0
+        for job_id, (policy, job_log) in policies.items():
+            removed += self._expire_job(job_id, policy, now)
+            if policy.get("max_file_mb"):
+                _rotate(Path(job_log), policy["max_file_mb"] * MB)
+        if keep_days:
+            cutoff = (now - timedelta(days=keep_days)).strftime("%Y/%m/%d")
+            for day_dir in sorted(LOGS_DIR.glob("[0-9]*/[0-9]*/[0-9]*")):
+                if day_dir.relative_to(LOGS_DIR).as_posix() >= cutoff:
+                    break
+                for path in day_dir.glob("*.log.gz"):
+                    self._removing(path)
+                    removed += 1
+                shutil.rmtree(day_dir, ignore_errors=True)
+                _prune(day_dir.parent)
+        if removed:
+            logger.info("Log retention removed %d run log(s)", removed)
+        return removed
+
+    def _expire_job(self, job_id: str, policy: dict, now: datetime) -> int:
+        max_age, max_total = policy.get("max_age_days"), policy.get("max_total_mb")
+        if not (max_age or max_total):
+            return 0
+        cutoff = now - timedelta(days=max_age) if max_age else None
+        budget = max_total * MB if max_total else None
+        kept = removed = 0
+        for run_id, started_at in self.list_runs(job_id):
+            path = archive_path(run_id, started_at)
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            if (cutoff and started_at < cutoff) or (budget is not None and kept + size > budget):
+                self._removing(path)
+                path.unlink(missing_ok=True)
+                _prune(path.parent)
+                removed += 1
+            else:
+                kept += size
+        return removed
+
+    def _removing(self, path: Path):
+        if self.on_remove is not None:
+            self.on_remove(path.name.removesuffix(".log.gz"), path)
+
+
+def _rotate(path: Path, max_bytes: int):
+    """Rename a job's repo log to ``.1`` once it grows past ``max_bytes``.
+
+    wrapper.sh opens the log for appending on each run, so the next run
+    simply starts a new file.
+    """
+    try:
+        if path.stat().st_size <= max_bytes:
+            return
+    except FileNotFoundError:
+        return
+    path.replace(path.with_name(path.name + ".1"))
+    logger.info("Rotated %s", path)
+
+
+def _prune(directory: Path):
+    """Remove empty shard directories up to LOGS_DIR."""
+    while directory != LOGS_DIR and LOGS_DIR in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
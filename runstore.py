@@ -0,0 +1,274 @@
+"""Batched writes and retention for the JobRun table."""
+
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+import stats
+from db import IngestState, JobRun, PipelineRun, engine, run_changes
+from metrics import DB_BATCH_SIZE, DB_COMMIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+COMMIT_RETRIES = 3
+RETENTION_CHUNK = 2000
+RETENTION_INTERVAL = 3600.0
+FINISHED_STATUSES = ("success", "failed", "cancelled")
+
+
+class RunStore:
+    """Single writer for run records.
+
+    Inserts and status updates are queued and committed by one background
+    thread. Whatever queued up while the previous transaction was committing
+    (up to BATCH_SIZE operations) goes into the next one, so a lone write is
+    committed immediately and bursts share transactions. Callers that need
+    the write to be visible before continuing pass ``wait=True``.
+
+    Finished runs are counted in the JobRunDaily rollups as they complete.
+    The same thread periodically applies the ``runs`` retention policy:
+    finished runs older than ``retention_days`` are optionally archived as
+    gzipped JSON lines, then deleted, leaving only their rollups behind;
+    finished pipelines that old are deleted too.
+    """
+
+    def __init__(self):
+        self.retention_days: Optional[int] = None
+        self.archive_dir: Optional[Path] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._next_retention = 0.0
+
+    def configure(self, config: dict):
+        """Apply the ``runs`` section of targets.yaml."""
+        self.retention_days = config.get("retention_days")
+        archive_dir = config.get("archive_dir")
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self._next_retention = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="run-store", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Flush queued writes and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _submit(self, op: tuple, wait: bool):
+        future = Future()
+        if self._thread is None:
+            # Not started (e.g. scripts and tests): write synchronously.
+            self._apply([(op, future)])
+        else:
+            self._queue.put((op, future))
+        if wait:
+            future.result()
+
+    def insert(self, run: JobRun, wait: bool = False):
+        self._submit(("insert", run), wait)
+
+    def update(self, run_id: str, wait: bool = False, **fields):
+        self._submit(("update", run_id, fields), wait)
+
+    def finish(self, run_id: str, job_id: str, day: date, wait: bool = False, **fields):
+        """Record a run's final status and add it to the daily rollups in one transaction."""
+        self._submit(("finish", run_id, {**fields, "rolled_up": True}, job_id, day), wait)
+
+    def claim(self, run_id: str, **fields) -> bool:
+        """Flip a queued run to running, unless it is no longer queued.
+
+        Written directly rather than through the queue: the conditional
+        UPDATE is what stops a run whose earlier writes are still queued
+        from being picked up and executed again.
+        """
+        with Session(engine) as session:
+            result = session.execute(
+                update(JobRun)
+                .where(JobRun.run_id == run_id, JobRun.status == "queued", JobRun.cancelled_by.is_(None))
+                .values(status="running", **fields)
+            )
+            session.commit()
+        if result.rowcount != 1:
+            return False
+        run_changes.bump()
+        return True
+
+    def ingest(self, runs: list[dict], state: IngestState, wait: bool = True):
+        """Insert finished runs read from ``state.source`` and save its new offset.
+
+        Runs whose run_id is already recorded are skipped, so a source can
+        safely be re-read. Rows, rollups and offset commit together.
+        """
+        self._submit(("ingest", runs, state), wait)
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._apply(batch)
+            if stopping:
+                return
+            if self.retention_days and time.monotonic() >= self._next_retention:
+                self._next_retention = time.monotonic() + RETENTION_INTERVAL
+                try:
+                    self.apply_retention()
+                except Exception:
+                    logger.exception("Run retention failed")
+
+    def _apply(self, batch: list[tuple[tuple, Future]]):
+        error = None
+        for attempt in range(1, COMMIT_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                with Session(engine) as session:
+                    for op, _ in batch:
+                        if op[0] == "insert":
+                            session.add(op[1])
+                            continue
+                        if op[0] == "ingest":
+                            _ingest(session, op[1], op[2])
+                            continue
+                        run_id, fields = op[1], op[2]
+                        session.execute(update(JobRun).where(JobRun.run_id == run_id).values(**fields))
+                        if op[0] == "finish":
+                            job_id, day = op[3], op[4]
+                            stats.record_run(
+                                session, job_id, day, fields["status"],
+                                fields.get("duration_ms"), fields.get("finished_at"),
+                                _cpu_ms(fields.get("cpu_user_ms"), fields.get("cpu_system_ms")),
+                                fields.get("max_rss_kb"),
+                            )
+                    session.commit()
+            except OperationalError as e:
+                # Typically "database is locked" from another process; back off.
+                error = e
+                time.sleep(0.1 * attempt)
+                continue
+            except Exception as e:
+                error = e
+                break
+            run_changes.bump()
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
+            DB_BATCH_SIZE.observe(len(batch))
+            for _, future in batch:
+                future.set_result(None)
+            return
+
+        if len(batch) > 1:
+            # Isolate the failing write so the rest of the batch still lands.
+            for item in batch:
+                self._apply([item])
+            return
+        logger.error("Dropping run store write %r: %s", batch[0][0][:2], error)
+        batch[0][1].set_exception(error)
+
+    def apply_retention(self, now: Optional[datetime] = None) -> int:
+        """Archive and delete finished runs older than the retention window.
+
+        Runs finished through ``finish`` are already in the rollups; any
+        others (e.g. failed on restart) are folded in before deletion.
+        """
+        if not self.retention_days:
+            return 0
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        removed = 0
+        while True:
+            with Session(engine) as session:
+                runs = session.exec(
+                    select(JobRun)
+                    .where(JobRun.started_at < cutoff, JobRun.status.in_(FINISHED_STATUSES))
+                    .order_by(JobRun.started_at)
+                    .limit(RETENTION_CHUNK)
+                ).all()
+                if not runs:
+                    break
+                _fold_into_rollups(session, [run for run in runs if not run.rolled_up])
+                if self.archive_dir:
+                    self._archive(runs)
+                ids = [run.run_id for run in runs]
+                session.execute(JobRun.__table__.delete().where(JobRun.run_id.in_(ids)))
+                session.commit()
+                removed += len(runs)
+        with Session(engine) as session:
+            session.execute(PipelineRun.__table__.delete().where(
+                PipelineRun.started_at < cutoff, PipelineRun.status.in_(FINISHED_STATUSES)
+            ))
+            session.commit()
+        if removed:
+            run_changes.bump()
+            logger.info("Retention removed %d run(s) older than %s", removed, cutoff)
+        return removed
+
+    def _archive(self, runs: list[JobRun]):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        by_day: dict[str, list[JobRun]] = {}
+        for run in runs:
+            by_day.setdefault(run.started_at.strftime("%Y-%m-%d"), []).append(run)
+        for day, day_runs in by_day.items():
+            with gzip.open(self.archive_dir / f"runs-{day}.jsonl.gz", "at") as f:
+                for run in day_runs:
+                    f.write(json.dumps(run.model_dump(mode="json")) + "\n")
+
+
+def _fold_into_rollups(session: Session, runs: list[JobRun]):
+    """Add finished runs that are not yet counted to their daily rollup rows."""
+    for run in runs:
+        stats.record_run(
+            session, run.job_id, run.started_at.date(), run.status, run.duration_ms, run.finished_at,
+            _cpu_ms(run.cpu_user_ms, run.cpu_system_ms), run.max_rss_kb,
+        )
+        run.rolled_up = True
+        session.add(run)
+
+
+def _cpu_ms(user_ms: Optional[int], system_ms: Optional[int]) -> Optional[int]:
+    if user_ms is None:
+        return None
+    return user_ms + (system_ms or 0)
+
+
+def _ingest(session: Session, runs: list[dict], state: IngestState):
+    existing = set(session.exec(
+        select(JobRun.run_id).where(JobRun.run_id.in_([run["run_id"] for run in runs]))
+    ).all()) if runs else set()
+    # A re-read source can repeat a run within one batch too.
+    unique = {run["run_id"]: run for run in runs if run["run_id"] not in existing}
+    new = [{**run, "rolled_up": True} for run in unique.values()]
+    if new:
+        session.execute(JobRun.__table__.insert(), new)
+        by_day: dict[tuple[str, date], list] = {}
+        for run in new:
+            by_day.setdefault((run["job_id"], run["started_at"].date()), []).append(
+                (run["status"], run["duration_ms"], run["finished_at"])
+            )
+        for (job_id, day), day_runs in by_day.items():
+            stats.record_runs(session, job_id, day, day_runs)
+    session.merge(state)
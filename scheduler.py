@@ -0,0 +1,306 @@
+"""In-process cron engine for monorepo-scheduler jobs."""
+
+import hashlib
+import heapq
+import itertools
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MISFIRE_POLICIES = ("skip", "run_once", "run_all")
+DEFAULT_MISFIRE_POLICY = "skip"
+DEFAULT_MISFIRE_GRACE = 60
+MAX_CATCHUP_RUNS = 10
+MAX_SLEEP = 60.0
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTH_NAMES = {n: i for i, n in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+_DOW_NAMES = {n: i for i, n in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+# Ranges an ``H`` field hashes into; days stop at 28 so every month has one.
+_HASH_RANGES = [(0, 59), (0, 23), (1, 28), (1, 12), (0, 6)]
+_HASH_FIELD = re.compile(r"H(?:\((\d+)-(\d+)\))?(?:/(\d+))?")
+
+
+def _hash(key: str, salt: str = "") -> int:
+    return int.from_bytes(hashlib.sha256(f"{key}\0{salt}".encode()).digest()[:8], "big")
+
+
+def resolve_hashed(expr: str, key: str) -> str:
+    """Replace Jenkins-style ``H`` fields with values derived from ``key``.
+
+    ``H`` picks one value in the field's range, ``H(a-b)`` one in ``a-b``,
+    and ``H/n`` or ``H(a-b)/n`` every n-th value starting from a hashed
+    offset, so ``H/10`` on the minute field might become
+    ``7,17,27,37,47,57``. The same key always gives the same expression,
+    which stays valid for plain cron.
+    """
+    fields = _ALIASES.get(expr.strip(), expr).split()
+    if len(fields) != 5 or not any(part.startswith("H") for f in fields for part in f.split(",")):
+        return expr
+    resolved = []
+    for i, (field, (lo, hi)) in enumerate(zip(fields, _HASH_RANGES)):
+        parts = []
+        for part in field.split(","):
+            if not part.startswith("H"):
+                parts.append(part)
+                continue
+            match = _HASH_FIELD.fullmatch(part)
+            if match is None:
+                raise ValueError(f"Invalid H field {field!r} in {expr!r}")
+            first, last, step = match.groups()
+            start, end = (int(first), int(last)) if first else (lo, hi)
+            step = int(step) if step else 0
+            if not (lo <= start <= end <= hi) or (match.group(3) and not step):
+                raise ValueError(f"Invalid H field {field!r} in {expr!r}")
+            h = _hash(key, str(i))
+            if step:
+                offset = start + h % min(step, end - start + 1)
+                parts.append(",".join(str(v) for v in range(offset, end + 1, step)))
+            else:
+                parts.append(str(start + h % (end - start + 1)))
+        resolved.append(",".join(parts))
+    return " ".join(resolved)
+
+
+def jitter_offset(key: str, jitter_seconds: int) -> int:
+    """Seconds in ``[0, jitter_seconds)`` to delay each fire of ``key``'s job by."""
+    if not jitter_seconds or jitter_seconds <= 1:
+        return 0
+    return _hash(key, "jitter") % int(jitter_seconds)
+
+
+class CronExpr:
+    """A parsed five-field cron expression using Vixie cron semantics.
+
+    Supports ``*``, ranges, steps, lists, month/weekday names and the
+    ``@hourly``-style aliases. When both day-of-month and day-of-week are
+    restricted, a day matches if either does.
+    """
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        fields = _ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields, got {len(fields)}: {expr!r}")
+        self.minutes = self._parse(fields[0], 0, 59)
+        self.hours = self._parse(fields[1], 0, 23)
+        self.days = self._parse(fields[2], 1, 31)
+        self.months = self._parse(fields[3], 1, 12, _MONTH_NAMES)
+        dows = self._parse(fields[4], 0, 7, _DOW_NAMES)
+        self.weekdays = frozenset(d % 7 for d in dows)
+        self._dom_any = fields[2].startswith("*")
+        self._dow_any = fields[4].startswith("*")
+
+    def _parse(self, field: str, lo: int, hi: int, names: Optional[dict] = None) -> frozenset:
+        values = set()
+        for part in field.lower().split(","):
+            spec, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if step < 1:
+                raise ValueError(f"Invalid step in {field!r}")
+            if spec == "*":
+                start, end = lo, hi
+            else:
+                first, _, last = spec.partition("-")
+                start = self._value(first, names)
+                end = self._value(last, names) if last else (hi if step > 1 else start)
+            if not (lo <= start <= hi and lo <= end <= hi and start <= end):
+                raise ValueError(f"Value out of range in {field!r} ({lo}-{hi})")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    @staticmethod
+    def _value(token: str, names: Optional[dict]) -> int:
+        if names and token in names:
+            return names[token]
+        return int(token)
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._dom_any or self._dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, dt: datetime) -> datetime:
+        """Return the first matching minute strictly after ``dt``."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                year, month = (t.year + 1, 1) if t.month == 12 else (t.year, t.month + 1)
+                t = t.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+                continue
+            later = [m for m in self.minutes if m >= t.minute]
+            if not later:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+                continue
+            return t.replace(minute=min(later))
+        raise ValueError(f"Cron expression {self.expr!r} never fires")
+
+
+@dataclass
+class _Entry:
+    job: dict
+    expr: CronExpr
+    offset: timedelta
+    policy: str
+    next_fire: datetime
+
+    def after(self, t: datetime) -> datetime:
+        """Next fire strictly after ``t``, including the job's jitter offset."""
+        return self.expr.next_after(t - self.offset) + self.offset
+
+
+class Scheduler:
+    """Fire catalog jobs at their cron times from a single background thread.
+
+    Next-fire times live in a min-heap; ``replan`` swaps in a new set of jobs
+    without stopping the thread, keeping the pending fire time of any job
+    whose cron expression is unchanged. Fires that are more than ``grace``
+    seconds late (the process was down or stalled) are handled per the job's
+    misfire policy: ``skip`` drops them, ``run_once`` fires once to catch up
+    and ``run_all`` fires each missed time, up to MAX_CATCHUP_RUNS. A job's
+    ``fire_offset`` (see ``jitter_offset``) shifts every fire by that many
+    seconds.
+    """
+
+    def __init__(
+        self,
+        fire: Callable[[dict, datetime], None],
+        last_fire: Callable[[str], Optional[datetime]] = lambda job_id: None,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        self._fire = fire
+        self._last_fire = last_fire
+        self._now = now
+        self.default_policy = DEFAULT_MISFIRE_POLICY
+        self.grace = timedelta(seconds=DEFAULT_MISFIRE_GRACE)
+
+        self._cond = threading.Condition()
+        self._entries: dict[str, _Entry] = {}
+        self._heap: list[tuple[datetime, int, str]] = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def configure(self, config: dict):
+        """Apply the ``scheduler`` section of targets.yaml."""
+        policy = config.get("misfire_policy", DEFAULT_MISFIRE_POLICY)
+        if policy not in MISFIRE_POLICIES:
+            raise ValueError(f"Unknown misfire_policy {policy!r}")
+        self.default_policy = policy
+        self.grace = timedelta(seconds=config.get("misfire_grace_seconds", DEFAULT_MISFIRE_GRACE))
+
+    def replan(self, jobs: Iterable[dict]):
+        """Replace the scheduled jobs, e.g. after the catalog is reloaded."""
+        now = self._now()
+        entries = {}
+        for job in jobs:
+            if not job.get("cron"):
+                continue
+            try:
+                expr = CronExpr(job["cron"])
+            except ValueError as e:
+                logger.error("Skipping job %s: %s", job["job_id"], e)
+                continue
+            policy = job.get("misfire_policy") or self.default_policy
+            entry = _Entry(job, expr, timedelta(seconds=job.get("fire_offset") or 0), policy, now)
+            current = self._entries.get(job["job_id"])
+            if current and (current.expr.expr, current.offset) == (expr.expr, entry.offset):
+                entry.next_fire = current.next_fire
+            elif current:
+                entry.next_fire = entry.after(now)
+            else:
+                # First plan for this job in this process: resume from its
+                # last recorded fire so misfires while down are caught up.
+                entry.next_fire = entry.after(self._last_fire(job["job_id"]) or now)
+            entries[job["job_id"]] = entry
+
+        with self._cond:
+            self._entries = entries
+            self._heap = [(e.next_fire, next(self._seq), job_id) for job_id, e in entries.items()]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        logger.info("Scheduler planned %d job(s)", len(entries))
+
+    def next_fires(self) -> dict[str, datetime]:
+        with self._cond:
+            return {job_id: e.next_fire for job_id, e in self._entries.items()}
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _due(self, entry: _Entry, now: datetime) -> list[datetime]:
+        """Return the fire times to run for an entry whose next fire has passed."""
+        if now - entry.next_fire <= self.grace:
+            return [entry.next_fire]
+        if entry.policy == "skip":
+            logger.warning("Job %s missed its %s fire, skipping", entry.job["job_id"], entry.next_fire)
+            return []
+        if entry.policy == "run_once":
+            return [entry.next_fire]
+        missed, t = [], entry.next_fire
+        while t <= now and len(missed) < MAX_CATCHUP_RUNS:
+            missed.append(t)
+            t = entry.after(t)
+        return missed
+
+    def _loop(self):
+        while True:
+            fires = []
+            with self._cond:
+                if self._stopping:
+                    return
+                now = self._now()
+                while self._heap and self._heap[0][0] <= now:
+                    when, _, job_id = heapq.heappop(self._heap)
+                    entry = self._entries.get(job_id)
+                    if entry is None or entry.next_fire != when:
+                        continue  # replaced by replan
+                    fires.extend((entry.job, t) for t in self._due(entry, now))
+                    entry.next_fire = entry.after(max(when, now) if now - when > self.grace else when)
+                    heapq.heappush(self._heap, (entry.next_fire, next(self._seq), job_id))
+                if not fires:
+                    delay = (self._heap[0][0] - now).total_seconds() if self._heap else MAX_SLEEP
+                    self._cond.wait(min(max(delay, 0), MAX_SLEEP))
+                    continue
+
+            for job, scheduled_for in fires:
+                try:
+                    self._fire(job, scheduled_for)
+                except Exception:
+                    logger.exception("Failed to fire job %s for %s", job["job_id"], scheduled_for)
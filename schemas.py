@@ -0,0 +1,126 @@
+"""Typed API payloads for jobs and runs, encoded straight to JSON bytes."""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+from db import JobRun
+
+
+class InvalidFields(ValueError):
+    """Raised for a ``fields=`` projection naming fields the payload does not have."""
+
+
+class RunResources(BaseModel):
+    max_rss_kb: Optional[int] = None
+    cpu_user_ms: Optional[int] = None
+    cpu_system_ms: Optional[int] = None
+    io_read_blocks: Optional[int] = None
+    io_write_blocks: Optional[int] = None
+
+
+class RunOut(BaseModel):
+    run_id: str
+    job_id: str
+    target_name: str
+    status: str
+    triggered_by: str
+    created_at: datetime
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    exit_code: Optional[int] = None
+    duration: Optional[int] = None
+    queue_wait: Optional[int] = None
+    error: Optional[str] = None
+    parent_run_id: Optional[str] = None
+    worker_id: Optional[str] = None
+    attempts: Optional[int] = None
+    resources: RunResources
+
+    @classmethod
+    def from_run(cls, run: JobRun) -> "RunOut":
+        return cls(
+            run_id=run.run_id,
+            job_id=run.job_id,
+            target_name=run.target_name,
+            status=run.status,
+            triggered_by=run.triggered_by,
+            created_at=run.queued_at or run.started_at,
+            started_at=run.started_at,
+            finished_at=run.finished_at,
+            exit_code=run.exit_code,
+            duration=run.duration_ms,
+            queue_wait=run.queue_wait_ms,
+            error=run.error_message,
+            parent_run_id=run.parent_run_id,
+            worker_id=run.worker_id,
+            attempts=run.attempts,
+            resources=RunResources(
+                max_rss_kb=run.max_rss_kb,
+                cpu_user_ms=run.cpu_user_ms,
+                cpu_system_ms=run.cpu_system_ms,
+                io_read_blocks=run.io_read_blocks,
+                io_write_blocks=run.io_write_blocks,
+            ),
+        )
+
+
+class JobOut(BaseModel):
+    job_id: str
+    target_name: str
+    cron: Optional[str] = None
+
+    @classmethod
+    def from_job(cls, job: dict) -> "JobOut":
+        return cls(job_id=job["job_id"], target_name=job["target_name"], cron=job["cron"])
+
+
+class JobDetail(JobOut):
+    cron_spec: Optional[str] = None
+    fire_offset: int = 0
+    depends_on: list[str] = []
+    runs_on: list[str] = []
+    groups: list[str] = []
+
+    @classmethod
+    def from_job(cls, job: dict) -> "JobDetail":
+        return cls(
+            job_id=job["job_id"],
+            target_name=job["target_name"],
+            cron=job["cron"],
+            cron_spec=job.get("cron_spec"),
+            fire_offset=job.get("fire_offset", 0),
+            depends_on=job.get("depends_on", []),
+            runs_on=job.get("runs_on", []),
+            groups=job.get("groups", []),
+        )
+
+
+def parse_fields(fields: Optional[str], model: type[BaseModel]) -> Optional[frozenset[str]]:
+    """Turn a comma-separated ``fields=`` value into the set of ``model`` fields to keep."""
+    if not fields:
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    unknown = sorted(names - model.model_fields.keys())
+    if unknown:
+        raise InvalidFields(f"Unknown field(s): {', '.join(unknown)}")
+    return names or None
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def encode(payload: BaseModel | list[BaseModel], model: type[BaseModel], fields: Optional[frozenset[str]] = None) -> bytes:
+    """Serialize one ``model`` or a list of them to JSON, keeping only ``fields`` if given.
+
+    Encoding runs in pydantic-core, skipping the jsonable_encoder pass that
+    plain dict responses go through.
+    """
+    if isinstance(payload, list):
+        include = {"__all__": set(fields)} if fields else None
+        return _list_adapter(model).dump_json(payload, include=include)
+    return payload.model_dump_json(include=set(fields) if fields else None).encode()
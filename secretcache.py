@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Cached Doppler secret snapshots, injected into job environments."""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+SECRETS_DIR = Path("/var/lib/monorepo-scheduler/secrets")
+# Kept apart from the snapshots, so reading those is not enough to decrypt them.
+DEFAULT_KEY_FILE = Path("/etc/monorepo-scheduler/secrets.key")
+KEY_ENV = "SCHEDULER_SECRETS_KEY"  # a Fernet key; overrides the key file
+DEFAULT_COMMAND = [
+    "doppler", "secrets", "download", "--no-file", "--format", "json",
+    "--project", "{project}", "--config", "{config}",
+]
+DEFAULT_TTL = 3600
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_MAX_STALE_HOURS = 168
+FETCH_TIMEOUT = 30
+
+
+class SecretsUnavailable(Exception):
+    """Raised when secrets cannot be fetched and no usable snapshot exists."""
+
+
+class SecretCache:
+    """TTL-bound snapshots of each Doppler project/config's secrets.
+
+    ``environ`` serves a snapshot younger than ``ttl`` without contacting
+    the provider, fetches a new one otherwise, and falls back to the last
+    good snapshot (up to ``max_stale_hours`` old) if the fetch fails. Once
+    started, a background thread refreshes known snapshots every
+    ``refresh_interval`` seconds so runs never wait on the provider.
+
+    Snapshots are also written to ``cache_dir``, encrypted with a Fernet key
+    from $SCHEDULER_SECRETS_KEY or ``key_file`` (created on first use),
+    which lets cron-fired jobs (see ``main`` below) and restarts reuse them.
+    """
+
+    def __init__(self, cache_dir: Path = SECRETS_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.key_file = DEFAULT_KEY_FILE
+        self.command = list(DEFAULT_COMMAND)
+        self.ttl = DEFAULT_TTL
+        self.refresh_interval = DEFAULT_REFRESH_INTERVAL
+        self.max_stale = DEFAULT_MAX_STALE_HOURS * 3600
+
+        self._lock = threading.Lock()
+        self._snapshots: dict[tuple[str, str], tuple[float, dict]] = {}
+        self._mtimes: dict[tuple[str, str], int] = {}  # snapshot file versions loaded
+        self._fernet = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: dict):
+        """Apply the ``doppler`` section of targets.yaml."""
+        self.command = list(config.get("command") or DEFAULT_COMMAND)
+        self.ttl = config.get("cache_ttl", DEFAULT_TTL)
+        self.refresh_interval = config.get("refresh_interval", DEFAULT_REFRESH_INTERVAL)
+        self.max_stale = config.get("max_stale_hours", DEFAULT_MAX_STALE_HOURS) * 3600
+        key_file = Path(config.get("key_file") or DEFAULT_KEY_FILE)
+        if key_file != self.key_file:
+            self.key_file = key_file
+            self._fernet = None
+        if self.key_file.resolve().is_relative_to(self.cache_dir.resolve()):
+            logger.warning("Secret snapshot key %s is inside the snapshot directory", self.key_file)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="secret-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            with self._lock:
+                keys = list(self._snapshots)
+            for project, config in keys:
+                try:
+                    self.refresh(project, config)
+                except SecretsUnavailable as e:
+                    logger.warning("Background secret refresh failed: %s", e)
+
+    def environ(self, project: str, config: str) -> dict:
+        """Return the secrets for a project/config as environment variables."""
+        snapshot = self._load(project, config)
+        if snapshot and time.time() - snapshot[0] < self.ttl:
+            return snapshot[1]
+        return self.refresh(project, config)
+
+    def refresh(self, project: str, config: str) -> dict:
+        """Fetch from the provider, falling back to the last good snapshot."""
+        with self._file_lock(project, config):
+            # Another process may have refreshed while we waited for the lock.
+            snapshot = self._load(project, config)
+            if snapshot and time.time() - snapshot[0] < min(self.ttl, self.refresh_interval):
+                return snapshot[1]
+            try:
+                secrets = self._fetch(project, config)
+            except (OSError, subprocess.SubprocessError, ValueError) as e:
+                if snapshot and time.time() - snapshot[0] < self.max_stale:
+                    logger.warning(
+                        "Fetching secrets for %s/%s failed (%s), using snapshot from %.0fs ago",
+                        project, config, e, time.time() - snapshot[0],
+                    )
+                    return snapshot[1]
+                raise SecretsUnavailable(f"{project}/{config}: {e}") from e
+            self._store(project, config, (time.time(), secrets))
+            return secrets
+
+    def _fetch(self, project: str, config: str) -> dict:
+        cmd = [part.format(project=project, config=config) for part in self.command]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=FETCH_TIMEOUT, check=False)
+        if result.returncode != 0:
+            raise ValueError(f"exit {result.returncode}: {result.stderr.strip()[:200]}")
+        secrets = json.loads(result.stdout)
+        if not isinstance(secrets, dict):
+            raise ValueError("provider did not return a JSON object")
+        return {str(k): str(v) for k, v in secrets.items()}
+
+    def _path(self, project: str, config: str) -> Path:
+        digest = hashlib.sha256(f"{project}\0{config}".encode()).hexdigest()[:16]
+        return self.cache_dir / f"{digest}.snap"
+
+    @contextmanager
+    def _file_lock(self, project: str, config: str):
+        self.cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        with open(self._path(project, config).with_suffix(".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _cipher(self):
+        if self._fernet is None:
+            key = os.environ.get(KEY_ENV)
+            self._fernet = Fernet(key.encode() if key else self._key_from_file())
+            # Earlier versions kept the key next to the snapshots.
+            (self.cache_dir / "key").unlink(missing_ok=True)
+        return self._fernet
+
+    def _key_from_file(self) -> bytes:
+        key_path = self.key_file
+        if not key_path.exists():
+            key_path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+            # Publish the key with link() so concurrent processes agree on one.
+            tmp = key_path.with_name(f".{key_path.name}.{os.getpid()}.tmp")
+            _write_private(tmp, Fernet.generate_key())
+            try:
+                os.link(tmp, key_path)
+            except FileExistsError:
+                pass
+            finally:
+                tmp.unlink()
+        return key_path.read_bytes()
+
+    def _load(self, project: str, config: str) -> Optional[tuple[float, dict]]:
+        with self._lock:
+            snapshot = self._snapshots.get((project, config))
+        path = self._path(project, config)
+        try:
+            mtime = path.stat().st_mtime_ns
+            if snapshot and self._mtimes.get((project, config)) == mtime:
+                return snapshot
+            data = json.loads(self._cipher().decrypt(path.read_bytes()))
+        except FileNotFoundError:
+            return snapshot
+        except (InvalidToken, ValueError) as e:
+            logger.warning("Ignoring unreadable secret snapshot %s: %s", path, e)
+            return snapshot
+        snapshot = (data["fetched_at"], data["secrets"])
+        with self._lock:
+            self._snapshots[(project, config)] = snapshot
+            self._mtimes[(project, config)] = mtime
+        return snapshot
+
+    def _store(self, project: str, config: str, snapshot: tuple[float, dict]):
+        with self._lock:
+            self._snapshots[(project, config)] = snapshot
+        path = self._path(project, config)
+        token = self._cipher().encrypt(json.dumps({"fetched_at": snapshot[0], "secrets": snapshot[1]}).encode())
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        _write_private(tmp, token)
+        tmp.replace(path)
+        with self._lock:
+            self._mtimes[(project, config)] = path.stat().st_mtime_ns
+
+
+def _write_private(path: Path, data: bytes):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+
+def main():
+    """Exec a command with cached secrets; used in place of ``doppler run`` in cron lines."""
+    parser = argparse.ArgumentParser(description="Run a command with cached Doppler secrets")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL)
+    parser.add_argument("--max-stale-hours", type=int, default=DEFAULT_MAX_STALE_HOURS)
+    parser.add_argument("--key-file", help=f"snapshot key file (default {DEFAULT_KEY_FILE})")
+    parser.add_argument("--provider", help="JSON list overriding the secrets download command")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("no command given")
+
+    cache = SecretCache()
+    cache.configure({
+        "cache_ttl": args.ttl,
+        "max_stale_hours": args.max_stale_hours,
+        "command": json.loads(args.provider) if args.provider else None,
+        "key_file": args.key_file,
+    })
+    try:
+        secrets = cache.environ(args.project, args.config)
+    except SecretsUnavailable as e:
+        print(f"secretcache: {e}; falling back to doppler run", file=sys.stderr)
+        os.execvp("doppler", ["doppler", "run", "--project", args.project, "--config", args.config, "--", *command])
+    os.execvpe(command[0], command, {**os.environ, **secrets})
+
+
+if __name__ == "__main__":
+    main()
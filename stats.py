@@ -0,0 +1,211 @@
+"""Incremental run statistics built from the JobRunDaily rollups."""
+
+import json
+import math
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlmodel import Session, select
+
+from db import JobRunDaily
+
+# Bucket boundaries grow by GAMMA, so any quantile is within ~2.5% of the
+# true duration regardless of how many runs were recorded.
+GAMMA = 1.05
+_LOG_GAMMA = math.log(GAMMA)
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOWS = {"1d": 1, "7d": 7, "30d": 30, "90d": 90, "365d": 365}
+DEFAULT_WINDOW = "7d"
+
+
+class DurationSketch:
+    """Mergeable log-bucket histogram of durations in milliseconds."""
+
+    def __init__(self, buckets: Optional[Counter] = None):
+        self.buckets: Counter = buckets or Counter()
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "DurationSketch":
+        if not raw:
+            return cls()
+        return cls(Counter({int(k): v for k, v in json.loads(raw).items()}))
+
+    def to_json(self) -> str:
+        return json.dumps({str(k): v for k, v in sorted(self.buckets.items())}, separators=(",", ":"))
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets.values())
+
+    def add(self, duration_ms: int):
+        # Bucket i covers (GAMMA**(i-1), GAMMA**i] ms; -1 holds 0ms runs.
+        index = -1 if duration_ms < 1 else math.ceil(math.log(duration_ms) / _LOG_GAMMA)
+        self.buckets[index] += 1
+
+    def merge(self, other: "DurationSketch"):
+        self.buckets.update(other.buckets)
+
+    def quantile(self, q: float) -> Optional[int]:
+        total = self.count
+        if not total:
+            return None
+        # Nearest rank: the smallest duration at or above a q share of runs,
+        # so a single slow run out of a few still shows up in the p99.
+        rank = max(math.ceil(q * total) - 1, 0)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                if index < 0:
+                    return 0
+                # Midpoint of the bucket, which bounds the relative error.
+                return round(2 * GAMMA ** index / (1 + GAMMA))
+        return None
+
+
+def record_run(
+    session: Session,
+    job_id: str,
+    day: date,
+    status: str,
+    duration_ms: Optional[int],
+    finished_at: Optional[datetime],
+    cpu_ms: Optional[int] = None,
+    max_rss_kb: Optional[int] = None,
+):
+    """Add one finished run to its job's daily rollup row (not committed)."""
+    record_runs(session, job_id, day, [(status, duration_ms, finished_at, cpu_ms, max_rss_kb)])
+
+
+def record_runs(
+    session: Session,
+    job_id: str,
+    day: date,
+    runs: Iterable[tuple],
+):
+    """Add runs of one job and day to its rollup.
+
+    Each run is ``(status, duration_ms, finished_at)``, optionally followed
+    by ``cpu_ms`` and ``max_rss_kb`` when its resource usage is known.
+    """
+    rollup = session.get(JobRunDaily, (job_id, day))
+    if rollup is None:
+        rollup = JobRunDaily(job_id=job_id, day=day)
+    # Totals are kept in a _Totals and written back once, since setting
+    # model attributes is slow for large batches.
+    totals = _Totals()
+    totals.add(rollup)
+    for status, duration_ms, finished_at, *usage in runs:
+        totals.runs += 1
+        if status == "success":
+            totals.last_success_at = _pick(max, totals.last_success_at, finished_at)
+        else:
+            totals.failures += 1
+            totals.last_failure_at = _pick(max, totals.last_failure_at, finished_at)
+        if duration_ms is not None:
+            totals.duration_sum_ms += duration_ms
+            totals.duration_min_ms = _pick(min, totals.duration_min_ms, duration_ms)
+            totals.duration_max_ms = _pick(max, totals.duration_max_ms, duration_ms)
+            totals.sketch.add(duration_ms)
+        cpu_ms, max_rss_kb = (usage + [None, None])[:2]
+        if cpu_ms is not None:
+            totals.cpu_sum_ms += cpu_ms
+            totals.cpu_runs += 1
+        totals.max_rss_kb = _pick(max, totals.max_rss_kb, max_rss_kb)
+    rollup.runs = totals.runs
+    rollup.failures = totals.failures
+    rollup.duration_sum_ms = totals.duration_sum_ms
+    rollup.duration_min_ms = totals.duration_min_ms
+    rollup.duration_max_ms = totals.duration_max_ms
+    rollup.last_success_at = totals.last_success_at
+    rollup.last_failure_at = totals.last_failure_at
+    if totals.cpu_runs:
+        rollup.cpu_sum_ms = totals.cpu_sum_ms
+        rollup.cpu_runs = totals.cpu_runs
+    rollup.max_rss_kb = totals.max_rss_kb
+    if totals.sketch.count:
+        rollup.duration_sketch = totals.sketch.to_json()
+    session.add(rollup)
+
+
+class _Totals:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.duration_sum_ms = 0
+        self.duration_count = 0
+        self.duration_min_ms: Optional[int] = None
+        self.duration_max_ms: Optional[int] = None
+        self.last_success_at: Optional[datetime] = None
+        self.last_failure_at: Optional[datetime] = None
+        self.cpu_sum_ms = 0
+        self.cpu_runs = 0
+        self.max_rss_kb: Optional[int] = None
+        self.sketch = DurationSketch()
+
+    def add(self, rollup: JobRunDaily):
+        self.runs += rollup.runs
+        self.failures += rollup.failures
+        self.duration_sum_ms += rollup.duration_sum_ms
+        sketch = DurationSketch.from_json(rollup.duration_sketch)
+        self.duration_count += sketch.count
+        self.sketch.merge(sketch)
+        self.duration_min_ms = _pick(min, self.duration_min_ms, rollup.duration_min_ms)
+        self.duration_max_ms = _pick(max, self.duration_max_ms, rollup.duration_max_ms)
+        self.last_success_at = _pick(max, self.last_success_at, rollup.last_success_at)
+        self.last_failure_at = _pick(max, self.last_failure_at, rollup.last_failure_at)
+        self.cpu_sum_ms += rollup.cpu_sum_ms or 0
+        self.cpu_runs += rollup.cpu_runs or 0
+        self.max_rss_kb = _pick(max, self.max_rss_kb, rollup.max_rss_kb)
+
+    def to_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "failure_rate": round(self.failures / self.runs, 4) if self.runs else None,
+            "duration": {
+                "min": self.duration_min_ms,
+                "max": self.duration_max_ms,
+                "mean": round(self.duration_sum_ms / self.duration_count) if self.duration_count else None,
+                **{f"p{round(q * 100)}": self.sketch.quantile(q) for q in QUANTILES},
+            },
+            "resources": {
+                "cpu_total_ms": self.cpu_sum_ms,
+                "cpu_mean_ms": round(self.cpu_sum_ms / self.cpu_runs) if self.cpu_runs else None,
+                "max_rss_kb": self.max_rss_kb,
+            },
+            "last_success": self.last_success_at.isoformat() if self.last_success_at else None,
+            "last_failure": self.last_failure_at.isoformat() if self.last_failure_at else None,
+        }
+
+
+def _pick(fn, a, b):
+    """``fn(a, b)``, ignoring whichever side is None."""
+    if a is None or b is None:
+        return b if a is None else a
+    return fn(a, b)
+
+
+def window_start(window: str, today: Optional[date] = None) -> date:
+    """First rollup day included in a window; ``1d`` means today (UTC)."""
+    return (today or datetime.utcnow().date()) - timedelta(days=WINDOWS[window] - 1)
+
+
+def job_stats(session: Session, job_ids: Iterable[str], since: date) -> tuple[dict, dict]:
+    """Aggregate rollups from ``since`` onwards.
+
+    Returns ``(per_job, overall)``; the cost depends on the number of days
+    and jobs in the window, never on the number of runs.
+    """
+    job_ids = list(job_ids)
+    per_job = {job_id: _Totals() for job_id in job_ids}
+    overall = _Totals()
+    if job_ids:
+        rollups = session.exec(
+            select(JobRunDaily).where(JobRunDaily.job_id.in_(job_ids), JobRunDaily.day >= since)
+        ).all()
+        for rollup in rollups:
+            per_job[rollup.job_id].add(rollup)
+            overall.add(rollup)
+    return {job_id: t.to_dict() for job_id, t in per_job.items()}, overall.to_dict()
@@ -0,0 +1,65 @@
+"""Shared fixtures: a scratch database, log directory and API per test."""
+
+import os
+import tempfile
+
+import bcrypt
+import pytest
+import yaml
+
+PASSWORD = "pw"
+
+
+def pytest_sessionstart(session):
+    # db.py resolves ./runs.db against the working directory when it is
+    # imported, so move somewhere disposable before any test imports it.
+    os.chdir(tempfile.mkdtemp(prefix="scheduler-tests-"))
+
+
+@pytest.fixture(autouse=True)
+def database():
+    import db
+    from sqlmodel import SQLModel
+
+    db.init_db()
+    yield
+    SQLModel.metadata.drop_all(db.engine)
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    import runlogs
+
+    path = tmp_path / "logs"
+    path.mkdir()
+    monkeypatch.setattr(runlogs, "LOGS_DIR", path)
+    return path
+
+
+@pytest.fixture
+def make_api(tmp_path, monkeypatch):
+    """Point api at a one-target catalog holding ``schedules``; returns the module."""
+    import api
+
+    def make(schedules: list[dict], config: dict | None = None):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        (repo / "schedule.yml").write_text(yaml.safe_dump({"schedules": schedules}))
+        targets = tmp_path / "targets.yaml"
+        targets.write_text(yaml.safe_dump({
+            "targets": [{"name": "proj", "repo_path": str(repo), "schedule_file": "schedule.yml", "groups": ["admin"]}],
+            **(config or {}),
+        }))
+        users = tmp_path / "users.yaml"
+        password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+        users.write_text(yaml.safe_dump({"users": [
+            {"username": "admin", "password_hash": password_hash, "groups": ["admin"]},
+            {"username": "agent", "password_hash": password_hash, "groups": ["agents"]},
+        ]}))
+        monkeypatch.setattr(api, "TARGETS_FILE", targets)
+        monkeypatch.setattr(api, "_user_store", api.UserStore(users))
+        # Run the bare command rather than through wrapper.sh.
+        monkeypatch.setattr(api, "build_wrapper_command", lambda job, *args, **kwargs: job["command"])
+        return api
+
+    return make
@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlmodel import Session
+
+import executor
+from agent import Agent
+from db import JobRun, engine
+from executor import PendingRun
+from runstore import RunStore
+
+JOB = {"job_id": "proj-stubborn", "target_name": "proj", "runs_on": ["linux"], "limits": {"timeout": 1}}
+# Ignores SIGTERM, so it only stops at the SIGKILL, which takes the launcher's usage report with it.
+STUBBORN = "trap '' TERM; sleep 30"
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "KILL_GRACE", 0.5)
+    return Agent(["linux"], targets_file=tmp_path / "targets.yaml")
+
+
+def _claimed_run(agent: Agent) -> PendingRun:
+    now = datetime.utcnow()
+    RunStore().insert(JobRun(run_id="r1", job_id=JOB["job_id"], target_name="proj", status="queued",
+                             triggered_by="test", started_at=now, queued_at=now))
+    [row] = agent.queue.claim([JOB["job_id"]], exclude=set(), limit=1)
+    return PendingRun(row.run_id, JOB, STUBBORN, row.triggered_by, queued_at=row.queued_at)
+
+
+def _get(run_id: str) -> JobRun:
+    with Session(engine) as session:
+        return session.get(JobRun, run_id)
+
+
+def test_run_killed_after_ignoring_its_timeout_is_recorded_as_timed_out(agent):
+    asyncio.run(agent._execute(_claimed_run(agent)))
+
+    run = _get("r1")
+    assert (run.status, run.exit_code, run.max_rss_kb) == ("failed", -9, None)
+    assert run.error_message.startswith("Timed out after 1s")
+
+
+def test_run_killed_after_ignoring_its_cancellation_is_recorded_as_cancelled(agent):
+    run = _claimed_run(agent)
+    run.job = {**JOB, "limits": {}}
+    run.cancelled_by = "admin"
+
+    async def execute():
+        asyncio.get_running_loop().call_later(0.2, run.cancel.set)
+        await agent._execute(run)
+
+    asyncio.run(execute())
+
+    stored = _get("r1")
+    assert (stored.status, stored.exit_code, stored.error_message) == ("cancelled", -9, "Cancelled by admin")
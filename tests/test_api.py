@@ -0,0 +1,132 @@
+import asyncio
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+import runlogs
+from conftest import PASSWORD
+from db import JobRun, engine
+from runstore import RunStore
+from workers import WorkerQueue
+
+AUTH = ("admin", PASSWORD)
+AGENT_AUTH = ("agent", PASSWORD)
+REPO = Path(__file__).resolve().parent.parent
+
+
+def _wait_finished(client: TestClient, run_id: str, timeout: float = 10.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        run = client.get(f"/api/runs/{run_id}", auth=AUTH).json()
+        if run["status"] not in ("queued", "running"):
+            return run
+        time.sleep(0.1)
+    raise AssertionError(f"run {run_id} did not finish")
+
+
+def test_run_executes_once_while_run_store_lags(make_api, tmp_path, monkeypatch):
+    counter = tmp_path / "executions"
+    api = make_api([{"name": "count", "command": f"echo run >> {counter}"}])
+    apply = RunStore._apply
+
+    def slow_apply(self, batch):
+        time.sleep(1.0)
+        apply(self, batch)
+
+    with TestClient(api.app) as client:
+        run_id = client.post("/api/jobs/proj-count/trigger", auth=AUTH).json()["run_id"]
+        # The finished run's writes now sit in the queue across several
+        # queue consumer passes, during which its row still reads queued.
+        monkeypatch.setattr(RunStore, "_apply", slow_apply)
+        run = _wait_finished(client, run_id)
+
+    assert run["status"] == "success"
+    assert counter.read_text().splitlines() == ["run"]
+
+
+def test_only_agents_append_to_run_logs(make_api):
+    api = make_api([{"name": "remote", "command": "true", "runs_on": ["gpu"]}])
+
+    with TestClient(api.app) as client:
+        run_id = client.post("/api/jobs/proj-remote/trigger", auth=AUTH).json()["run_id"]
+        queue = WorkerQueue(["gpu"])
+        assert [run.run_id for run in queue.claim(["proj-remote"], exclude=set(), limit=1)] == [run_id]
+        url = f"/api/runs/{run_id}/logs"
+        params = {"offset": 0, "worker_id": queue.worker_id}
+
+        assert client.post(url, params=params, content=b"forged\n", auth=AUTH).status_code == 403
+        response = client.post(url, params={**params, "worker_id": "other"}, content=b"x\n", auth=AGENT_AUTH)
+        assert response.status_code == 409
+        response = client.post(url, params=params, content=b"hello\n", auth=AGENT_AUTH)
+        assert response.json() == {"size": 6}
+        # A retried chunk is only written once.
+        response = client.post(url, params=params, content=b"hello\nworld\n", auth=AGENT_AUTH)
+        assert response.json() == {"size": 12}
+
+    assert runlogs.log_path(run_id).read_text() == "hello\nworld\n"
+
+
+def test_pipeline_child_outcome_is_recorded_off_the_event_loop(make_api, monkeypatch):
+    api = make_api([{"name": "build", "command": "true"}])
+    now = datetime.utcnow()
+    RunStore().insert(JobRun(run_id="child", job_id="proj-build", target_name="proj", status="running",
+                             triggered_by="test", started_at=now, queued_at=now, parent_run_id="pipeline"))
+    run = SimpleNamespace(run_id="child", job={"job_id": "proj-build"}, parent_run_id="pipeline")
+    apply = RunStore._apply
+
+    def slow_apply(self, batch):
+        time.sleep(0.5)
+        apply(self, batch)
+
+    async def record_while_ticking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await api._record_finished(run, now.date(), status="success", finished_at=now, exit_code=0)
+        ticker.cancel()
+        return ticks
+
+    monkeypatch.setattr(RunStore, "_apply", slow_apply)
+    assert asyncio.run(record_while_ticking()) >= 5
+    with Session(engine) as session:
+        assert session.get(JobRun, "child").status == "success"
+
+
+# A worker process starting on a fresh database, publishing its catalog along with the others.
+STARTUP = """
+import os, sys, time
+from pathlib import Path
+from types import SimpleNamespace
+os.chdir(sys.argv[1])
+sys.path.insert(0, sys.argv[2])
+import api, db
+db.init_db()
+Path(f"ready.{os.getpid()}").touch()
+while len(list(Path().glob("ready.*"))) < int(sys.argv[3]):
+    time.sleep(0.001)
+print(api._publish_catalog_version(SimpleNamespace(digest="d1")))
+"""
+
+
+def test_workers_starting_together_publish_one_catalog_version(tmp_path):
+    workers = [
+        subprocess.Popen([sys.executable, "-c", STARTUP, str(tmp_path), str(REPO), "4"],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+    results = [worker.communicate(timeout=60) for worker in workers]
+
+    assert [worker.returncode for worker in workers] == [0] * 4, [err for _, err in results]
+    assert [out.strip() for out, _ in results] == ["1"] * 4
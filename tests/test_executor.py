@@ -0,0 +1,111 @@
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from executor import Dispatcher, OutputTail, PendingRun, RunLimits, run_command
+
+
+def _run(tmp_path, cmd: str, **kwargs):
+    return asyncio.run(run_command(cmd, tmp_path / "run.log", OutputTail(), **kwargs))
+
+
+def test_max_rss_is_the_commands_own(tmp_path):
+    # A shell forked from this process would start from its peak RSS.
+    ballast = bytearray(200 * 1024 * 1024)
+    ballast[::4096] = b"x" * len(ballast[::4096])
+
+    result = _run(tmp_path, "true")
+    assert result.returncode == 0
+    assert result.rusage.ru_maxrss < 64 * 1024
+
+    result = _run(tmp_path, f"{sys.executable} -c 'b = bytearray(100 * 1024 * 1024); b[::4096] = b\"x\" * len(b[::4096])'")
+    assert result.rusage.ru_maxrss > 100 * 1024
+
+
+def test_exit_status_is_the_commands(tmp_path):
+    assert _run(tmp_path, "exit 3").returncode == 3
+    assert _run(tmp_path, "kill -TERM $$").returncode == -15
+
+
+def test_memory_limit_applies_to_the_command(tmp_path):
+    cmd = f"{sys.executable} -c 'bytearray(200 * 1024 * 1024)'"
+    result = _run(tmp_path, cmd, limits=RunLimits(max_memory_mb=100))
+    assert result.returncode != 0
+    assert "MemoryError" in (tmp_path / "run.log").read_text()
+
+
+def test_cancel_stops_the_run_and_keeps_its_usage(tmp_path):
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+
+    result = _run(tmp_path, "sleep 30", cancel=cancel)
+
+    assert result.stopped == "cancelled"
+    assert result.returncode == -15
+    assert result.rusage is not None
+
+
+def _pending(run_id: str) -> PendingRun:
+    return PendingRun(run_id, {"job_id": "proj-build", "target_name": "proj"}, "true", "test")
+
+
+def test_submit_records_the_run_without_holding_up_the_dispatcher():
+    executed = {run_id: threading.Event() for run_id in ("slow", "fast")}
+
+    async def execute(run):
+        executed[run.run_id].set()
+
+    dispatcher = Dispatcher(execute, max_workers=2, max_queue=2)
+    recording, release = threading.Event(), threading.Event()
+
+    def slow_record(run):
+        recording.set()
+        release.wait(10)
+
+    submitter = threading.Thread(target=dispatcher.submit, args=(_pending("slow"), slow_record))
+    submitter.start()
+    assert recording.wait(10)
+
+    # Other runs still start and finish, and the slot stays reserved.
+    assert dispatcher.submit(_pending("fast"))
+    assert executed["fast"].wait(10)
+    assert not dispatcher.submit(_pending("slow"))
+    assert dispatcher.capacity() == 1
+    assert not executed["slow"].is_set()
+    release.set()
+    submitter.join(10)
+    assert executed["slow"].wait(10)
+
+
+def test_failed_recording_gives_the_slot_back():
+    async def execute(run):
+        pass
+
+    def broken_record(run):
+        raise OSError("database is locked")
+
+    dispatcher = Dispatcher(execute, max_queue=1)
+    with pytest.raises(OSError):
+        dispatcher.submit(_pending("r1"), broken_record)
+
+    assert dispatcher.run_ids() == set()
+    assert dispatcher.capacity() == 1
+
+
+def test_run_cancelled_while_being_recorded_is_dropped():
+    executed = []
+
+    async def execute(run):
+        executed.append(run.run_id)
+
+    dispatcher = Dispatcher(execute)
+
+    def record(run):
+        assert dispatcher.cancel(run.run_id, "admin") == "queued"
+
+    assert dispatcher.submit(_pending("r1"), record)
+    assert dispatcher.run_ids() == set()
+    assert dispatcher.stats()["queued"] == 0
+    assert executed == []
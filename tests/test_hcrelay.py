@@ -0,0 +1,106 @@
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from hcrelay import LOCK_NAME, PingRelay, spool
+
+
+class _Healthchecks(BaseHTTPRequestHandler):
+    statuses: list[int] = []
+    received: list[tuple[str, bytes]] = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.received.append((self.path, body))
+        self.send_response(self.statuses.pop(0) if self.statuses else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def healthchecks():
+    _Healthchecks.statuses, _Healthchecks.received = [], []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Healthchecks)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield _Healthchecks, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def relay(tmp_path):
+    relay = PingRelay(tmp_path / "spool")
+    for sub in ("tmp", "new"):
+        (relay.spool_dir / sub).mkdir(parents=True)
+    return relay
+
+
+def test_delivers_and_removes_spooled_pings(relay, healthchecks):
+    server, base = healthchecks
+    spool(f"{base}/key/job", "start", spool_dir=relay.spool_dir)
+    spool(f"{base}/key/job", "0", b"all good", spool_dir=relay.spool_dir)
+
+    assert relay.deliver_pending() == 2
+
+    assert server.received == [("/key/job/start", b""), ("/key/job/0", b"all good")]
+    assert relay.pending() == []
+
+
+def test_failed_ping_is_retried_later_and_keeps_its_checks_order(relay, healthchecks):
+    server, base = healthchecks
+    server.statuses = [503]
+    spool(f"{base}/key/job", "start", spool_dir=relay.spool_dir)
+    spool(f"{base}/key/job", "0", spool_dir=relay.spool_dir)
+
+    assert relay.deliver_pending() == 0
+    assert len(relay.pending()) == 2
+    # Backing off: nothing is sent until the retry time.
+    assert relay.deliver_pending() == 0
+    assert len(server.received) == 1
+
+    relay._retry_at.clear()
+    assert relay.deliver_pending() == 2
+    assert [path for path, _ in server.received] == ["/key/job/start", "/key/job/start", "/key/job/0"]
+
+
+def test_rejected_ping_is_dropped(relay, healthchecks):
+    server, base = healthchecks
+    server.statuses = [404]
+    spool(f"{base}/key/missing", "start", spool_dir=relay.spool_dir)
+
+    assert relay.deliver_pending() == 0
+    assert relay.pending() == []
+
+
+def test_pings_older_than_max_age_are_dropped_unsent(relay, healthchecks):
+    server, base = healthchecks
+    relay.configure({"max_age_hours": 1})
+    path = spool(f"{base}/key/job", "start", spool_dir=relay.spool_dir)
+    stale = time.time_ns() - 2 * 3600 * 10**9
+    path.rename(path.with_name(f"{stale}-{path.name.split('-', 1)[1]}"))
+
+    assert relay.deliver_pending() == 0
+    assert relay.pending() == []
+    assert server.received == []
+
+
+def _lock_taken(relay: PingRelay) -> bool:
+    # What wrapper.sh's relay_running checks.
+    result = subprocess.run(["flock", "-n", "-E", "75", str(relay.spool_dir / LOCK_NAME), "true"])
+    return result.returncode == 75
+
+
+def test_relay_holds_its_lock_only_while_running(relay):
+    relay.start()
+    try:
+        assert _lock_taken(relay)
+    finally:
+        relay.stop()
+    assert not _lock_taken(relay)
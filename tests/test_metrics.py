@@ -0,0 +1,102 @@
+import json
+import os
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from conftest import PASSWORD
+from db import JobRun
+from metrics import Profiler, Registry, SharedMetrics
+from runstore import RunStore
+
+
+def _registry(pings: dict = {}, waits: list = []) -> Registry:
+    registry = Registry()
+    counter = registry.counter("pings_total", "Pings", ("result",))
+    histogram = registry.histogram("wait_seconds", "Wait", buckets=(1, 10))
+    for result, count in pings.items():
+        counter.inc(count, result=result)
+    for wait in waits:
+        histogram.observe(wait)
+    return registry
+
+
+def _other_process(directory, pid: int, registry: Registry, profiles=()):
+    (directory / f"{pid}.json").write_text(json.dumps({
+        "pid": pid, "metrics": registry.export(), "profiles": list(profiles),
+    }))
+
+
+def test_render_adds_up_live_processes(tmp_path):
+    mine = _registry({"sent": 1}, [0.5])
+    theirs = _registry({"sent": 2, "dropped": 1}, [5])
+    shared = SharedMetrics(tmp_path, mine, Profiler())
+    shared.start()
+    try:
+        _other_process(tmp_path, os.getppid(), theirs)
+        text = shared.render()
+    finally:
+        shared.stop()
+
+    assert 'pings_total{result="sent"} 3' in text
+    assert 'pings_total{result="dropped"} 1' in text
+    assert 'wait_seconds_bucket{le="1"} 1' in text
+    assert 'wait_seconds_bucket{le="10"} 2' in text
+    assert "wait_seconds_count 2" in text
+    assert not (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_files_of_exited_processes_are_dropped(tmp_path):
+    theirs = _registry({"sent": 1}, [])
+    dead = 2 ** 22 + 1  # above the default pid_max
+    _other_process(tmp_path, dead, theirs)
+
+    text = SharedMetrics(tmp_path, _registry(), Profiler()).render()
+
+    assert "pings_total{" not in text
+    assert not (tmp_path / f"{dead}.json").exists()
+
+
+def test_profiler_settings_reach_other_processes(tmp_path):
+    here, there = Profiler(), Profiler()
+    SharedMetrics(tmp_path, _registry(), here).configure_profiler(True, "/api/jobs")
+    other = SharedMetrics(tmp_path, _registry(), there)
+    assert not there.enabled
+
+    other.sync()
+
+    assert (there.enabled, there.match) == (True, "/api/jobs")
+
+
+def test_profiles_come_from_every_process(tmp_path):
+    _other_process(tmp_path, os.getppid(), _registry(), [{"path": "/api/jobs", "at": 1.0}])
+    shared = SharedMetrics(tmp_path, _registry(), Profiler())
+
+    assert shared.profiles() == [{"path": "/api/jobs", "at": 1.0, "pid": os.getppid()}]
+
+
+def test_run_gauges_come_from_the_database(make_api):
+    api = make_api([{"name": "build", "command": "true"}])
+    now = datetime.utcnow()
+    store = RunStore()
+    for run_id, job, run_status in [("a", "proj-build", "running"), ("b", "proj-build", "queued"),
+                                    ("c", "proj-test", "queued"), ("d", "proj-test", "success")]:
+        store.insert(JobRun(run_id=run_id, job_id=job, target_name="proj", status=run_status,
+                            triggered_by="test", started_at=now, queued_at=now))
+
+    text = api.metrics.REGISTRY.render()
+
+    assert 'runs_active{job_id="proj-build"} 1' in text
+    assert 'runs_queued{job_id="proj-test"} 1' in text
+    assert "run_queue_depth 2" in text
+
+
+def test_profiling_is_for_admins(make_api):
+    api = make_api([{"name": "build", "command": "true"}])
+
+    with TestClient(api.app) as client:
+        agent = ("agent", PASSWORD)
+        assert client.get("/api/debug/profile", auth=agent).status_code == 403
+        assert client.put("/api/debug/profile", params={"enabled": True}, auth=agent).status_code == 403
+        response = client.put("/api/debug/profile", params={"enabled": False}, auth=("admin", PASSWORD))
+        assert response.json() == {"enabled": False, "match": "/api/"}
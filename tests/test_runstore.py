@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from sqlmodel import Session
+
+from db import JobRun, engine
+from runstore import RunStore
+
+
+def _queued(run_id: str, **fields) -> JobRun:
+    now = datetime.utcnow()
+    return JobRun(
+        run_id=run_id, job_id="proj-build", target_name="proj", status="queued",
+        triggered_by="test", started_at=now, queued_at=now, **fields,
+    )
+
+
+def _get(run_id: str) -> JobRun:
+    with Session(engine) as session:
+        return session.get(JobRun, run_id)
+
+
+def test_claim_only_succeeds_once():
+    store = RunStore()
+    store.insert(_queued("r1"))
+    started_at = datetime.utcnow()
+
+    assert store.claim("r1", started_at=started_at, queue_wait_ms=5)
+    assert not store.claim("r1", started_at=started_at, queue_wait_ms=5)
+
+    run = _get("r1")
+    assert run.status == "running"
+    assert run.queue_wait_ms == 5
+
+
+def test_claim_skips_cancelled_and_finished_runs():
+    store = RunStore()
+    store.insert(_queued("cancelled", cancelled_by="admin"))
+    store.insert(_queued("done"))
+    store.finish("done", "proj-build", datetime.utcnow().date(), status="success", finished_at=datetime.utcnow())
+
+    assert not store.claim("cancelled")
+    assert not store.claim("done")
+    assert _get("cancelled").status == "queued"
+    assert _get("done").status == "success"
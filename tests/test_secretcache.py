@@ -0,0 +1,99 @@
+import json
+import stat
+import sys
+
+import pytest
+from cryptography.fernet import Fernet
+
+from secretcache import SecretCache, SecretsUnavailable
+
+# Prints the JSON in the file it is given, or fails like an unreachable Doppler once it is gone.
+PROVIDER = """
+import pathlib, sys
+path = pathlib.Path(sys.argv[1])
+if not path.exists():
+    sys.exit("doppler: unable to reach the API")
+print(path.read_text())
+"""
+
+
+@pytest.fixture
+def provider(tmp_path):
+    secrets_file = tmp_path / "provider.json"
+    secrets_file.write_text(json.dumps({"TOKEN": "one"}))
+    return secrets_file
+
+
+def _cache(tmp_path, provider, **config) -> SecretCache:
+    cache = SecretCache(tmp_path / "secrets")
+    cache.configure({
+        "command": [sys.executable, "-c", PROVIDER, str(provider)],
+        "key_file": tmp_path / "keys" / "secrets.key",
+        **config,
+    })
+    return cache
+
+
+def _age(cache: SecretCache, seconds: float):
+    """Make every snapshot ``seconds`` older, in memory and on disk."""
+    for key, (fetched_at, secrets) in list(cache._snapshots.items()):
+        cache._store(*key, (fetched_at - seconds, secrets))
+
+
+def test_snapshot_is_reused_within_its_ttl(tmp_path, provider):
+    cache = _cache(tmp_path, provider, cache_ttl=3600)
+    assert cache.environ("proj", "prd") == {"TOKEN": "one"}
+
+    provider.write_text(json.dumps({"TOKEN": "two"}))
+    assert cache.environ("proj", "prd") == {"TOKEN": "one"}
+    # Another process (a cron job) reads the same snapshot from disk.
+    assert _cache(tmp_path, provider, cache_ttl=3600).environ("proj", "prd") == {"TOKEN": "one"}
+
+    _age(cache, 3600)
+    assert cache.environ("proj", "prd") == {"TOKEN": "two"}
+
+
+def test_stale_snapshot_is_used_while_the_provider_fails(tmp_path, provider):
+    cache = _cache(tmp_path, provider, cache_ttl=60, max_stale_hours=1)
+    cache.environ("proj", "prd")
+    provider.unlink()
+
+    _age(cache, 120)
+    assert cache.environ("proj", "prd") == {"TOKEN": "one"}
+    assert _cache(tmp_path, provider, cache_ttl=60, max_stale_hours=1).environ("proj", "prd") == {"TOKEN": "one"}
+
+    _age(cache, 3600)
+    with pytest.raises(SecretsUnavailable, match="unable to reach the API"):
+        cache.environ("proj", "prd")
+
+
+def test_no_snapshot_and_no_provider_is_an_error(tmp_path, provider):
+    provider.unlink()
+    with pytest.raises(SecretsUnavailable):
+        _cache(tmp_path, provider).environ("proj", "prd")
+
+
+def test_key_is_kept_private_and_apart_from_the_snapshots(tmp_path, provider):
+    cache = _cache(tmp_path, provider)
+    cache.cache_dir.mkdir()
+    (cache.cache_dir / "key").write_bytes(b"left by an earlier version")
+    cache.environ("proj", "prd")
+
+    key_file = tmp_path / "keys" / "secrets.key"
+    assert stat.S_IMODE(key_file.stat().st_mode) == 0o600
+    assert stat.S_IMODE(key_file.parent.stat().st_mode) == 0o700
+    assert sorted(path.suffix for path in cache.cache_dir.iterdir()) == [".lock", ".snap"]
+    assert b"one" not in next(cache.cache_dir.glob("*.snap")).read_bytes()
+
+
+def test_key_can_come_from_the_environment(tmp_path, provider, monkeypatch):
+    monkeypatch.setenv("SCHEDULER_SECRETS_KEY", Fernet.generate_key().decode())
+    cache = _cache(tmp_path, provider)
+    cache.environ("proj", "prd")
+
+    assert not (tmp_path / "keys").exists()
+    monkeypatch.delenv("SCHEDULER_SECRETS_KEY")
+    provider.unlink()
+    # Without the key the snapshot cannot be read.
+    with pytest.raises(SecretsUnavailable):
+        _cache(tmp_path, provider).environ("proj", "prd")
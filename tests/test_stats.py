@@ -0,0 +1,35 @@
+import pytest
+
+from stats import GAMMA, DurationSketch
+
+
+def _sketch(durations) -> DurationSketch:
+    sketch = DurationSketch()
+    for duration in durations:
+        sketch.add(duration)
+    return sketch
+
+
+def test_quantiles_use_the_nearest_rank():
+    sketch = _sketch([3, 3, 1006])
+
+    assert sketch.quantile(0.5) == pytest.approx(3, rel=GAMMA - 1)
+    assert sketch.quantile(0.95) == pytest.approx(1006, rel=GAMMA - 1)
+    assert sketch.quantile(0.99) == pytest.approx(1006, rel=GAMMA - 1)
+
+
+def test_quantiles_of_many_runs_stay_within_the_bucket_error():
+    sketch = _sketch(range(1, 1001))
+
+    assert sketch.quantile(0.5) == pytest.approx(500, rel=GAMMA - 1)
+    assert sketch.quantile(0.99) == pytest.approx(990, rel=GAMMA - 1)
+    assert _sketch([0, 0]).quantile(0.5) == 0
+    assert DurationSketch().quantile(0.5) is None
+
+
+def test_merged_sketches_give_the_quantiles_of_all_runs():
+    sketch = _sketch([10] * 98)
+    sketch.merge(DurationSketch.from_json(_sketch([5000, 5000]).to_json()))
+
+    assert sketch.quantile(0.5) == pytest.approx(10, rel=GAMMA - 1)
+    assert sketch.quantile(0.99) == pytest.approx(5000, rel=GAMMA - 1)
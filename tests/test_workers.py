@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+import runlogs
+from db import JobRun, JobRunDaily, engine
+from runstore import RunStore
+from workers import LeaseMonitor, WorkerQueue, can_run
+
+JOB_ID = "proj-build"
+
+
+def _queue_run(run_id: str, **fields):
+    now = datetime.utcnow()
+    RunStore().insert(JobRun(
+        run_id=run_id, job_id=JOB_ID, target_name="proj", status="queued",
+        triggered_by="test", started_at=now, queued_at=now, **fields,
+    ))
+
+
+def _get(run_id: str) -> JobRun:
+    with Session(engine) as session:
+        return session.get(JobRun, run_id)
+
+
+def _monitor(max_attempts: int = 3) -> LeaseMonitor:
+    monitor = LeaseMonitor(on_finished=lambda runs: None)
+    monitor.configure({"max_attempts": max_attempts})
+    return monitor
+
+
+def _after_lease(queue: WorkerQueue) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=queue.lease_seconds + 1)
+
+
+def test_can_run_needs_every_label():
+    job = {"target_name": "proj", "runs_on": ["linux", "gpu"]}
+    assert can_run(job, ["gpu", "linux", "arm"])
+    assert not can_run(job, ["linux"])
+    assert not can_run(job, ["gpu", "linux"], targets=["other"])
+    assert not can_run({"target_name": "proj"}, ["linux"])
+
+
+def test_claim_hands_each_run_to_one_worker():
+    _queue_run("r1")
+    _queue_run("r2")
+    _queue_run("cancelled", cancelled_by="admin")
+    first, second = WorkerQueue(["linux"]), WorkerQueue(["linux"])
+
+    claimed = first.claim([JOB_ID], exclude=set(), limit=1)
+    assert [run.run_id for run in claimed] == ["r1"]
+    assert [run.run_id for run in second.claim([JOB_ID], exclude=set(), limit=5)] == ["r2"]
+    assert first.claim([JOB_ID], exclude=set(), limit=5) == []
+
+    run = _get("r1")
+    assert (run.status, run.worker_id, run.attempts) == ("running", first.worker_id, 1)
+    assert run.lease_expires_at > datetime.utcnow()
+    assert _get("cancelled").status == "queued"
+
+
+def test_heartbeat_renews_leases_and_reports_lost_runs():
+    _queue_run("r1")
+    queue = WorkerQueue(["linux"], lease_seconds=30)
+    queue.claim([JOB_ID], exclude=set(), limit=1)
+
+    assert queue.heartbeat({"r1"}) == set()
+    assert _monitor().check(now=datetime.utcnow() + timedelta(seconds=10)) == 0
+    assert _get("r1").status == "running"
+
+    _monitor().check(now=_after_lease(queue))
+    assert queue.heartbeat({"r1"}) == {"r1"}
+    assert not queue.finish("r1", JOB_ID, datetime.utcnow().date(), status="success")
+
+
+def test_expired_lease_requeues_the_run_and_drops_its_partial_log():
+    _queue_run("r1")
+    queue = WorkerQueue(["linux"])
+    queue.claim([JOB_ID], exclude=set(), limit=1)
+    runlogs.log_path("r1").write_text("partial output\n")
+
+    assert _monitor().check(now=_after_lease(queue)) == 1
+
+    run = _get("r1")
+    assert (run.status, run.worker_id, run.lease_expires_at) == ("queued", None, None)
+    assert "requeued (attempt 1 of 3)" in run.error_message
+    assert not runlogs.log_path("r1").exists()
+    # Another agent picks it up as its second attempt.
+    retry = WorkerQueue(["linux"]).claim([JOB_ID], exclude=set(), limit=1)
+    assert [r.run_id for r in retry] == ["r1"]
+    assert _get("r1").attempts == 2
+
+
+def test_expired_lease_fails_the_run_after_max_attempts_and_keeps_its_log():
+    _queue_run("r1")
+    monitor = _monitor(max_attempts=2)
+    for _ in range(2):
+        queue = WorkerQueue(["linux"])
+        queue.claim([JOB_ID], exclude=set(), limit=1)
+        runlogs.log_path("r1").write_text("output\n")
+        monitor.check(now=_after_lease(queue))
+
+    run = _get("r1")
+    assert (run.status, run.exit_code) == ("failed", -1)
+    assert "gave up after 2 attempt(s)" in run.error_message
+    assert runlogs.log_path("r1").read_text() == "output\n"
+    with Session(engine) as session:
+        rollup = session.get(JobRunDaily, (JOB_ID, run.started_at.date()))
+    assert (rollup.runs, rollup.failures) == (1, 1)
+
+
+def test_expired_lease_of_a_cancelled_run_records_it_cancelled():
+    _queue_run("r1")
+    queue = WorkerQueue(["linux"])
+    queue.claim([JOB_ID], exclude=set(), limit=1)
+    RunStore().update("r1", cancelled_by="admin")
+    runlogs.log_path("r1").write_text("output\n")
+
+    _monitor().check(now=_after_lease(queue))
+
+    run = _get("r1")
+    assert run.status == "cancelled"
+    assert run.error_message.startswith("Cancelled by admin")
+    assert runlogs.log_path("r1").exists()
+
+
+def test_release_puts_held_runs_back_in_the_queue():
+    _queue_run("r1")
+    queue = WorkerQueue(["linux"])
+    queue.claim([JOB_ID], exclude=set(), limit=1)
+
+    assert queue.release(["r1"]) == 1
+    assert (_get("r1").status, _get("r1").worker_id) == ("queued", None)
+    assert queue.release(["r1"]) == 0
@@ -0,0 +1,137 @@
+"""Background watcher that reloads the job catalog when its files change."""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from catalog import CatalogLoader
+
+try:
+    import watchfiles
+except ImportError:  # pragma: no cover - watchfiles ships with uvicorn[standard]
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0
+DEBOUNCE_MS = 500
+
+
+class CatalogWatcher:
+    """Call ``on_change`` whenever targets.yaml or a schedule file changes.
+
+    Uses inotify (through watchfiles) on the directories holding the watched
+    files, so editors that replace files atomically are still noticed, and
+    falls back to polling file stats every ``poll_interval`` seconds. The set
+    of watched files is refreshed after every reload, so adding a target
+    starts watching its schedule file.
+    """
+
+    def __init__(
+        self,
+        loader: CatalogLoader,
+        on_change: Callable[[], None],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        use_inotify: bool = True,
+    ):
+        self._loader = loader
+        self._on_change = on_change
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and watchfiles is not None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Watching catalog files (%s)", "inotify" if self.use_inotify else "polling")
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _fire(self):
+        try:
+            self._on_change()
+        except Exception:
+            logger.exception("Catalog reload failed, keeping the previous catalog")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.use_inotify:
+                self._watch_inotify()
+            elif self._stop.wait(self.poll_interval):
+                return
+            if not self._stop.is_set() and self._loader.stale():
+                self._fire()
+
+    def _watch_inotify(self):
+        """Block until a watched file changes, or the watched set needs refreshing."""
+        paths = {p.resolve() for p in self._loader.watched_paths()}
+        dirs = {p.parent for p in paths if p.parent.is_dir()}
+        if not dirs:
+            self._stop.wait(self.poll_interval)
+            return
+        for changes in watchfiles.watch(
+            *dirs,
+            stop_event=self._stop,
+            debounce=DEBOUNCE_MS,
+            rust_timeout=int(self.poll_interval * 1000),
+            yield_on_timeout=True,
+        ):
+            if changes:
+                if any(Path(p).resolve() in paths for _, p in changes):
+                    return
+            elif self._loader.stale():
+                # Timeouts yield an empty set; the stat check catches files
+                # in directories that did not exist when the watch started.
+                return
+
+
+class VersionWatcher:
+    """Call ``on_change`` whenever ``shared()`` no longer equals ``current()``.
+
+    With several API worker processes, each loads its own catalog; a reload
+    in one (through /catalog/reload, or its file watcher) bumps the version
+    shared in the database, and this brings the others up to date.
+    """
+
+    def __init__(
+        self,
+        shared: Callable[[], int],
+        current: Callable[[], int],
+        on_change: Callable[[], None],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        self._shared = shared
+        self._current = current
+        self._on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-version", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self._shared() != self._current():
+                    self._on_change()
+            except Exception:
+                logger.exception("Catalog version check failed")
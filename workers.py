@@ -0,0 +1,315 @@
+"""Lease-based run queue shared by the API executor and worker agents."""
+
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+
+import runlogs
+import stats
+from db import JobRun, Worker, engine, run_changes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 30
+DEFAULT_MAX_ATTEMPTS = 3
+MONITOR_INTERVAL = 5.0
+# Agents stamp finished_at with their own clocks; look back this far for
+# runs that finished "before" the previous pass on a host running behind.
+FINISHED_OVERLAP = timedelta(minutes=5)
+FORGET_WORKERS_AFTER = timedelta(days=1)
+FINISHED_STATUSES = ("success", "failed", "cancelled")
+
+
+def can_run(job: dict, labels: Iterable[str], targets: Optional[Iterable[str]] = None) -> bool:
+    """Whether an agent offering ``labels`` (and limited to ``targets``, if any) may run ``job``.
+
+    Only jobs with ``runs_on`` labels go to agents, and only to agents that
+    have every one of them.
+    """
+    required = job.get("runs_on") or []
+    if not required:
+        return False
+    if targets and job["target_name"] not in targets:
+        return False
+    return set(required) <= set(labels)
+
+
+class WorkerQueue:
+    """One agent's side of the queue: claim runs, renew their leases, record results.
+
+    A run is claimed by flipping its queued JobRun row to running under this
+    worker's id with a lease expiry, in one conditional UPDATE, so no two
+    agents can both win it. ``heartbeat`` renews the lease on every run the
+    worker holds and reports any it has lost, i.e. that LeaseMonitor gave to
+    someone else after the worker missed its heartbeats. ``start`` and
+    ``finish`` only write while the worker still holds the run.
+    """
+
+    def __init__(
+        self,
+        labels: list[str],
+        targets: Optional[list[str]] = None,
+        max_runs: int = 1,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    ):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.labels = sorted(labels)
+        self.targets = sorted(targets) if targets else None
+        self.max_runs = max_runs
+        self.lease_seconds = lease_seconds
+        self.started_at = datetime.utcnow()
+
+    def _lease_expiry(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def _held(self):
+        return (JobRun.worker_id == self.worker_id, JobRun.status == "running")
+
+    def register(self):
+        self.heartbeat(set())
+
+    def deregister(self):
+        with Session(engine) as session:
+            session.execute(Worker.__table__.delete().where(Worker.worker_id == self.worker_id))
+            session.commit()
+
+    def heartbeat(self, run_ids: set[str]) -> set[str]:
+        """Renew the worker's leases; returns which of ``run_ids`` it no longer holds."""
+        with Session(engine) as session:
+            session.merge(Worker(
+                worker_id=self.worker_id,
+                hostname=socket.gethostname(),
+                pid=os.getpid(),
+                labels=json.dumps(self.labels),
+                targets=json.dumps(self.targets) if self.targets else None,
+                max_runs=self.max_runs,
+                started_at=self.started_at,
+                heartbeat_at=datetime.utcnow(),
+            ))
+            session.execute(update(JobRun).where(*self._held()).values(lease_expires_at=self._lease_expiry()))
+            held = set(session.exec(select(JobRun.run_id).where(*self._held())).all())
+            session.commit()
+        return run_ids - held
+
+    def claim(self, job_ids: Iterable[str], exclude: set[str], limit: int) -> list[JobRun]:
+        """Take up to ``limit`` of the oldest queued runs of ``job_ids``."""
+        job_ids = list(job_ids)
+        if not job_ids or limit <= 0:
+            return []
+        claimed = []
+        with Session(engine) as session:
+            candidates = session.exec(
+                select(JobRun)
+                .where(
+                    JobRun.status == "queued",
+                    JobRun.cancelled_by.is_(None),
+                    JobRun.job_id.in_(job_ids),
+                    JobRun.run_id.not_in(exclude),
+                )
+                .order_by(JobRun.queued_at)
+                .limit(limit)
+            ).all()
+            session.expunge_all()
+            for row in candidates:
+                result = session.execute(
+                    update(JobRun)
+                    .where(JobRun.run_id == row.run_id, JobRun.status == "queued", JobRun.cancelled_by.is_(None))
+                    .values(
+                        status="running",
+                        worker_id=self.worker_id,
+                        lease_expires_at=self._lease_expiry(),
+                        attempts=func.coalesce(JobRun.attempts, 0) + 1,
+                    )
+                )
+                session.commit()
+                if result.rowcount == 1:
+                    claimed.append(row)
+        if claimed:
+            run_changes.bump()
+        return claimed
+
+    def release(self, run_ids: Iterable[str]) -> int:
+        """Hand runs this worker will not finish straight back to the queue."""
+        with Session(engine) as session:
+            result = session.execute(
+                update(JobRun)
+                .where(JobRun.run_id.in_(list(run_ids)), *self._held())
+                .values(status="queued", worker_id=None, lease_expires_at=None, started_at=JobRun.queued_at)
+            )
+            session.commit()
+        if result.rowcount:
+            run_changes.bump()
+        return result.rowcount
+
+    def cancellations(self) -> list[tuple[str, str, str]]:
+        """``(run_id, job_id, cancelled_by)`` for held runs someone asked to cancel."""
+        with Session(engine) as session:
+            return session.exec(
+                select(JobRun.run_id, JobRun.job_id, JobRun.cancelled_by).where(*self._held(), JobRun.cancelled_by.is_not(None))
+            ).all()
+
+    def start(self, run_id: str, **fields) -> bool:
+        with Session(engine) as session:
+            result = session.execute(update(JobRun).where(JobRun.run_id == run_id, *self._held()).values(**fields))
+            session.commit()
+        if result.rowcount != 1:
+            return False
+        run_changes.bump()
+        return True
+
+    def finish(self, run_id: str, job_id: str, day: date, **fields) -> bool:
+        """Record a held run's final status and add it to the daily rollups in one transaction."""
+        with Session(engine) as session:
+            result = session.execute(
+                update(JobRun)
+                .where(JobRun.run_id == run_id, *self._held())
+                .values(**fields, lease_expires_at=None, rolled_up=True)
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                return False
+            cpu_ms = None
+            if fields.get("cpu_user_ms") is not None:
+                cpu_ms = fields["cpu_user_ms"] + (fields.get("cpu_system_ms") or 0)
+            stats.record_run(
+                session, job_id, day, fields["status"], fields.get("duration_ms"), fields.get("finished_at"),
+                cpu_ms, fields.get("max_rss_kb"),
+            )
+            session.commit()
+        run_changes.bump()
+        return True
+
+
+class LeaseMonitor:
+    """Requeue runs whose worker agent stopped renewing its lease.
+
+    Runs in the executor process. Every ``interval`` seconds, runs whose
+    lease has expired go back to the queue for another agent, or fail once
+    they have been claimed ``max_attempts`` times (a job that keeps killing
+    its worker must not take down every agent in turn); cancelled ones are
+    recorded as cancelled. Runs agents have finished since the last pass are
+    passed to ``on_finished``, which the executor uses for log indexing and
+    pipelines, just as for the runs it executes itself.
+    """
+
+    def __init__(self, on_finished: Callable[[list[JobRun]], None], interval: float = MONITOR_INTERVAL):
+        self.on_finished = on_finished
+        self.interval = interval
+        self.max_attempts = DEFAULT_MAX_ATTEMPTS
+        self._since = datetime.utcnow()
+        self._seen: dict[str, datetime] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: dict):
+        """Apply the ``workers`` section of targets.yaml."""
+        self.max_attempts = config.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._since = datetime.utcnow()
+            self._thread = threading.Thread(target=self._loop, name="lease-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Checking worker leases failed")
+
+    def check(self, now: Optional[datetime] = None) -> int:
+        """One pass; returns how many expired runs were requeued or failed."""
+        now = now or datetime.utcnow()
+        expired = self._expire(now)
+        finished = self._collect_finished(now)
+        if finished:
+            self.on_finished(finished)
+        with Session(engine) as session:
+            session.execute(Worker.__table__.delete().where(Worker.heartbeat_at < now - FORGET_WORKERS_AFTER))
+            session.commit()
+        return expired
+
+    def _expire(self, now: datetime) -> int:
+        expired = 0
+        with Session(engine) as session:
+            rows = session.exec(
+                select(JobRun).where(
+                    JobRun.status == "running", JobRun.worker_id.is_not(None), JobRun.lease_expires_at < now
+                )
+            ).all()
+            session.expunge_all()
+            for row in rows:
+                attempts = row.attempts or 1
+                lost = f"Worker {row.worker_id} stopped responding"
+                if row.cancelled_by is not None:
+                    values = {"status": "cancelled", "error_message": f"Cancelled by {row.cancelled_by} ({lost})"}
+                elif attempts >= self.max_attempts:
+                    values = {"status": "failed", "error_message": f"{lost}; gave up after {attempts} attempt(s)"}
+                else:
+                    values = {
+                        "status": "queued",
+                        "worker_id": None,
+                        "started_at": row.queued_at or row.started_at,
+                        "queue_wait_ms": None,
+                        "error_message": f"{lost}; requeued (attempt {attempts} of {self.max_attempts})",
+                    }
+                if values["status"] != "queued":
+                    values.update(finished_at=now, exit_code=-1, rolled_up=True)
+                # A heartbeat that lands first renews the lease and wins.
+                result = session.execute(
+                    update(JobRun)
+                    .where(
+                        JobRun.run_id == row.run_id,
+                        JobRun.worker_id == row.worker_id,
+                        JobRun.status == "running",
+                        JobRun.lease_expires_at < now,
+                    )
+                    .values(lease_expires_at=None, **values)
+                )
+                if result.rowcount != 1:
+                    continue
+                if values["status"] != "queued":
+                    stats.record_run(session, row.job_id, row.started_at.date(), values["status"], None, now)
+                session.commit()
+                if values["status"] == "queued":
+                    # The next attempt writes the run's log from the start.
+                    runlogs.log_path(row.run_id).unlink(missing_ok=True)
+                logger.warning("Run %s (%s): %s", row.run_id, row.job_id, values["error_message"])
+                expired += 1
+        if expired:
+            run_changes.bump()
+        return expired
+
+    def _collect_finished(self, now: datetime) -> list[JobRun]:
+        since = self._since - FINISHED_OVERLAP
+        with Session(engine) as session:
+            rows = session.exec(
+                select(JobRun).where(
+                    JobRun.worker_id.is_not(None),
+                    JobRun.status.in_(FINISHED_STATUSES),
+                    JobRun.finished_at >= since,
+                )
+            ).all()
+            session.expunge_all()
+        new = [row for row in rows if row.run_id not in self._seen]
+        for row in new:
+            self._seen[row.run_id] = row.finished_at
+        self._since = now
+        self._seen = {run_id: at for run_id, at in self._seen.items() if at >= since}
+        return new
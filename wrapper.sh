@@ -10,21 +10,99 @@ cd "$WORK_DIR" || exit 1
 
 HC_PING_URL="$HC_PING_URL"
 HC_PING_KEY="$HC_PING_KEY"
+HC_SPOOL_DIR="/var/lib/monorepo-scheduler/hc-spool"
+HC_MAX_BODY=100000
+RUN_LOGS_DIR="/var/lib/monorepo-scheduler/logs"
+RUN_SLOTS_DIR="/var/lib/monorepo-scheduler/run-slots"
+
+# Runs started by the API pass in their id; cron runs get a fresh one, which
+# the API's run_log.csv ingester records them under.
+RUN_ID="${SCHEDULER_RUN_ID:-$(cat /proc/sys/kernel/random/uuid 2>/dev/null)}"
+
+# relay_running
+# Whether the API's relay is up: it holds relay.lock in the spool directory
+# while it runs (flock exits 75 here when the lock is taken).
+relay_running() {
+    [ -d "$HC_SPOOL_DIR/new" ] || return 1
+    flock -n -E 75 "$HC_SPOOL_DIR/relay.lock" true 2>/dev/null
+    [ $? -eq 75 ]
+}
+
+# hc_ping SIGNAL [BODY_FILE]
+# Hand the ping to the API's relay through its spool directory so a slow
+# Healthchecks server cannot delay the job; fall back to curl if no relay.
+hc_ping() {
+    local check="${HC_PING_URL}/${HC_PING_KEY}/${HC_PING_SLUG}"
+    if relay_running; then
+        local name="$(date +%s%N)-$$-${RANDOM}-$1.ping"
+        if (
+            umask 077
+            {
+                printf 'check=%s\nsignal=%s\n\n' "$check" "$1"
+                if [ -n "$2" ]; then tail -c "$HC_MAX_BODY" "$2"; fi
+            } > "$HC_SPOOL_DIR/tmp/$name"
+        ) 2>/dev/null && mv "$HC_SPOOL_DIR/tmp/$name" "$HC_SPOOL_DIR/new/$name"; then
+            return
+        fi
+        rm -f "$HC_SPOOL_DIR/tmp/$name"
+    fi
+    if [ -n "$2" ]; then
+        tail -c "$HC_MAX_BODY" "$2" | curl -sfm 10 --data-binary @- "$check/$1" > /dev/null 2>&1
+    else
+        curl -sfm 10 "$check/$1" > /dev/null 2>&1
+    fi
+}
+
+# admit SLOTS
+# Wait until one of SLOTS host-wide slot locks is free and hold it (on
+# fd 9) until this script exits, so at most SLOTS scheduled runs execute
+# at once and the rest start as others finish.
+admit() {
+    mkdir -p "$RUN_SLOTS_DIR" 2>/dev/null || return 0
+    local i first=$((RANDOM % $1))
+    while :; do
+        for ((i = 0; i < $1; i++)); do
+            exec 9>>"$RUN_SLOTS_DIR/slot.$(((first + i) % $1))" || return 0
+            if flock -n 9; then
+                return 0
+            fi
+            exec 9>&-
+        done
+        sleep 1
+    done
+}
+
+# Cron files set SCHEDULER_MAX_RUNNING (scheduler.max_running); runs started
+# by the API are admitted by its dispatcher instead.
+if [ -z "$SCHEDULER_RUN_ID" ] && [ "${SCHEDULER_MAX_RUNNING:-0}" -gt 0 ] 2>/dev/null; then
+    admit "$SCHEDULER_MAX_RUNNING"
+fi
 
 START_TS=$(date '+%Y-%m-%d %H:%M:%S')
 START_EPOCH=$(date +%s)
 
 # Ping Healthchecks start
 if [ -n "$HC_PING_URL" ] && [ -n "$HC_PING_KEY" ] && [ -n "$HC_PING_SLUG" ]; then
-    curl -sfm 10 "${HC_PING_URL}/${HC_PING_KEY}/${HC_PING_SLUG}/start" > /dev/null 2>&1
+    hc_ping start
 fi
 
 # Capture output to temp file so we can send it to Healthchecks
 TMPLOG=$(mktemp)
 
+# Job limits for cron runs (see LIMIT_ENV in main.py); timeout signals the
+# command's whole process group, the ulimits apply to every process in it.
+LIMITED=()
+if [ -n "$SCHEDULER_TIMEOUT" ]; then
+    LIMITED=(timeout --kill-after=10 "$SCHEDULER_TIMEOUT")
+fi
+
 {
     echo "=== START $START_TS ==="
-    bash -c "$COMMAND"
+    (
+        if [ -n "$SCHEDULER_MAX_MEMORY_MB" ]; then ulimit -v $((SCHEDULER_MAX_MEMORY_MB * 1024)); fi
+        if [ -n "$SCHEDULER_CPU_SECONDS" ]; then ulimit -t "$SCHEDULER_CPU_SECONDS"; fi
+        exec "${LIMITED[@]}" bash -c "$COMMAND"
+    ) 9>&-
     EXIT_CODE=$?
     echo "=== END $(date '+%Y-%m-%d %H:%M:%S') exit_code=$EXIT_CODE ==="
 } > "$TMPLOG" 2>&1
@@ -35,18 +113,23 @@ DURATION=$((END_EPOCH - START_EPOCH))
 # Append to per-job log file
 cat "$TMPLOG" >> "$LOG_FILE"
 
+# Keep a per-run copy of a cron run's output for the API's log endpoints
+# (API runs already have one)
+if [ -z "$SCHEDULER_RUN_ID" ] && [ -n "$RUN_ID" ] && [ -d "$RUN_LOGS_DIR" ]; then
+    cp "$TMPLOG" "$RUN_LOGS_DIR/$RUN_ID.log" 2>/dev/null
+fi
+
 # Append to run log CSV
 if [ -n "$RUN_LOG" ]; then
     if [ ! -f "$RUN_LOG" ]; then
-        echo "timestamp,job_name,exit_code,duration_seconds" > "$RUN_LOG"
+        echo "timestamp,job_name,exit_code,duration_seconds,run_id,start_epoch" > "$RUN_LOG"
     fi
-    echo "$START_TS,$JOB_NAME,$EXIT_CODE,$DURATION" >> "$RUN_LOG"
+    echo "$START_TS,$JOB_NAME,$EXIT_CODE,$DURATION,$RUN_ID,$START_EPOCH" >> "$RUN_LOG"
 fi
 
-# Send log output and report exit status to Healthchecks
+# Report exit status to Healthchecks, with the log output as the ping body
 if [ -n "$HC_PING_URL" ] && [ -n "$HC_PING_KEY" ] && [ -n "$HC_PING_SLUG" ]; then
-    curl -sfm 10 --data-binary @"$TMPLOG" "${HC_PING_URL}/${HC_PING_KEY}/${HC_PING_SLUG}/log" > /dev/null 2>&1
-    curl -sfm 10 "${HC_PING_URL}/${HC_PING_KEY}/${HC_PING_SLUG}/${EXIT_CODE}" > /dev/null 2>&1
+    hc_ping "$EXIT_CODE" "$TMPLOG"
 fi
 
 rm -f "$TMPLOG"
\ No newline at end of file